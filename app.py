@@ -1,25 +1,18 @@
-import streamlit as st
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
-import pandas as pd
-import time
 import os
-import shutil
-import subprocess
-from io import BytesIO, StringIO
-
-# Try importing webdriver_manager for local compatibility
-try:
-    from webdriver_manager.chrome import ChromeDriverManager
-    from webdriver_manager.core.os_manager import ChromeType
-    HAS_WDM = True
-except ImportError:
-    HAS_WDM = False
+import time
+
+import streamlit as st
+
+from captcha_solver import LABEL_DIR, MANUAL, LabelStore, load_solver, solver_stats, train_model
+from driver_discovery import discover, launch_driver
+from driver_pool import DriverPool, PoolExhausted
+from driver_profiles import DEFAULT_PROFILE, apply_profile, build_options
+from extractors import ENGINES, QUERY_TYPES, ZONES, PERIODS, HttpExtractor, SeleniumExtractor
+from instrumentation import METRICS, start_metrics_server
+from jobs import RETRYABLE_STATUSES, JobExecutor
+from resilience import MAX_RETRIES, ZONE_BREAKER, CLOSED, CircuitOpen
+# Batch, history, result views and exports (pandas, pyarrow, DuckDB) are imported
+# where they are first used, so the first page load doesn't wait for them
 
 # Page Config
 st.set_page_config(page_title="FOIS Data Extractor", page_icon="🚆", layout="wide")
@@ -30,64 +23,22 @@ This tool automates data extraction from the [FOIS Website](https://www.fois.ind
 **Instructions:**
 1. Configure your query (Type, Zone, Period).
 2. Click **Initialize & Load CAPTCHA**.
-3. Enter the CAPTCHA code shown in the screenshot.
+3. Enter the CAPTCHA code shown in the image.
 4. Click **Submit & Extract**.
 """)
 
 # --- Helper Functions ---
 
-def get_driver():
-    """Initializes and returns a headless Chrome driver with Cloud support."""
-    options = Options()
-    # options.add_argument("--headless") # Commented out for local debugging
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-features=VizDisplayCompositor")
-    options.add_argument("--disable-features=NetworkService")
-    options.add_argument("--window-size=1920,1080")
-    options.add_argument("--page-load-strategy=none") 
+def get_driver(headless=None, profile=None):
+    """Initializes and returns a Chrome driver for a launch profile, with Cloud support."""
+    options = build_options(profile, headless)
     
     try:
-        # Debug info
-        try:
-             res = subprocess.run(["chromium", "--version"], capture_output=True, text=True)
-             if res.returncode == 0:
-                 st.write(f"Chromium Version: {res.stdout.strip()}")
-        except:
-             pass
-
-        # 1. Streamlit Cloud (Linux) Strategy
-        if os.path.exists("/usr/bin/chromium") and os.path.exists("/usr/bin/chromedriver"):
-            options.binary_location = "/usr/bin/chromium"
+        # The binaries are looked up once and cached (driver_discovery.py)
+        if discover()["source"] == "system" and "--headless=new" not in options.arguments:
             options.add_argument("--headless=new") # Force headless in Cloud
-            service = Service("/usr/bin/chromedriver")
-            driver = webdriver.Chrome(service=service, options=options)
-        
-        # 2. Local Strategy (Windows/Mac) using WebDriver Manager
-        elif HAS_WDM:
-            st.toast("Using Webdriver Manager for Local Chrome...")
-            try:
-                driver_path = ChromeDriverManager().install()
-                # st.write(f"Debug: Driver found at {driver_path}")
-                service = Service(driver_path)
-                driver = webdriver.Chrome(service=service, options=options)
-            except Exception as e:
-                st.error(f"WDM Error: {e}")
-                # Fallback to default
-                driver = webdriver.Chrome(options=options)
-            
-        # 3. Fallback (PATH)
-        else:
-            driver = webdriver.Chrome(options=options)
-            
-        driver.set_page_load_timeout(600) 
-        driver.set_script_timeout(600)
-        
-        try:
-            driver.command_executor.set_timeout(600)
-        except:
-            pass
+        driver = launch_driver(options)
+        apply_profile(driver, profile)
             
     except Exception as e:
         st.error(f"Error initializing driver: {e}")
@@ -96,16 +47,501 @@ def get_driver():
         
     return driver
 
+@st.cache_resource
+def get_driver_pool():
+    """Process-wide pool of warm drivers, shared by every Streamlit session."""
+    return DriverPool(
+        lambda: get_driver(profile=DEFAULT_PROFILE),
+        size=int(os.environ.get("FOIS_POOL_SIZE", "2")),
+        max_size=int(os.environ.get("FOIS_POOL_MAX_SIZE", "4")),
+        max_uses=int(os.environ.get("FOIS_DRIVER_MAX_USES", "25")),
+    )
+
+def pooled_extractor(pool, timeout=60):
+    """A SeleniumExtractor on a leased driver; the lease lasts as long as the extractor."""
+    extractor = SeleniumExtractor(pool.checkout(timeout=timeout), release=pool.checkin)
+    pool.hold(extractor.driver, extractor)
+    return extractor
+
+def new_extractor(engine):
+    """Creates an extractor for the chosen engine; Selenium ones lease a pooled driver."""
+    if engine == "selenium":
+        return pooled_extractor(get_driver_pool())
+    return HttpExtractor()
+
+@st.cache_resource
+def get_result_cache():
+    """Shared on-disk cache of extracted results."""
+    from result_cache import ResultCache
+    return ResultCache()
+
+@st.cache_resource
+def get_history_store():
+    """The analytical history every fresh result is appended to; None if FOIS_HISTORY_DIR is empty."""
+    from history import HISTORY_DIR, HistoryStore
+    return HistoryStore(HISTORY_DIR) if HISTORY_DIR else None
+
+@st.cache_resource
+def get_metrics_server():
+    """Prometheus /metrics endpoint on FOIS_METRICS_PORT, started once per process."""
+    port = os.environ.get("FOIS_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+def show_performance():
+    """p50/p95 per phase over the recent queries of this process."""
+    with st.sidebar.expander("📈 Performance"):
+        phases = METRICS.percentiles("fois_phase_seconds", by=("phase",))
+        if not phases:
+            st.caption("No queries yet.")
+            return
+        st.dataframe(phases, hide_index=True, use_container_width=True,
+                     column_config={"p50": st.column_config.NumberColumn(format="%.2f s"),
+                                    "p95": st.column_config.NumberColumn(format="%.2f s")})
+        st.caption(f"Server error rate: {METRICS.server_error_rate():.0%}")
+
+@st.cache_resource
+def get_captcha_solver():
+    """The trained offline CAPTCHA model, loaded once per process; None until one is trained."""
+    return load_solver()
+
+def suggest_captcha(image):
+    """The offline model's answer to a CAPTCHA, if it is confident enough."""
+    solver = get_captcha_solver()
+    if solver is None:
+        return None
+    try:
+        return solver(image)
+    except Exception:
+        return None
+
+def show_captcha_solver():
+    """Solver accuracy and latency, and training of the offline model from collected labels."""
+    with st.sidebar.expander("🔤 CAPTCHA Solver"):
+        rows = solver_stats()
+        if rows:
+            st.dataframe(rows, hide_index=True, use_container_width=True,
+                         column_config={"accuracy": st.column_config.NumberColumn(format="percent"),
+                                        "p50_ms": st.column_config.NumberColumn("p50", format="%.1f ms")})
+        labelled = len(LabelStore(LABEL_DIR)) if LABEL_DIR else 0
+        st.caption(f"{labelled} labelled CAPTCHAs collected; offline model "
+                   f"{'loaded' if get_captcha_solver() is not None else 'not trained yet'}.")
+        if labelled and st.button("Train offline model"):
+            with st.spinner("Training..."):
+                try:
+                    report = train_model(LABEL_DIR)
+                except ValueError as e:
+                    st.error(str(e))
+                    return
+            get_captcha_solver.clear()
+            if report["holdout"]:
+                st.success(f"Holdout accuracy {report['accuracy']:.0%}, confident on {report['answered']:.0%}, "
+                           f"{report['solve_ms']:.1f} ms per CAPTCHA.")
+            else:
+                st.success(f"Trained on {report['samples']} CAPTCHAs.")
+
+def show_portal_health(zone=None):
+    """Circuit breaker state of the zones FOIS has recently failed for."""
+    states = ZONE_BREAKER.states()
+    with st.sidebar.expander("🔌 Portal Health", expanded=any(s["state"] != CLOSED for s in states)):
+        if not states:
+            st.caption("No recent FOIS failures.")
+        else:
+            st.dataframe(states, hide_index=True, use_container_width=True,
+                         column_config={"retry_in_s": st.column_config.NumberColumn("retry in", format="%d s")})
+    if zone and ZONE_BREAKER.state(zone) != CLOSED:
+        st.warning(f"FOIS has been failing for zone {zone}; new queries are paused until it recovers.")
+
+@st.fragment
+def show_results(view, stem="fois_data", key="results"):
+    """Paginated, filterable preview and download of an extracted table.
+
+    Runs as a fragment, so filtering and paging rerun only this part of the
+    page, and only the visible page of rows is sent to the browser.
+    """
+    from export import FORMATS as EXPORT_FORMATS, export_bytes, file_name as export_file_name
+
+    st.write("### Data Preview")
+
+    with st.expander("Filter & Sort"):
+        filters = {}
+        filter_cols = st.columns(max(len(view.filter_columns), 1))
+        for col, (kind, column) in zip(filter_cols, view.filter_columns.items()):
+            with col:
+                filters[column] = st.multiselect(f"{kind.title()}:", view.options(column), key=f"{key}_{kind}")
+
+        date_column, date_range = None, None
+        if view.date_columns:
+            col_date_col, col_dates = st.columns([1, 2])
+            date_column = col_date_col.selectbox("Date column:", view.date_columns, key=f"{key}_date_column")
+            bounds = view.date_bounds(date_column)
+            if bounds:
+                dates = col_dates.date_input("Date range:", value=bounds, min_value=bounds[0], max_value=bounds[1],
+                                             key=f"{key}_dates_{date_column}")
+                # Mid-selection the widget holds only the start date
+                if len(dates) == 2 and tuple(dates) != bounds:
+                    date_range = tuple(dates)
+
+        col_sort, col_order = st.columns([2, 1])
+        sort_by = col_sort.selectbox("Sort by:", view.columns, index=None, placeholder="Original order",
+                                     key=f"{key}_sort")
+        descending = col_order.checkbox("Descending", key=f"{key}_descending")
+
+    selection = view.select(filters, date_column, date_range, sort_by, descending)
+
+    col_size, col_page, col_info = st.columns([1, 1, 2])
+    page_size = col_size.selectbox("Rows per page:", [50, 100, 500, 1000], index=1, key=f"{key}_page_size")
+    pages = selection.page_count(page_size)
+    # Filters can shrink the selection below the current page
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = 1
+    page = col_page.number_input("Page:", min_value=1, max_value=pages, step=1, key=f"{key}_page")
+    first = (page - 1) * page_size
+    with col_info:
+        st.write("") # Spacer
+        st.caption(f"Rows {min(first + 1, selection.num_rows)}–{min(first + page_size, selection.num_rows)} "
+                   f"of {selection.num_rows:,}" + (f" (filtered from {view.num_rows:,})"
+                                                   if selection.num_rows != view.num_rows else ""))
+    st.dataframe(selection.page(page, page_size), use_container_width=True, hide_index=True)
+
+    # Download of the filtered rows; the file is only generated when the button is clicked
+    col_fmt, col_dl = st.columns([1, 1])
+    with col_fmt:
+        fmt = st.selectbox("Download Format:", list(EXPORT_FORMATS), key=f"{key}_format",
+                           format_func=lambda f: EXPORT_FORMATS[f]["label"])
+    with col_dl:
+        st.write("") # Spacer
+        st.download_button(
+            label="📥 Download File",
+            data=lambda: export_bytes(selection.to_pandas(), fmt),
+            file_name=export_file_name(stem, fmt),
+            mime=EXPORT_FORMATS[fmt]["mime"],
+            type="primary",
+            key=f"{key}_download"
+        )
+
+def extractor_factory(engine):
+    """Returns a factory for batch workers; the pool is looked up here, on the script thread."""
+    if engine == "selenium":
+        pool = get_driver_pool()
+        return lambda: pooled_extractor(pool, timeout=600)
+    return HttpExtractor
+
+@st.cache_resource
+def get_job_executor():
+    """Thread pool running the extractions of every session, off the script threads."""
+    cache = get_result_cache()
+    history = get_history_store()
+
+    def store(job):
+        query = job.query
+        cache.put(query["query"], query["zone"], query.get("period"), job.df)
+        if history is not None:
+            history.append(job.df, query["query"], query["zone"], query.get("period"))
+
+    return JobExecutor(on_result=store)
+
+@st.fragment(run_every=1)
+def show_job(job_id):
+    """Live status of a running extraction, with the rows parsed so far."""
+    job = get_job_executor().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.info(f"⏳ {job.label}: {job.phase or job.status} · {job.elapsed():.0f}s · {job.rows} rows so far")
+    preview = job.preview()
+    if preview is not None and len(preview):
+        st.dataframe(preview, use_container_width=True, hide_index=True)
+    if st.button("Cancel", key=f"cancel_{job_id}", disabled=job.status == "cancelling"):
+        get_job_executor().cancel(job_id)
+
+def finish_job(job):
+    """Shows the outcome of this session's extraction job; FOIS failures get a new CAPTCHA."""
+    from result_view import ResultView
+
+    executor = get_job_executor()
+    st.session_state.active_job = None
+    for warning in job.warnings:
+        st.warning(warning)
+
+    if job.status == "done":
+        st.session_state.retry_notice = None
+        st.success(f"Success! Extracted {job.rows} rows.")
+        st.caption("Timings: " + " · ".join(f"{k} {v:.2f}s" for k, v in job.timings.items()))
+        st.session_state.result_view = ResultView(job.df)
+    elif job.status == "no data":
+        st.session_state.retry_notice = None
+        st.error("No data found.")
+    elif job.status == "cancelled":
+        st.info("Extraction cancelled.")
+    elif job.status in RETRYABLE_STATUSES and (job.extractor is None or job.captcha_image is None):
+        # Out of retries, or no new CAPTCHA could be loaded
+        st.error(job.error)
+    elif job.status in RETRYABLE_STATUSES:
+        # The job already loaded the new CAPTCHA in the same session (after a backoff for a server error)
+        st.session_state.extractor = executor.take_extractor(job.id)
+        st.session_state.driver_active = True
+        st.session_state.captcha_image = job.captcha_image
+        st.session_state.captcha_suggestion = suggest_captcha(job.captcha_image)
+        if job.status == "captcha rejected":
+            st.session_state.retry_notice = "FOIS rejected the CAPTCHA. Please enter the new one."
+        else:
+            st.session_state.retry_attempt = job.retries
+            st.session_state.retry_notice = (f"FOIS could not process the query (retry {job.retries}/{MAX_RETRIES}). "
+                                             "Please enter the new CAPTCHA.")
+    else:
+        st.error(f"Execution Error: {job.error}")
+
+@st.fragment(run_every=2)
+def show_jobs():
+    """This session's extraction jobs; finished results can be reopened."""
+    if not st.session_state.job_ids:
+        return
+    jobs = get_job_executor().jobs(st.session_state.job_ids)
+    if not jobs:
+        return
+    with st.expander(f"Extraction jobs ({sum(not job.done for job in jobs)} running)"):
+        st.dataframe([job.summary() for job in jobs], use_container_width=True, hide_index=True)
+        finished = {f"{job.id} · {job.label} · {job.rows} rows": job for job in jobs if job.df is not None}
+        if finished:
+            col_pick, col_show = st.columns([3, 1])
+            picked = col_pick.selectbox("Result:", list(finished), label_visibility="collapsed")
+            if col_show.button("Show"):
+                from result_view import ResultView
+                st.session_state.result_view = ResultView(finished[picked].df)
+                st.rerun()
+
+def release_extractor(broken=False):
+    """Closes this session's extractor, returning its driver to the pool."""
+    if st.session_state.extractor:
+        st.session_state.extractor.close(broken=broken)
+        st.session_state.extractor = None
+    st.session_state.driver_active = False
+
 # --- Session State Management ---
 
 if 'driver_active' not in st.session_state:
     st.session_state.driver_active = False
 
-if 'driver' not in st.session_state:
-    st.session_state.driver = None
+if 'extractor' not in st.session_state:
+    st.session_state.extractor = None
+
+if 'cached_result' not in st.session_state:
+    st.session_state.cached_result = None
+
+# The last extracted table, kept across reruns as an Arrow-backed view
+if 'result_view' not in st.session_state:
+    st.session_state.result_view = None
+
+# Retries of the current query after FOIS answered "unable to process"
+if 'retry_attempt' not in st.session_state:
+    st.session_state.retry_attempt = 0
+    st.session_state.retry_notice = None
+
+# The offline model's answer to the CAPTCHA on screen, pre-filled for the operator
+if 'captcha_suggestion' not in st.session_state:
+    st.session_state.captcha_suggestion = None
+
+# Background extraction jobs of this session; active_job is the one started from the form
+if 'job_ids' not in st.session_state:
+    st.session_state.job_ids = []
+    st.session_state.active_job = None
+
+if 'batch' not in st.session_state:
+    st.session_state.batch = None
+    st.session_state.batch_captcha = None
+    st.session_state.batch_view = None
+
+# --- Batch Mode ---
+
+@st.fragment(run_every=2)
+def batch_progress():
+    """Polls the running batch and shows the next CAPTCHA to solve."""
+    from batch import ACTIVE_STATUSES
+
+    run = st.session_state.batch
+    if run.done:
+        st.rerun()
+
+    counts = run.progress()
+    finished = len(run.jobs) - sum(counts.get(k, 0) for k in ACTIVE_STATUSES)
+    st.progress(finished / len(run.jobs), text=", ".join(f"{v} {k}" for k, v in counts.items()))
+
+    held = st.session_state.batch_captcha
+    if held is None or held.expired:
+        st.session_state.batch_captcha = run.next_captcha()
+    request = st.session_state.batch_captcha
+    if request is not None:
+        st.image(request.image, caption=f"CAPTCHA for {request.job.label}")
+        with st.form("batch_captcha_form", clear_on_submit=True):
+            answer = st.text_input("Enter CAPTCHA:", placeholder="Type code from image")
+            col_ok, col_skip = st.columns([1, 1])
+            solved = col_ok.form_submit_button("Submit")
+            skipped = col_skip.form_submit_button("Skip Job")
+        if solved and answer:
+            request.solve(answer)
+        elif skipped:
+            request.skip()
+        if (solved and answer) or skipped:
+            st.session_state.batch_captcha = None
+            st.rerun()
+    else:
+        st.info("Waiting for the next CAPTCHA...")
+
+    st.dataframe(run.summary(), use_container_width=True, hide_index=True)
+    if st.button("Cancel Batch"):
+        run.cancel()
+        st.session_state.batch_captcha = None
+
+def render_batch(engine):
+    from batch import DEFAULT_WORKERS, BatchRun, build_jobs
+    from result_view import ResultView
+
+    st.subheader("Batch Extraction")
+    run = st.session_state.batch
+
+    if run is None or run.done:
+        with st.form("batch_form"):
+            zones = st.multiselect("Zones:", ZONES, default=ZONES)
+            queries = st.multiselect("Query Types:", list(QUERY_TYPES), default=list(QUERY_TYPES)[:1])
+            periods = st.multiselect("Periods (Matured Indents only):", PERIODS, default=PERIODS[:1])
+            workers = st.slider("Concurrent sessions:", 1, 8, int(os.environ.get("FOIS_BATCH_WORKERS", DEFAULT_WORKERS)),
+                                help="Upper bound on parallel queries sent to the FOIS portal.")
+            force_refresh = st.checkbox("Force refresh (ignore cached results)")
+            auto_solve = st.checkbox("Solve CAPTCHAs automatically", value=get_captcha_solver() is not None,
+                                     disabled=get_captcha_solver() is None,
+                                     help="Uses the offline model; CAPTCHAs it is unsure about are shown here.")
+            start = st.form_submit_button("Start Batch", type="primary")
+        if start and zones and queries:
+            jobs = build_jobs([QUERY_TYPES[q] for q in queries], zones, periods)
+            st.session_state.batch = BatchRun(jobs, extractor_factory(engine), max_workers=workers,
+                                              cache=None if force_refresh else get_result_cache(),
+                                              solver=get_captcha_solver() if auto_solve else None,
+                                              history=get_history_store()).start()
+            st.session_state.batch_captcha = None
+            st.session_state.batch_view = None
+            st.rerun()
+
+    if run is None:
+        return
+    if not run.done:
+        batch_progress()
+        return
+
+    st.write("### Batch Summary")
+    st.dataframe(run.summary(), use_container_width=True, hide_index=True)
+    if st.session_state.batch_view is None:
+        merged = run.results()
+        if merged is None:
+            st.error("No data extracted.")
+            return
+        st.session_state.batch_view = ResultView(merged)
+    view = st.session_state.batch_view
+
+    st.success(f"Extracted {view.num_rows} rows from {len(view.options('zone'))} zone(s) "
+               f"in {run.finished_at - run.started_at:.0f}s.")
+    show_results(view, stem="fois_batch", key="batch")
+
+# --- History Mode ---
+
+HISTORY_ANALYSES = {
+    "Counts (latest capture)": "counts",
+    "Ageing (latest capture)": "ageing",
+    "Trend over time": "trend",
+    "Outstanding ODRs/indents": "outstanding",
+}
+HISTORY_GROUPS = ["station", "commodity", "zone", "division", "wagon_type", "consignor", "query_type"]
+HISTORY_WINDOWS = {"Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All": None}
+
+def render_history():
+    st.subheader("History")
+    store = get_history_store()
+    if store is None:
+        st.info("The history is disabled (FOIS_HISTORY_DIR is empty).")
+        return
+    stats = store.stats()
+    if not stats["files"]:
+        st.info("No extractions recorded yet; every successful query is added here.")
+        return
+    col_stats, col_compact = st.columns([3, 1])
+    col_stats.caption(f"{stats['files']} files over {stats['months']} month(s), {stats['bytes'] / 1e6:.1f} MB.")
+    if col_compact.button("Compact", help="Merge each month's files per zone into one; queries get faster."):
+        with st.spinner("Compacting..."):
+            merged = store.compact()
+        st.toast(f"Merged {merged} files.")
+
+    with st.form("history_form"):
+        col_a, col_b = st.columns([1, 1])
+        analysis = col_a.selectbox("Analysis:", list(HISTORY_ANALYSES))
+        window = col_b.selectbox("Captured:", list(HISTORY_WINDOWS), index=1)
+        by = st.multiselect("Group by:", HISTORY_GROUPS, default=["station"],
+                            help="Not used for outstanding ODRs/indents; trend also accepts none.")
+        col_z, col_q = st.columns([1, 1])
+        zones = col_z.multiselect("Zones:", ZONES)
+        query_label = col_q.selectbox("Query type:", ["All"] + list(QUERY_TYPES))
+        col_s, col_c = st.columns([1, 1])
+        station = col_s.text_input("Station:").strip().upper() or None
+        commodity = col_c.text_input("Commodity:").strip().upper() or None
+        run = st.form_submit_button("Run", type="primary")
+    with st.expander("SQL"):
+        query = st.text_area("Query against the `history` view:",
+                             "SELECT zone, query_type, count(*) AS rows FROM history GROUP BY ALL ORDER BY ALL")
+        run_sql = st.button("Run SQL")
+
+    start = time.perf_counter()
+    try:
+        if run_sql:
+            result = store.sql(query, select_only=True)
+        elif run:
+            filters = dict(days=HISTORY_WINDOWS[window], zones=zones or None,
+                           query_type=QUERY_TYPES.get(query_label), station=station, commodity=commodity)
+            method = HISTORY_ANALYSES[analysis]
+            if method == "outstanding":
+                result = store.outstanding(**filters)
+            else:
+                result = getattr(store, method)(by=by, **filters)
+        else:
+            return
+    except Exception as e:
+        st.error(f"Query failed: {e}")
+        return
+    st.caption(f"{len(result)} rows in {time.perf_counter() - start:.2f}s")
+    if run and HISTORY_ANALYSES[analysis] == "trend" and len(result):
+        groups = [c for c in result.columns if c not in ("capture_date", "rows")]
+        if groups:
+            series = result[groups].astype(str).agg(" / ".join, axis=1)
+            chart = result.assign(group=series).pivot_table(index="capture_date", columns="group", values="rows",
+                                                            aggfunc="sum")
+        else:
+            chart = result.set_index("capture_date")["rows"]
+        st.line_chart(chart)
+    st.dataframe(result, use_container_width=True, hide_index=True)
 
 # --- UI Logic ---
 
+engine = st.sidebar.radio(
+    "Extraction Engine:",
+    options=list(ENGINES),
+    index=list(ENGINES).index(os.environ.get("FOIS_ENGINE", "selenium")),
+    help="'http' submits the FOIS form directly without starting a browser."
+)
+
+mode = st.sidebar.radio("Mode:", options=["Single Query", "Batch", "History"], index=0)
+
+get_metrics_server()
+show_performance()
+show_captcha_solver()
+
+# Hands this session's browser back to the pool; rendered before the modes so every mode has it
+if st.sidebar.button("Reset / Close Browser"):
+    release_extractor()
+    st.rerun()
+
+if mode == "Batch":
+    render_batch(engine)
+    st.stop()
+if mode == "History":
+    render_history()
+    st.stop()
+
 col1, col2 = st.columns([1, 1])
 
 with col1:
@@ -114,16 +550,14 @@ with col1:
     # Query Type
     query_type = st.radio(
         "Select Query Type:",
-        options=["Outstanding ODR(s)", "Matured Indents (Last 30 Days)"],
+        options=list(QUERY_TYPES),
         index=0
     )
     
     # Zone
-    zone_options = [
-        "CR", "DFCR", "EC", "ECO", "ER", "KR", "NC", "NE", "NF", 
-        "NPLR", "NR", "NW", "SC", "SE", "SEC", "SR", "SW", "WC", "WR"
-    ]
+    zone_options = ZONES
     selected_zone = st.selectbox("Select Zone:", zone_options, index=3) # Default ECO
+    show_portal_health(selected_zone)
     
     # Period (Conditional)
     selected_period_val = None
@@ -138,183 +572,97 @@ with col1:
 
     st.write("---")
 
-    if st.button("Initialize & Load CAPTCHA", type="primary"):
-        with st.spinner("Initializing Browser..."):
+    col_init, col_refresh = st.columns([2, 1])
+    initialize = col_init.button("Initialize & Load CAPTCHA", type="primary")
+    force_refresh = col_refresh.button("🔄 Force Refresh", help="Ignore cached results and query FOIS again.")
+    query_key = (QUERY_TYPES[query_type], selected_zone, selected_period_val)
+
+    # A fresh enough cached result skips the browser and the CAPTCHA entirely
+    cached = None
+    if initialize:
+        from result_view import ResultView
+        cached = get_result_cache().get(*query_key)
+        st.session_state.cached_result = cached
+        st.session_state.result_view = ResultView(cached.df) if cached is not None else None
+        if cached is not None:
+            st.session_state.driver_active = False
+
+    if (initialize and cached is None) or force_refresh:
+        st.session_state.cached_result = None
+        st.session_state.result_view = None
+        st.session_state.retry_attempt = 0
+        st.session_state.retry_notice = None
+        # A running job carries on in the background; it stays in the jobs list
+        st.session_state.active_job = None
+        with st.spinner("Loading FOIS form..."):
             try:
-                # Close existing
-                if st.session_state.driver:
-                    try:
-                        st.session_state.driver.quit()
-                    except:
-                        pass
-                    st.session_state.driver = None
-                
-                st.session_state.driver = get_driver()
-                driver = st.session_state.driver
-                
-                url = "https://www.fois.indianrail.gov.in/FOISWebPortal/pages/FWP_ODROtsgDtls.jsp"
-                driver.get(url)
-                
-                wait = WebDriverWait(driver, 15)
-                
-                # A. Select Query Type
-                try:
-                    if query_type == "Outstanding ODR(s)":
-                        selector = "input[value='ODR_RK_OTSG']"
-                    else:
-                        selector = "input[value='MATURED_INDENTS']"
-                    
-                    radio_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, selector)))
-                    if not radio_btn.is_selected():
-                        radio_btn.click()
-                        time.sleep(1)
-                except Exception as e:
-                    st.warning(f"Note: Could not select Query Type (might be default). Error: {e}")
-
-                # B. Select Zone
-                try:
-                    zone_dropdown = wait.until(EC.presence_of_element_located((By.TAG_NAME, "select")))
-                    select = Select(zone_dropdown)
-                    select.select_by_value(selected_zone)
-                except:
-                    try:
-                        select.select_by_visible_text(selected_zone)
-                    except Exception as e:
-                        st.error(f"Failed to select Zone {selected_zone}: {e}")
-
-                # C. Select Period
-                if selected_period_val:
-                    try:
-                        period_rad = driver.find_element(By.CSS_SELECTOR, f"input[name='Optn'][value='{selected_period_val}']")
-                        if not period_rad.is_selected():
-                            period_rad.click()
-                    except Exception as e:
-                        st.warning(f"Could not select Period: {e}")
-
-                # Screenshot
-                time.sleep(2)
-                screenshot = driver.get_screenshot_as_png()
-                st.session_state.captcha_image = screenshot
+                # Reuse this session's extractor if it is still usable, else start a new one
+                extractor = st.session_state.extractor
+                if extractor and (extractor.engine != engine or
+                                  (engine == "selenium" and not get_driver_pool().is_healthy(extractor.driver))):
+                    release_extractor(broken=extractor.engine == engine)
+                if not st.session_state.extractor:
+                    st.session_state.extractor = new_extractor(engine)
+                extractor = st.session_state.extractor
+
+                st.session_state.captcha_image = extractor.load(*query_key)
+                st.session_state.captcha_suggestion = suggest_captcha(st.session_state.captcha_image)
+                st.session_state.query_key = query_key
+                for warning in extractor.warnings:
+                    st.warning(warning)
                 st.session_state.driver_active = True
                 st.success("Page Loaded!")
                 
+            except (PoolExhausted, CircuitOpen) as e:
+                st.error(f"Initialization Error: {e}")
             except Exception as e:
                 st.error(f"Initialization Error: {e}")
-                if st.session_state.driver:
-                    st.session_state.driver.quit()
-                    st.session_state.driver = None
+                release_extractor(broken=True)
 
 with col2:
     st.subheader("2. Action")
-    if st.session_state.driver_active and 'captcha_image' in st.session_state:
-        st.image(st.session_state.captcha_image, caption="Current Page Screenshot", use_container_width=True)
+    job = get_job_executor().get(st.session_state.active_job) if st.session_state.active_job else None
+    if job is not None and job.done:
+        finish_job(job)
+        job = None
+
+    if job is not None:
+        show_job(job.id)
+    elif st.session_state.cached_result is not None:
+        cached = st.session_state.cached_result
+        st.info(f"⚡ Served from cache, age {cached.age_text()}. Use **Force Refresh** for live data.")
+    elif st.session_state.driver_active and 'captcha_image' in st.session_state:
+        if st.session_state.retry_notice:
+            st.warning(st.session_state.retry_notice)
+        st.image(st.session_state.captcha_image, caption="CAPTCHA")
+        suggestion = st.session_state.captcha_suggestion
+        if suggestion:
+            st.caption("🤖 Filled in by the offline model; check it before submitting.")
         
-        with st.form("captcha_form"):
+        with st.form("captcha_form", clear_on_submit=True):
             col_caps, col_sub = st.columns([2, 1])
             with col_caps:
-                captcha_text = st.text_input("Enter CAPTCHA:", placeholder="Type code from image")
+                captcha_text = st.text_input("Enter CAPTCHA:", value=suggestion or "", placeholder="Type code from image")
             with col_sub:
                 st.write("") # Spacer
                 st.write("")
                 submit_button = st.form_submit_button("Submit & Extract")
             
         if submit_button and captcha_text:
-            driver = st.session_state.driver
-            if not driver:
+            extractor = st.session_state.extractor
+            if not extractor:
                 st.error("Browser session lost.")
             else:
-                with st.spinner("Extracting data..."):
-                    try:
-                        # 1. Enter CAPTCHA
-                        try:
-                            try:
-                                captcha_box = driver.find_element(By.ID, "txtCaptcha")
-                            except:
-                                captcha_box = driver.find_element(By.NAME, "txtCaptcha")
-                            captcha_box.clear()
-                            captcha_box.send_keys(captcha_text)
-                        except:
-                            inputs = driver.find_elements(By.CSS_SELECTOR, "input[type='text']")
-                            if inputs:
-                                inputs[-1].send_keys(captcha_text)
-                        
-                        # 2. Click Submit
-                        try:
-                            submit_btn = driver.find_element(By.XPATH, "//input[@type='button' and @value='Submit'] | //button[text()='Submit']")
-                            submit_btn.click()
-                        except:
-                            driver.execute_script("arguments[0].click();", submit_btn)
-
-                        # 3. Wait & Extract
-                        time.sleep(5) # Valid wait for server to start processing
-                        
-                        # Define wait (fix for NameError)
-                        wait = WebDriverWait(driver, 300)
-
-                        if "WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY" in driver.page_source:
-                            st.error("FOIS Server Error: Unable to process request. Please try again.")
-                        else:
-                            try:
-                                # Switch to iframe
-                                wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "frmDtls")))
-                                
-                                # Use JS to get content (faster/safer than page_source)
-                                # Wait for table to be present inside iframe
-                                try:
-                                    wait.until(
-                                        EC.presence_of_element_located((By.TAG_NAME, "table"))
-                                    )
-                                except:
-                                    st.warning("Table might not have loaded fully, attempting extraction anyway...")
-
-                                html_content = driver.execute_script("return document.body.innerHTML;")
-                                
-                                dfs = pd.read_html(StringIO(html_content))
-                                target_df = None
-                                max_rows = 0
-                                for df in dfs:
-                                    if df.shape[0] > max_rows:
-                                        max_rows = df.shape[0]
-                                        target_df = df
-                                
-                                if target_df is not None:
-                                    st.success(f"Success! Extracted {target_df.shape[0]} rows.")
-                                    
-                                    # Clean Columns
-                                    try:
-                                        target_df.columns = [' '.join(map(str, col)).strip() if isinstance(col, tuple) else col for col in target_df.columns]
-                                    except:
-                                        pass
-                                    
-                                    # Preview Data (User Request)
-                                    st.write("### Data Preview")
-                                    st.dataframe(target_df.head(50), use_container_width=True)
-
-                                    # Excel Download
-                                    output = BytesIO()
-                                    target_df.to_excel(output, index=False)
-                                    output.seek(0)
-                                    
-                                    st.download_button(
-                                        label="📥 Download Excel File",
-                                        data=output,
-                                        file_name="fois_data.xlsx",
-                                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                        type="primary"
-                                    )
-                                else:
-                                    st.error("No data found. Check CAPTCHA.")
-                                
-                                driver.switch_to.default_content()
-                            except Exception as e:
-                                st.error(f"Extraction Error (Iframe): {e}")
-
-                    except Exception as e:
-                        st.error(f"Execution Error: {e}")
+                solver = "offline" if suggestion and captcha_text == suggestion else MANUAL
+                # The job owns the extractor from here on; Initialize starts a new one meanwhile
+                job_id = get_job_executor().submit(extractor, captcha_text, solver=solver,
+                                                   retries=st.session_state.retry_attempt)
+                st.session_state.extractor = None
+                st.session_state.driver_active = False
+                st.session_state.active_job = job_id
+                st.session_state.job_ids.append(job_id)
+                st.rerun()
 
-if st.sidebar.button("Reset / Close Browser"):
-    if st.session_state.driver:
-        st.session_state.driver.quit()
-        st.session_state.driver = None
-    st.session_state.driver_active = False
-    st.rerun()
+    show_jobs()
+    if st.session_state.result_view is not None:
+        show_results(st.session_state.result_view)
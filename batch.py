@@ -0,0 +1,361 @@
+"""Fans one query out over many zones, query types and periods.
+
+Jobs run on a bounded pool of worker threads, each with its own extractor.
+Every job loads the form, queues its CAPTCHA for the operator and waits for
+the answer while the other jobs keep loading or fetching, so the operator
+solves CAPTCHAs back to back instead of waiting on each page load.
+
+When FOIS answers "unable to process", the job backs off and asks for a new
+CAPTCHA in the same session, up to ``max_retries`` times. Jobs for a zone
+whose circuit breaker is open fail fast with status "circuit open".
+
+With a ``solver`` (see captcha_solver), CAPTCHAs are first offered to it and
+only those it is unsure about are queued for the operator. A rejected answer
+gets a fresh CAPTCHA, up to CAPTCHA_ATTEMPTS answers per job; these don't
+count against ``max_retries``. A CAPTCHA the operator doesn't answer within
+``captcha_timeout`` expires and its job is skipped.
+"""
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from captcha_solver import MANUAL
+from extractors import CaptchaRejected, FoisServerError
+from readiness import QueryCancelled
+from resilience import MAX_RETRIES, CircuitOpen
+
+DEFAULT_WORKERS = 4
+CAPTCHA_ATTEMPTS = 3
+
+# Statuses of jobs that have not finished yet
+ACTIVE_STATUSES = ("pending", "loading", "awaiting captcha", "fetching", "retrying")
+
+
+class BatchJob:
+    """One (query type, zone, period) query and what happened to it."""
+
+    def __init__(self, query_type, zone, period=None):
+        self.query_type = query_type
+        self.zone = zone
+        self.period = period
+
+        self.status = "pending"
+        self.error = None
+        self.df = None
+        # CAPTCHAs answered, and new CAPTCHAs asked for after FOIS server errors
+        self.attempts = 0
+        self.retries = 0
+        # Who answered the last CAPTCHA: "manual" or a solver's name
+        self.solver = None
+        self.timings = {}
+
+    @property
+    def label(self):
+        parts = [self.zone, self.query_type] + ([self.period] if self.period else [])
+        return "/".join(parts)
+
+    @property
+    def rows(self):
+        return 0 if self.df is None else len(self.df)
+
+    def summary(self):
+        return {
+            "zone": self.zone,
+            "query": self.query_type,
+            "period": self.period,
+            "status": self.status,
+            "rows": self.rows,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "solver": self.solver,
+            "error": self.error,
+            **{f"{phase}_s": round(seconds, 2) for phase, seconds in self.timings.items()},
+        }
+
+
+class CaptchaRequest:
+    """A CAPTCHA waiting for the operator; the worker blocks until it is answered.
+
+    A request nobody answered within the worker's timeout is ``expired``:
+    its job has moved on, so answers to it are ignored and
+    BatchRun.next_captcha() no longer hands it out.
+    """
+
+    def __init__(self, job, image):
+        self.job = job
+        self.image = image
+        self.answer = None
+        self.solver = MANUAL
+        self.expired = False
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def solve(self, text, solver=MANUAL):
+        with self._lock:
+            if self.expired:
+                return
+            self.answer = text
+            self.solver = solver
+            self._event.set()
+
+    def skip(self):
+        with self._lock:
+            self.answer = None
+            self._event.set()
+
+    def wait(self, timeout=None):
+        if not self._event.wait(timeout):
+            with self._lock:
+                # An answer may have come in just as the wait timed out
+                if not self._event.is_set():
+                    self.expired = True
+                    self._event.set()
+        return self.answer
+
+
+def build_jobs(query_types, zones, periods=None):
+    """Expands query types x zones x periods; periods only apply to matured indents."""
+    jobs = []
+    for query_type, zone in itertools.product(query_types, zones):
+        if query_type == "MATURED_INDENTS":
+            for period in periods or ["7"]:
+                jobs.append(BatchJob(query_type, zone, period))
+        else:
+            jobs.append(BatchJob(query_type, zone))
+    return jobs
+
+
+class BatchRun:
+    """Runs a list of BatchJobs concurrently.
+
+    ``extractor_factory`` is called once per job and must return a fresh
+    extractor; ``max_workers`` bounds both the open sessions and the load
+    put on the FOIS portal. With a ``cache`` (a ResultCache), jobs with a
+    fresh cached result skip the portal and fresh results are stored.
+    CAPTCHAs go to ``captchas``, a queue that may outlive the run.
+    A job that hits a FOIS server error is retried ``max_retries`` times.
+    ``solver`` is tried on every CAPTCHA before the operator.
+    Fresh results are also appended to ``history`` (a HistoryStore), if given.
+    """
+
+    def __init__(self, jobs, extractor_factory, max_workers=DEFAULT_WORKERS, captcha_timeout=900, cache=None,
+                 captchas=None, max_retries=MAX_RETRIES, solver=None, history=None):
+        self.jobs = list(jobs)
+        self.extractor_factory = extractor_factory
+        self.cache = cache
+        self.max_workers = max(1, max_workers)
+        self.captcha_timeout = captcha_timeout
+        self.max_retries = max(0, max_retries)
+        self.solver = solver
+        self.history = history
+
+        self.captchas = captchas if captchas is not None else queue.Queue()
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = threading.Event()
+        self._executor = None
+        self._futures = []
+        # Job -> extractor of the jobs running right now, so cancel() can stop them mid-fetch
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started_at = time.time()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fois-batch")
+        self._futures = [self._executor.submit(self._run_job, job) for job in self.jobs]
+        self._executor.shutdown(wait=False)
+        return self
+
+    def next_captcha(self, timeout=None):
+        """Returns the next CaptchaRequest to solve, or None if none is waiting; expired ones are dropped."""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            try:
+                if deadline is None:
+                    request = self.captchas.get_nowait()
+                else:
+                    request = self.captchas.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+            if not request.expired:
+                return request
+
+    @property
+    def done(self):
+        return bool(self._futures) and all(f.done() for f in self._futures)
+
+    def wait(self):
+        for future in self._futures:
+            future.result()
+        return self
+
+    def cancel(self):
+        """Stops the run: jobs not started yet are cancelled, running ones stop at their next wait or chunk."""
+        self._cancelled.set()
+        with self._lock:
+            active = list(self._active.values())
+        for extractor in active:
+            extractor.cancel()
+        # Unblock workers waiting on the operator; the queue may be shared, so other runs' CAPTCHAs go back
+        others = []
+        while True:
+            request = self.next_captcha()
+            if request is None:
+                break
+            if request.job in self.jobs:
+                request.skip()
+            else:
+                others.append(request)
+        for request in others:
+            self.captchas.put(request)
+
+    def progress(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def summary(self):
+        """Per-job status and timings as a DataFrame."""
+        return pd.DataFrame([job.summary() for job in self.jobs])
+
+    def results(self):
+        """All successful results merged into one DataFrame with zone/query/period columns."""
+        frames = []
+        for job in self.jobs:
+            if job.df is None or job.df.empty:
+                continue
+            df = job.df.copy()
+            df.insert(0, "period", job.period)
+            df.insert(0, "query", job.query_type)
+            df.insert(0, "zone", job.zone)
+            frames.append(df)
+        if not frames:
+            return None
+
+        merged = pd.concat(frames, ignore_index=True, sort=False)
+        # Categoricals with different categories come out of concat as object
+        for col in {c for df in frames for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)}:
+            merged[col] = merged[col].astype("category")
+        for col in ("zone", "query", "period"):
+            merged[col] = merged[col].astype("category")
+        return merged
+
+    def _run_job(self, job):
+        extractor = None
+        broken = False
+        start = time.perf_counter()
+        try:
+            if self._cancelled.is_set():
+                job.status = "cancelled"
+                return
+            cached = self.cache.get(job.query_type, job.zone, job.period) if self.cache else None
+            if cached is not None:
+                job.df = cached.df
+                job.status = "cached"
+                return
+
+            job.status = "loading"
+            extractor = self.extractor_factory()
+            with self._lock:
+                self._active[job] = extractor
+            if self._cancelled.is_set():
+                job.status = "cancelled"
+                return
+            image = extractor.load(job.query_type, job.zone, job.period)
+            job.timings["load"] = time.perf_counter() - start
+
+            rejected = 0
+            while True:
+                job.attempts += 1
+                job.status = "awaiting captcha"
+                mark = time.perf_counter()
+                answer, job.solver = self._solve(job, image)
+                job.timings["captcha_wait"] = job.timings.get("captcha_wait", 0.0) + time.perf_counter() - mark
+                if self._cancelled.is_set():
+                    job.status = "cancelled"
+                    return
+                if not answer:
+                    job.status = "skipped"
+                    return
+
+                job.status = "fetching"
+                mark = time.perf_counter()
+                try:
+                    job.df = extractor.extract(answer, solver=job.solver)
+                except CaptchaRejected as e:
+                    rejected += 1
+                    if rejected >= CAPTCHA_ATTEMPTS or self._cancelled.is_set():
+                        raise
+                    job.error = str(e)
+                    image = extractor.reload_captcha()
+                    continue
+                except FoisServerError as e:
+                    # Wrong CAPTCHAs don't count against the server-error retries
+                    if job.retries >= self.max_retries or self._cancelled.is_set():
+                        raise
+                    job.retries += 1
+                    job.error = str(e)
+                    job.status = "retrying"
+                    image = extractor.retry(job.retries)
+                    continue
+                job.timings["fetch"] = time.perf_counter() - mark
+                break
+            job.status = "done" if job.df is not None else "no data"
+            job.error = None
+            if self.cache and job.df is not None:
+                self.cache.put(job.query_type, job.zone, job.period, job.df)
+            if self.history is not None and job.df is not None:
+                try:
+                    self.history.append(job.df, job.query_type, job.zone, job.period)
+                except Exception as e:
+                    print(f"[{job.label}] Could not add the result to the history: {e}")
+        except FoisServerError as e:
+            job.status = "server error"
+            job.error = str(e)
+        except CircuitOpen as e:
+            job.status = "circuit open"
+            job.error = str(e)
+        except CaptchaRejected as e:
+            job.status = "captcha rejected"
+            job.error = str(e)
+        except QueryCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            broken = True
+        finally:
+            job.timings["total"] = time.perf_counter() - start
+            with self._lock:
+                self._active.pop(job, None)
+            if extractor is not None:
+                # Per-phase breakdown from the extractor (navigate, submit, first_byte, ...)
+                job.timings.update(extractor.timings)
+                extractor.close(broken=broken)
+            if all(j.status not in ACTIVE_STATUSES for j in self.jobs):
+                self.finished_at = time.time()
+
+    def _solve(self, job, image):
+        """The answer to a CAPTCHA and who gave it: the solver if it is sure, else the operator."""
+        if self.solver is not None:
+            try:
+                answer = self.solver(image, job)
+            except Exception as e:
+                print(f"[{job.label}] CAPTCHA solver failed: {e}")
+                answer = None
+            if answer:
+                return answer, getattr(self.solver, "name", "solver")
+        request = CaptchaRequest(job, image)
+        self.captchas.put(request)
+        if self._cancelled.is_set():
+            # cancel() may have drained the queue just before this request went in
+            request.skip()
+        answer = request.wait(self.captcha_timeout)
+        if request.expired:
+            print(f"[{job.label}] No CAPTCHA answer within {self.captcha_timeout}s; skipping.")
+        return answer, request.solver
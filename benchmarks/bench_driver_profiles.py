@@ -0,0 +1,152 @@
+"""Benchmark: Chrome launch profiles (driver_profiles.py) side by side.
+
+For each profile a browser is started and the FOIS form loaded ``--loads``
+times, waiting for the document and the CAPTCHA image each time. Reported
+per profile:
+
+    start       seconds to launch the browser
+    load p50    seconds from driver.get() to a usable form with its CAPTCHA
+    KB/load     bytes transferred per load (Resource Timing transferSize)
+    requests    resources fetched per load
+    RSS MB      resident memory of chromedriver and every browser process
+    captcha     whether the CAPTCHA image loaded in every run
+
+By default the form comes from fois_replay's synthetic server, which serves
+no stylesheets, fonts or pictures; point --url at the live portal (or a
+mirror of it) to see what the lean profile's resource blocking saves.
+RSS is read from /proc, so it is only reported on Linux.
+
+Usage:
+    python benchmarks/bench_driver_profiles.py [--profiles lean default] [--loads 5] [--url URL]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Bytes and requests of the current page, main document included
+_TRANSFER_JS = """
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+var bytes = 0;
+for (var i = 0; i < entries.length; i++) {
+    bytes += entries[i].transferSize || entries[i].encodedBodySize || 0;
+}
+return [bytes, entries.length];
+"""
+
+
+def _children():
+    """Parent pid -> child pids, from /proc."""
+    tree = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; the ppid follows the closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        tree.setdefault(ppid, []).append(int(entry))
+    return tree
+
+
+def tree_rss_mb(pid):
+    """Resident memory of ``pid`` and all of its descendants, or None off Linux."""
+    if not os.path.isdir("/proc"):
+        return None
+    tree, stack, total = _children(), [pid], 0
+    while stack:
+        current = stack.pop()
+        stack.extend(tree.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total / 1024
+
+
+def run_profile(profile, url, loads):
+    from extract_fois_data import setup_driver
+    from instrumentation import percentile
+    from readiness import ReadinessTimeout, wait_for_captcha, wait_for_document
+
+    start = time.perf_counter()
+    driver = setup_driver(profile)
+    started = time.perf_counter() - start
+    try:
+        times, transfers, requests, captcha_ok = [], [], [], True
+        for _ in range(loads):
+            driver.get("about:blank")
+            mark = time.perf_counter()
+            driver.get(url)
+            wait_for_document(driver, timeout=60)
+            try:
+                wait_for_captcha(driver, timeout=30)
+            except ReadinessTimeout:
+                captcha_ok = False
+            times.append(time.perf_counter() - mark)
+            size, count = driver.execute_script(_TRANSFER_JS)
+            transfers.append(size)
+            requests.append(count)
+        rss = tree_rss_mb(driver.service.process.pid)
+    finally:
+        driver.quit()
+    return {
+        "start_s": started,
+        "load_p50_s": percentile(times, 50),
+        "load_p95_s": percentile(times, 95),
+        "kb_per_load": sum(transfers) / len(transfers) / 1024,
+        "requests_per_load": sum(requests) / len(requests),
+        "rss_mb": rss,
+        "captcha_ok": captcha_ok,
+    }
+
+
+def main():
+    from driver_profiles import PROFILES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["lean", "default"], choices=list(PROFILES))
+    parser.add_argument("--loads", type=int, default=5, help="Form loads per profile")
+    parser.add_argument("--url", help="Form to load (default: the synthetic replay server)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        from fois_replay import start_server
+        server = start_server(None)
+        url = server.form_url
+
+    results = {}
+    try:
+        if not args.json:
+            print(f"{'profile':>8}{'start s':>9}{'load p50':>10}{'load p95':>10}{'KB/load':>9}"
+                  f"{'requests':>10}{'RSS MB':>8}  captcha")
+        for profile in args.profiles:
+            r = run_profile(profile, url, args.loads)
+            results[profile] = r
+            if not args.json:
+                rss = "n/a" if r["rss_mb"] is None else f"{r['rss_mb']:.0f}"
+                print(f"{profile:>8}{r['start_s']:>9.2f}{r['load_p50_s']:>10.2f}{r['load_p95_s']:>10.2f}"
+                      f"{r['kb_per_load']:>9.1f}{r['requests_per_load']:>10.1f}{rss:>8}  "
+                      f"{'ok' if r['captcha_ok'] else 'MISSING'}")
+    finally:
+        if server is not None:
+            server.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark: export time and peak memory per format on synthetic FOIS-shaped tables.
+
+"to_excel" is the old path (DataFrame.to_excel into a BytesIO); the others
+go through export.py. Each measurement runs in a fresh subprocess so peak
+RSS is per format.
+
+Usage:
+    python benchmarks/bench_export.py [--rows 10000 100000 1000000] [--formats xlsx csv ...]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_frame(rows, seed=0):
+    """A matured-indents-shaped table with typed columns, like fois_parser produces."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    stations = np.array(["".join(rng.choice(list("ABCDEFGHIJKLMNOPRSTUVW"), 4)) for _ in range(800)])
+    dates = pd.Timestamp("2024-01-31") - pd.to_timedelta(rng.integers(0, 60, rows), unit="D")
+    return pd.DataFrame({
+        "S.No": np.arange(1, rows + 1, dtype="int32"),
+        "Zone": pd.Categorical(rng.choice(["CR", "ECO", "NR", "SEC", "WR"], rows)),
+        "Division": pd.Categorical(rng.choice([f"DV{i}" for i in range(60)], rows)),
+        "Station": pd.Categorical(rng.choice(stations, rows)),
+        "Indent No": pd.Series(rng.integers(100000, 999999, rows)).map("IND{}".format),
+        "Indent Date": dates,
+        "Maturity Date": dates + pd.to_timedelta(rng.integers(1, 10, rows), unit="D"),
+        "Consignor": pd.Series(rng.choice(stations, rows)).map("M/S {} TRADERS".format),
+        "Commodity": pd.Categorical(rng.choice(["COAL", "IRON ORE", "CEMENT", "FOODGRAINS", "POL"], rows)),
+        "Wagon Type": pd.Categorical(rng.choice(["BOXN", "BCN", "BTPN", "BOST"], rows)),
+        "Wagons": rng.integers(1, 58, rows),
+    })
+
+
+def run_one(fmt, rows):
+    """Runs in the child process: exports once and prints timing and memory as JSON."""
+    from io import BytesIO
+    from export import export
+
+    df = synthetic_frame(rows)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        if fmt == "to_excel":
+            output = BytesIO()
+            df.to_excel(output, index=False)
+            size = output.getbuffer().nbytes
+        else:
+            path = os.path.join(tmp, "out")
+            export(df, path, fmt)
+            size = os.path.getsize(path)
+        elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": elapsed,
+        "delta_rss_mb": (peak_rss - base_rss) / 1024,
+        "size_mb": size / 1e6,
+    }))
+
+
+def measure(fmt, rows):
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", fmt, str(rows)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    from export import FORMATS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="*", default=[10000, 100000, 1000000])
+    parser.add_argument("--formats", nargs="*", default=["to_excel"] + list(FORMATS))
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(args.child[0], int(args.child[1]))
+        return
+
+    print(f"{'rows':>9}{'format':>10}{'seconds':>10}{'rows/s':>12}{'peak +MB':>10}{'file MB':>10}")
+    for rows in args.rows:
+        for fmt in args.formats:
+            r = measure(fmt, rows)
+            print(f"{rows:>9}{fmt:>10}{r['seconds']:>10.2f}{rows / r['seconds']:>12,.0f}"
+                  f"{r['delta_rss_mb']:>10.1f}{r['size_mb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
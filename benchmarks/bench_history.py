@@ -0,0 +1,92 @@
+"""Benchmark: aggregations over the extraction history (history.py).
+
+Builds a synthetic history of ``--days`` days, with ``--captures`` captures
+per day of every zone and query type, then times each analysis of the query
+API over the whole range. This is run once on the files as appended, and
+again after compact().
+
+Usage:
+    python benchmarks/bench_history.py [--days 90] [--zones 19] [--captures 2] [--rows 500]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fois_parser import parse_fois_table
+from fois_replay import ZONES, sample_results_html
+from history import HistoryStore
+
+QUERIES = [("ODR_RK_OTSG", None), ("MATURED_INDENTS", "7")]
+
+ANALYSES = {
+    "counts by station": lambda store: store.counts(by="station"),
+    "counts by zone/commodity": lambda store: store.counts(by=["zone", "commodity"]),
+    "ageing by station": lambda store: store.ageing(by="station"),
+    "trend by zone": lambda store: store.trend(by="zone"),
+    "outstanding (one zone)": lambda store: store.outstanding(zones=[ZONES[0]]),
+}
+
+
+def build(store, days, zones, captures, rows):
+    tables = {(q, z): parse_fois_table(sample_results_html(q, z, p, rows=rows)) for q, p in QUERIES for z in zones}
+    start = datetime(2024, 1, 1, 6)
+    for day in range(days):
+        for capture in range(captures):
+            when = start + timedelta(days=day, hours=capture * 12 // max(1, captures))
+            for query_type, period in QUERIES:
+                for zone in zones:
+                    store.append(tables[query_type, zone], query_type, zone, period, captured_at=when)
+
+
+def time_analyses(store, repeat=3):
+    results = {}
+    for name, analysis in ANALYSES.items():
+        best = float("inf")
+        for _ in range(repeat):
+            mark = time.perf_counter()
+            out = analysis(store)
+            best = min(best, time.perf_counter() - mark)
+        results[name] = (best, len(out))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--zones", type=int, default=len(ZONES), help="Number of zones")
+    parser.add_argument("--captures", type=int, default=2, help="Captures per zone and query type per day")
+    parser.add_argument("--rows", type=int, default=500, help="Rows per capture")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="fois_history_")
+    try:
+        store = HistoryStore(directory)
+        mark = time.perf_counter()
+        build(store, args.days, ZONES[:args.zones], args.captures, args.rows)
+        stats = store.stats()
+        rows = args.days * args.captures * len(QUERIES) * args.zones * args.rows
+        print(f"Appended {stats['files']} captures ({rows:,} rows, {stats['bytes'] / 1e6:.1f} MB) "
+              f"in {time.perf_counter() - mark:.1f}s")
+
+        appended = time_analyses(store)
+        mark = time.perf_counter()
+        store.compact(before=datetime.now().date())
+        print(f"Compacted to {store.stats()['files']} files in {time.perf_counter() - mark:.1f}s")
+        compacted = time_analyses(store)
+
+        print(f"{'analysis':<28}{'appended s':>12}{'compacted s':>13}{'rows':>8}")
+        for name in ANALYSES:
+            print(f"{name:<28}{appended[name][0]:>12.3f}{compacted[name][0]:>13.3f}{compacted[name][1]:>8}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
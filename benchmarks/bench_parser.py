@@ -0,0 +1,106 @@
+"""Benchmark: streaming fois_parser vs. the old pd.read_html + pick-largest path.
+
+Each run happens in a fresh subprocess so that peak RSS is measured per parser.
+
+Usage:
+    python benchmarks/bench_parser.py [--rows 10000 50000 100000] [--pages saved1.html ...]
+"""
+import argparse
+import importlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_read_html(path):
+    from io import StringIO
+    import pandas as pd
+    with open(path, encoding="utf-8") as f:
+        html = f.read()
+    dfs = pd.read_html(StringIO(html))
+    return max(dfs, key=lambda df: df.shape[0])
+
+
+def parse_streaming(path):
+    from fois_parser import parse_fois_table
+    with open(path, encoding="utf-8") as f:
+        return parse_fois_table(f)
+
+
+PARSERS = {
+    "read_html": parse_read_html,
+    "streaming": parse_streaming,
+}
+
+
+def run_one(parser, path):
+    """Runs in the child process: parses once and prints timing and memory as JSON."""
+    # Import cost is not part of the measurement
+    for module in ("pandas", "lxml.etree"):
+        importlib.import_module(module)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    df = PARSERS[parser](path)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": peak_rss / 1024,
+        "delta_rss_mb": (peak_rss - base_rss) / 1024,
+        "rows": int(df.shape[0]),
+        "frame_mb": df.memory_usage(deep=True).sum() / 1e6,
+    }))
+
+
+def measure(parser, path):
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", parser, path],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="*", default=[10000, 50000, 100000],
+                        help="Sizes of synthetic pages to generate")
+    parser.add_argument("--pages", nargs="*", default=[], help="Saved frmDtls HTML pages to parse")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(*args.child)
+        return
+
+    from fois_replay import sample_results_html
+
+    tmpdir = tempfile.mkdtemp(prefix="fois-bench-")
+    pages = list(args.pages)
+    for rows in args.rows:
+        path = os.path.join(tmpdir, f"synthetic_{rows}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(sample_results_html("MATURED_INDENTS", "NR", "30", rows=rows))
+        pages.append(path)
+
+    print(f"{'page':<28}{'MB':>8}{'parser':>12}{'rows':>9}{'seconds':>10}{'peak RSS MB':>13}{'delta MB':>10}{'frame MB':>10}")
+    for path in pages:
+        size_mb = os.path.getsize(path) / 1e6
+        results = {name: measure(name, path) for name in PARSERS}
+        for name, r in results.items():
+            print(f"{os.path.basename(path):<28}{size_mb:>8.1f}{name:>12}{r['rows']:>9}{r['seconds']:>10.2f}"
+                  f"{r['peak_rss_mb']:>13.1f}{r['delta_rss_mb']:>10.1f}{r['frame_mb']:>10.1f}")
+        old, new = results["read_html"], results["streaming"]
+        print(f"{'':<36}streaming is {old['seconds'] / new['seconds']:.1f}x faster, "
+              f"peak RSS {old['peak_rss_mb'] - new['peak_rss_mb']:.0f} MB lower, "
+              f"frame {old['frame_mb'] / new['frame_mb']:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
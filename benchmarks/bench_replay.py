@@ -0,0 +1,227 @@
+"""Benchmark suite: end-to-end queries against the offline FOIS stand-in.
+
+Starts fois_replay's ReplayServer (serving a recording directory, or
+synthetic pages) and, for each concurrency level, runs a batch of queries
+through HttpExtractor in a fresh subprocess, answering the CAPTCHAs
+automatically. Reported per level:
+
+    p50/p95     end-to-end latency of one query (load, submit, fetch, parse),
+                excluding the wait for the CAPTCHA answer
+    parse       time to parse one results page
+    export      time to export the merged table as xlsx and as parquet
+    peak RSS    of the client process
+    throughput  queries per second
+
+Runs can be stored as a baseline and later runs compared against it:
+
+    python benchmarks/bench_replay.py --save-baseline
+    python benchmarks/bench_replay.py --check        # exits with 1 on a regression
+
+Usage:
+    python benchmarks/bench_replay.py [--dir recordings] [--concurrency 1 2 4 8] [--queries 32]
+        [--rows 2000] [--delay 0.2] [--chunk-delay 0] [--error-rate 0]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Keys of a baseline that describe the machine it was taken on
+HOST_KEYS = ("machine", "cpu", "cpus", "python")
+CAPTCHA = "REPLAY"
+
+# Metric -> True when lower is better
+COMPARED = {
+    "p50_s": True,
+    "p95_s": True,
+    "parse_s": True,
+    "export_xlsx_s": True,
+    "export_parquet_s": True,
+    "peak_rss_mb": True,
+    "throughput_qps": False,
+}
+
+
+def run_one(form_url, concurrency, queries):
+    """Runs in the child process: one batch at one concurrency level, printed as JSON."""
+    from urllib.parse import urlsplit
+
+    import requests
+
+    from batch import BatchJob, BatchRun, build_jobs
+    from export import export_bytes
+    from extractors import ZONES, HttpExtractor
+    from fois_parser import parse_fois_table
+    from fois_replay import RESULTS_PATH
+    from instrumentation import percentile
+
+    combos = [(job.query_type, job.zone, job.period)
+              for job in build_jobs(["ODR_RK_OTSG", "MATURED_INDENTS"], ZONES, ["7"])]
+    jobs = [BatchJob(*combos[i % len(combos)]) for i in range(queries)]
+
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    run = BatchRun(jobs, lambda: HttpExtractor(form_url), max_workers=concurrency).start()
+    while not run.done:
+        request = run.next_captcha(timeout=0.05)
+        if request is not None:
+            request.solve(CAPTCHA)
+    run.wait()
+    wall = time.perf_counter() - start
+
+    latencies = [job.timings["total"] - job.timings.get("captcha_wait", 0.0) for job in run.jobs]
+    statuses = {}
+    for job in run.jobs:
+        statuses[job.status] = statuses.get(job.status, 0) + 1
+
+    # Parse time on its own; the http engine parses while it downloads
+    url = urlsplit(form_url)
+    pages = [
+        requests.get(f"{url.scheme}://{url.netloc}{RESULTS_PATH}", params={"q": q, "z": z, "p": p or ""}).text
+        for q, z, p in combos[:4]
+    ]
+    # Best of three, so the number is stable enough to compare against a baseline
+    parse = float("inf")
+    for _ in range(3):
+        mark = time.perf_counter()
+        for page in pages:
+            parse_fois_table(page)
+        parse = min(parse, (time.perf_counter() - mark) / len(pages))
+
+    merged = run.results()
+    exports = {}
+    for fmt in ("xlsx", "parquet"):
+        mark = time.perf_counter()
+        if merged is not None:
+            export_bytes(merged, fmt)
+        exports[fmt] = time.perf_counter() - mark
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "queries": queries,
+        "statuses": statuses,
+        "rows": 0 if merged is None else len(merged),
+        "wall_s": wall,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "parse_s": parse,
+        "export_xlsx_s": exports["xlsx"],
+        "export_parquet_s": exports["parquet"],
+        "peak_rss_mb": peak_rss / 1024,
+        "delta_rss_mb": (peak_rss - base_rss) / 1024,
+        "throughput_qps": queries / wall,
+    }))
+
+
+def measure(form_url, concurrency, queries):
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", form_url, str(concurrency), str(queries)],
+        capture_output=True, text=True, check=True,
+        # The stand-in accepts any answer; none of them are training labels
+        env=dict(os.environ, FOIS_CAPTCHA_LABELS=""),
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def host():
+    """The machine a run is taken on; timings only compare between runs on the same one."""
+    cpu = platform.processor()
+    if not cpu and os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo", encoding="utf-8") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), "")
+    return {"machine": platform.platform(), "cpu": cpu or platform.machine(), "cpus": os.cpu_count(),
+            "python": platform.python_version()}
+
+
+def compare(result, baseline, tolerance):
+    """Relative change per compared metric, and the metrics that regressed beyond ``tolerance``."""
+    changes, regressions = {}, []
+    for metric, lower_is_better in COMPARED.items():
+        old, new = baseline.get(metric), result.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        changes[metric] = change
+        worse = change if lower_is_better else -change
+        if worse > tolerance:
+            regressions.append(metric)
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", help="Recording directory to replay (default: synthetic pages)")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--queries", type=int, default=32, help="Queries per concurrency level")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows in synthetic result tables")
+    parser.add_argument("--delay", type=float, default=0.2, help="Server think time per results response")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Delay between 16 KB response chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 'unable to process' answers")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 if a metric regressed beyond --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression (default 25%%)")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_one(args.child[0], int(args.child[1]), int(args.child[2]))
+        return
+
+    from fois_replay import start_server
+
+    params = {"dir": args.dir, "queries": args.queries, "rows": args.rows, "delay": args.delay,
+              "chunk_delay": args.chunk_delay, "error_rate": args.error_rate}
+    server = start_server(args.dir, captcha_answer=CAPTCHA, rows=args.rows, delay=args.delay,
+                          chunk_delay=args.chunk_delay, error_rate=args.error_rate)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"Note: baseline was recorded with {baseline.get('params')}; comparing anyway.")
+        recorded = {key: baseline.get(key) for key in HOST_KEYS}
+        if recorded != host():
+            print(f"Note: baseline was recorded on another machine ({recorded}); "
+                  "save one here with --save-baseline before trusting the comparison.")
+
+    print(f"{'workers':>8}{'p50 s':>8}{'p95 s':>8}{'parse s':>9}{'xlsx s':>8}{'parquet s':>10}"
+          f"{'RSS MB':>8}{'q/s':>7}  statuses")
+    levels, regressed = {}, []
+    try:
+        for concurrency in args.concurrency:
+            r = measure(server.form_url, concurrency, args.queries)
+            levels[str(concurrency)] = r
+            print(f"{concurrency:>8}{r['p50_s']:>8.2f}{r['p95_s']:>8.2f}{r['parse_s']:>9.3f}{r['export_xlsx_s']:>8.2f}"
+                  f"{r['export_parquet_s']:>10.3f}{r['peak_rss_mb']:>8.0f}{r['throughput_qps']:>7.1f}  {r['statuses']}")
+            base = (baseline or {}).get("levels", {}).get(str(concurrency))
+            if base:
+                changes, regressions = compare(r, base, args.tolerance)
+                print(f"{'':>8}vs baseline: " + ", ".join(f"{m} {c:+.0%}" for m, c in changes.items()))
+                regressed += [f"{m}@{concurrency}" for m in regressions]
+    finally:
+        server.shutdown()
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"params": params, **host(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "levels": levels}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif regressed:
+        print(f"Regressions beyond {args.tolerance:.0%}: {', '.join(regressed)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
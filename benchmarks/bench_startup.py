@@ -0,0 +1,144 @@
+"""Benchmark: how long the app takes to come up, render and get a browser.
+
+Every measurement runs in a fresh interpreter, as after a container start:
+
+    server up       `streamlit run app.py` until its health check answers
+    first run       the first script run of a new session (imports included),
+                    through streamlit.testing's AppTest
+    rerun           a script run with no change, median of --reruns
+    widget rerun    a script run after picking another zone, median of --reruns
+    discovery cold  finding the browser and driver with no saved discovery
+    discovery warm  the same with the discovery saved by the previous process
+    driver ready    discovery, launch and DevTools setup of a lean-profile
+                    browser (n/a where Chrome can't start)
+
+AppTest compiles the script again for every run, which the Streamlit server
+does only once, so its reruns are a little slower than a real session's.
+
+Usage:
+    python benchmarks/bench_startup.py [--reruns 10] [--json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_APP_RUNS = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+app, reruns = sys.argv[1], int(sys.argv[2])
+at = AppTest.from_file(app, default_timeout=120)
+mark = time.perf_counter()
+at.run()
+first = time.perf_counter() - mark
+plain, widget = [], []
+for i in range(reruns):
+    mark = time.perf_counter()
+    at.run()
+    plain.append(time.perf_counter() - mark)
+    zones = at.selectbox[0].options
+    mark = time.perf_counter()
+    at.selectbox[0].set_value(zones[i % len(zones)]).run()
+    widget.append(time.perf_counter() - mark)
+print(json.dumps({"first": first, "plain": plain, "widget": widget, "errors": [str(e.value) for e in at.exception]}))
+"""
+
+_DRIVER = """
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+mark = time.perf_counter()
+from driver_discovery import discover
+found = discover()
+result = {"discovery": time.perf_counter() - mark, "source": found["source"]}
+if sys.argv[2] == "launch":
+    try:
+        from driver_discovery import launch_driver
+        from driver_profiles import apply_profile, build_options
+        apply_profile(launch_driver(build_options("lean")), "lean").quit()
+        result["ready"] = time.perf_counter() - mark
+    except Exception as e:
+        result["error"] = str(e).splitlines()[0][:120]
+print(json.dumps(result))
+"""
+
+
+def _child(code, *args, env=None):
+    out = subprocess.run([sys.executable, "-c", code, *args], cwd=ROOT, capture_output=True, text=True,
+                         env=env, check=True)
+    # Whatever the app printed comes first; the result is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_up(timeout=120):
+    port = _free_port()
+    mark = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "streamlit", "run", "app.py", "--server.headless", "true",
+                                "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+                               cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - mark < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - mark
+            except OSError:
+                time.sleep(0.05)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {"server_up_s": server_up()}
+
+    runs = _child(_APP_RUNS, os.path.join(ROOT, "app.py"), str(args.reruns))
+    if runs["errors"]:
+        print(f"The app raised: {runs['errors']}", file=sys.stderr)
+    results["first_run_s"] = runs["first"]
+    results["rerun_s"] = statistics.median(runs["plain"])
+    results["widget_rerun_s"] = statistics.median(runs["widget"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, FOIS_DRIVER_CACHE=os.path.join(tmp, "drivers.json"))
+        cold = _child(_DRIVER, ROOT, "discover", env=env)
+        warm = _child(_DRIVER, ROOT, "launch", env=env)
+    results["discovery_cold_s"] = cold["discovery"]
+    results["discovery_warm_s"] = warm["discovery"]
+    results["driver_source"] = warm["source"]
+    results["driver_ready_s"] = warm.get("ready")
+    results["driver_error"] = warm.get("error")
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ("server_up_s", "first_run_s", "rerun_s", "widget_rerun_s", "discovery_cold_s", "discovery_warm_s",
+                 "driver_ready_s"):
+        value = results[name]
+        print(f"{name[:-2].replace('_', ' '):<18}{'n/a' if value is None else f'{value:.3f} s':>10}")
+    print(f"driver source     {results['driver_source']:>10}")
+    if results["driver_error"]:
+        print(f"driver error: {results['driver_error']}")
+
+
+if __name__ == "__main__":
+    main()
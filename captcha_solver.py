@@ -0,0 +1,444 @@
+"""CAPTCHA capture and solving.
+
+capture_captcha() takes just the CAPTCHA <img> out of the browser (the
+decoded image through a canvas, or a screenshot of the element) instead of
+a screenshot of the whole 1920x1080 page.
+
+Solvers are callables ``solver(image, job=None)`` taking the PNG bytes and
+returning the answer, or None when they are not sure; the answer then goes
+to the operator as before. The built-in OfflineSolver is a small CPU-only
+nearest-neighbour model over the characters of labelled CAPTCHAs. Labels
+can be collected as a side effect of normal use: with FOIS_CAPTCHA_LABELS
+set, every answer the live portal accepts is saved with its image to that
+directory (record_answer()). Answers accepted by anything else, such as
+fois_replay's stand-in, which takes any answer, are never saved. Solve
+latency and how often FOIS accepted each solver's answers are kept in the
+instrumentation metrics.
+
+Configuration (environment):
+    FOIS_CAPTCHA_LABELS      labelled CAPTCHAs are saved here (default: unset, not collected)
+    FOIS_CAPTCHA_MODEL       trained model file (default: captcha_model.npz)
+    FOIS_CAPTCHA_CONFIDENCE  answers below this confidence go to the operator (default: 0.5)
+
+Usage:
+    python captcha_solver.py train [--labels DIR] [--model FILE]   # fit, report holdout accuracy, save
+    python captcha_solver.py solve image.png [...]
+"""
+import argparse
+import base64
+import collections
+import io
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from instrumentation import METRICS
+
+LABEL_DIR = os.environ.get("FOIS_CAPTCHA_LABELS", "")
+MODEL_PATH = os.environ.get("FOIS_CAPTCHA_MODEL", "captcha_model.npz")
+CONFIDENCE = float(os.environ.get("FOIS_CAPTCHA_CONFIDENCE", "0.5"))
+
+# Every glyph is scaled to this many pixels (width, height) before comparing
+GLYPH_SIZE = (12, 16)
+MANUAL = "manual"
+
+# Copies the already loaded CAPTCHA <img> onto a canvas and returns it as a PNG data URL,
+# so the image isn't fetched again (which would give the session a new CAPTCHA)
+_CANVAS_JS = """
+const img = arguments[0];
+if (!img.complete || !img.naturalWidth) return null;
+const canvas = document.createElement('canvas');
+canvas.width = img.naturalWidth;
+canvas.height = img.naturalHeight;
+canvas.getContext('2d').drawImage(img, 0, 0);
+try { return canvas.toDataURL('image/png'); } catch (e) { return null; }
+"""
+
+
+def find_captcha(driver):
+    """The CAPTCHA <img> of the current page, or None."""
+    from selenium.webdriver.common.by import By
+
+    for img in driver.find_elements(By.TAG_NAME, "img"):
+        marker = " ".join(img.get_attribute(a) or "" for a in ("src", "id", "name")).lower()
+        if "captcha" in marker:
+            return img
+    return None
+
+
+def capture_captcha(driver):
+    """PNG bytes of only the CAPTCHA image; a full-page screenshot if it can't be found."""
+    img = find_captcha(driver)
+    if img is not None:
+        try:
+            data_url = driver.execute_script(_CANVAS_JS, img)
+            if data_url and data_url.startswith("data:image/png;base64,"):
+                return base64.b64decode(data_url.split(",", 1)[1])
+            return img.screenshot_as_png
+        except Exception:
+            pass
+    return driver.get_screenshot_as_png()
+
+
+# --- Labelled CAPTCHAs ---
+
+class LabelStore:
+    """A directory of CAPTCHA images named after their answer: <TEXT>_<stamp>.png."""
+
+    def __init__(self, directory=LABEL_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def add(self, image, text):
+        text = normalize(text)
+        if not text:
+            return None
+        with self._lock:
+            self._seq += 1
+            name = f"{text}_{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}_{self._seq}.png"
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(image)
+        os.replace(tmp, path)
+        return path
+
+    def samples(self):
+        """(text, PNG bytes) of every labelled CAPTCHA."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".png"):
+                continue
+            with open(os.path.join(self.directory, name), "rb") as f:
+                yield name.split("_", 1)[0], f.read()
+
+    def __len__(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(name.endswith(".png") for name in os.listdir(self.directory))
+
+
+def normalize(text):
+    """Upper-case alphanumerics of an answer; also what file names can hold."""
+    return re.sub(r"[^0-9A-Z]", "", (text or "").upper())
+
+
+# --- Offline model ---
+
+def _ink(image):
+    """Boolean ink mask of a CAPTCHA: the pixels on the minority side of an Otsu threshold."""
+    import numpy as np
+    from PIL import Image
+
+    gray = np.asarray(Image.open(io.BytesIO(image)).convert("L"), dtype=np.uint8)
+    hist = np.bincount(gray.ravel(), minlength=256).astype(float)
+    total = gray.size
+    cum = np.cumsum(hist)
+    cum_mean = np.cumsum(hist * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (cum_mean[-1] * cum / total - cum_mean) ** 2 / (cum * (total - cum))
+    threshold = int(np.nanargmax(between))
+    dark = gray <= threshold
+    ink = dark if dark.mean() <= 0.5 else ~dark
+    # Drop speckle: ink pixels with fewer than two inked neighbours
+    padded = np.pad(ink, 1).astype(np.uint8)
+    neighbours = sum(np.roll(np.roll(padded, dy, 0), dx, 1)
+                     for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx)[1:-1, 1:-1]
+    return ink & (neighbours >= 2)
+
+
+def _runs(profile):
+    """(start, end) of the runs of non-zero columns."""
+    runs, start = [], None
+    for i, value in enumerate(profile):
+        if value and start is None:
+            start = i
+        elif not value and start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(profile)))
+    return runs
+
+
+def segment(image, count=None):
+    """Splits a CAPTCHA into glyph masks, left to right.
+
+    Glyphs are separated at blank columns. With ``count``, pieces of one
+    glyph are merged across the narrowest gaps, and touching glyphs are
+    split at the middle of the widest run, until exactly ``count`` remain.
+    """
+    import numpy as np
+
+    ink = _ink(image)
+    runs = _runs(ink.any(axis=0))
+    # Leftover specks are not glyphs
+    total = ink.sum()
+    runs = [r for r in runs if ink[:, r[0]:r[1]].sum() >= 0.02 * total]
+    if count:
+        while len(runs) > count:
+            i = min(range(len(runs) - 1), key=lambda i: (runs[i + 1][0] - runs[i][1], runs[i + 1][1] - runs[i][0]))
+            runs[i:i + 2] = [(runs[i][0], runs[i + 1][1])]
+        while runs and len(runs) < count:
+            start, end = max(runs, key=lambda r: r[1] - r[0])
+            if end - start < 4:
+                break
+            i = runs.index((start, end))
+            middle = (start + end) // 2
+            runs[i:i + 1] = [(start, middle), (middle, end)]
+    glyphs = []
+    for start, end in runs:
+        column = ink[:, start:end]
+        rows = np.flatnonzero(column.any(axis=1))
+        glyphs.append(column[rows[0]:rows[-1] + 1] if len(rows) else column)
+    return glyphs
+
+
+def glyph_features(glyph):
+    """A glyph mask scaled to GLYPH_SIZE, as a unit-length vector."""
+    import numpy as np
+    from PIL import Image
+
+    scaled = Image.fromarray(glyph.astype(np.uint8) * 255).resize(GLYPH_SIZE, Image.BILINEAR)
+    vector = np.asarray(scaled, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class OfflineSolver:
+    """Nearest-neighbour classifier over the glyphs of labelled CAPTCHAs.
+
+    Confidence is the smallest, over the glyphs, of how much nearer the best
+    character is than the nearest different one (0 to 1). Answers below
+    ``threshold`` are returned as None so the operator gets the CAPTCHA.
+    """
+
+    name = "offline"
+
+    def __init__(self, features, labels, length, threshold=CONFIDENCE):
+        import numpy as np
+
+        self.features = np.asarray(features, dtype=np.float32)
+        self.labels = np.asarray(labels)
+        self.length = int(length)
+        self.threshold = threshold
+
+    @classmethod
+    def train(cls, samples, threshold=CONFIDENCE):
+        """Fits the model to (text, PNG bytes) pairs; samples that don't segment cleanly are skipped."""
+        samples = [(normalize(text), image) for text, image in samples]
+        lengths = collections.Counter(len(text) for text, _ in samples if text)
+        if not lengths:
+            raise ValueError("No labelled CAPTCHAs to train on.")
+        length = lengths.most_common(1)[0][0]
+        features, labels = [], []
+        for text, image in samples:
+            if len(text) != length:
+                continue
+            glyphs = segment(image, length)
+            if len(glyphs) != length:
+                continue
+            features += [glyph_features(g) for g in glyphs]
+            labels += list(text)
+        if not features:
+            raise ValueError("None of the labelled CAPTCHAs could be segmented.")
+        return cls(features, labels, length, threshold)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH, threshold=CONFIDENCE):
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["features"], data["labels"], data["length"], threshold)
+
+    def save(self, path=MODEL_PATH):
+        import numpy as np
+
+        tmp = path + ".tmp.npz"
+        np.savez_compressed(tmp, features=self.features, labels=self.labels, length=self.length)
+        os.replace(tmp, path)
+
+    def predict(self, image):
+        """(answer, confidence) for a CAPTCHA image."""
+        import numpy as np
+
+        glyphs = segment(image, self.length)
+        if len(glyphs) != self.length:
+            return "", 0.0
+        answer, confidence = [], 1.0
+        for glyph in glyphs:
+            distances = np.linalg.norm(self.features - glyph_features(glyph), axis=1)
+            best = int(np.argmin(distances))
+            char = self.labels[best]
+            others = distances[self.labels != char]
+            nearest_other = others.min() if len(others) else np.inf
+            answer.append(str(char))
+            confidence = min(confidence, 1.0 - distances[best] / nearest_other if nearest_other > 0 else 0.0)
+        return "".join(answer), float(confidence)
+
+    def __call__(self, image, job=None):
+        start = time.perf_counter()
+        try:
+            answer, confidence = self.predict(image)
+        except Exception:
+            METRICS.inc("fois_captcha_solves_total", solver=self.name, outcome="failed")
+            raise
+        finally:
+            METRICS.observe("fois_captcha_solve_seconds", time.perf_counter() - start, solver=self.name)
+        confident = bool(answer) and confidence >= self.threshold
+        METRICS.inc("fois_captcha_solves_total", solver=self.name, outcome="answered" if confident else "unsure")
+        return answer if confident else None
+
+
+def load_solver(path=MODEL_PATH, threshold=CONFIDENCE):
+    """The trained OfflineSolver, or None if no model has been trained yet."""
+    if not path or not os.path.exists(path):
+        return None
+    return OfflineSolver.load(path, threshold)
+
+
+# --- Operator ---
+
+def save_captcha(captcha_dir, job, image):
+    """Saves a job's CAPTCHA as <captcha_dir>/<label>.png and returns the path."""
+    os.makedirs(captcha_dir, exist_ok=True)
+    path = os.path.join(captcha_dir, job.label.replace("/", "_") + ".png")
+    with open(path, "wb") as f:
+        f.write(image)
+    return path
+
+
+def prompt_solver(captcha_dir="captchas", out=None):
+    """Solver for an operator at the terminal: saves the image and reads the text from stdin.
+
+    The prompt goes to ``out`` (default: stdout); pass sys.stderr when
+    stdout carries data.
+    """
+    def solve(image, job):
+        path = save_captcha(captcha_dir, job, image)
+        print(f"[{job.label}] CAPTCHA saved to {path}. Enter text (blank to skip): ", end="",
+              file=out or sys.stdout, flush=True)
+        return sys.stdin.readline().strip() or None
+    return solve
+
+
+
+class CommandSolver:
+    """Pipes the CAPTCHA PNG to an external command and reads the answer from its stdout."""
+
+    name = "command"
+
+    def __init__(self, command, timeout=60):
+        self.command = command
+        self.timeout = timeout
+
+    def __call__(self, image, job):
+        out = subprocess.run(self.command, input=image, capture_output=True, shell=True, timeout=self.timeout)
+        answer = out.stdout.decode().strip()
+        return answer or None
+
+# --- Feedback ---
+
+_labels = LabelStore(LABEL_DIR) if LABEL_DIR else None
+
+
+def record_answer(image, text, accepted, solver=MANUAL, label=True):
+    """Records whether FOIS accepted a CAPTCHA answer.
+
+    Accepted answers become training labels when label collection is on and
+    ``label`` is true; pass False when the answer was not really checked.
+    """
+    METRICS.inc("fois_captcha_answers_total", solver=solver or MANUAL, result="accepted" if accepted else "rejected")
+    if accepted and label and image and _labels is not None:
+        try:
+            _labels.add(image, text)
+        except OSError as e:
+            print(f"Warning: could not save the labelled CAPTCHA: {e}")
+
+
+def solver_stats():
+    """Per solver: answers FOIS accepted and rejected, accuracy and solve latency."""
+    latencies = {row["solver"]: row for row in METRICS.percentiles("fois_captcha_solve_seconds", by=("solver",))}
+    solvers = set(latencies) | set(METRICS.label_values("fois_captcha_answers_total", "solver"))
+    rows = []
+    for solver in sorted(solvers):
+        accepted = METRICS.counter("fois_captcha_answers_total", solver=solver, result="accepted")
+        rejected = METRICS.counter("fois_captcha_answers_total", solver=solver, result="rejected")
+        rows.append({
+            "solver": solver,
+            "accepted": accepted,
+            "rejected": rejected,
+            "accuracy": accepted / (accepted + rejected) if accepted + rejected else None,
+            "unsure": METRICS.counter("fois_captcha_solves_total", solver=solver, outcome="unsure"),
+            "p50_ms": latencies[solver]["p50"] * 1000 if solver in latencies else None,
+        })
+    return rows
+
+
+def train_model(label_dir=LABEL_DIR, model_path=MODEL_PATH, holdout=0.2, seed=0):
+    """Trains on the labelled CAPTCHAs, measures the model on a holdout and saves it.
+
+    Returns a dict with the sample counts, holdout accuracy, the share of
+    holdout CAPTCHAs answered with confidence, and the mean solve time.
+    """
+    import numpy as np
+
+    samples = list(LabelStore(label_dir).samples())
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(samples))
+    cut = int(len(samples) * holdout) if len(samples) >= 10 else 0
+    test = [samples[i] for i in order[:cut]]
+    report = {"samples": len(samples), "holdout": len(test)}
+    if test:
+        model = OfflineSolver.train([samples[i] for i in order[cut:]])
+        correct = answered = 0
+        start = time.perf_counter()
+        for text, image in test:
+            answer, confidence = model.predict(image)
+            correct += answer == normalize(text)
+            answered += confidence >= model.threshold
+        report["solve_ms"] = (time.perf_counter() - start) / len(test) * 1000
+        report["accuracy"] = correct / len(test)
+        report["answered"] = answered / len(test)
+    # The saved model learns from every sample
+    model = OfflineSolver.train(samples)
+    model.save(model_path)
+    report["glyphs"] = len(model.labels)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="Train the offline solver on labelled CAPTCHAs")
+    train.add_argument("--labels", default=LABEL_DIR or None, required=not LABEL_DIR,
+                       help="Labelled CAPTCHA directory (default: FOIS_CAPTCHA_LABELS)")
+    train.add_argument("--model", default=MODEL_PATH)
+    solve = sub.add_parser("solve", help="Solve CAPTCHA images with the trained model")
+    solve.add_argument("images", nargs="+")
+    solve.add_argument("--model", default=MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "train":
+        report = train_model(args.labels, args.model)
+        print(f"Trained on {report['samples']} CAPTCHAs ({report['glyphs']} glyphs); saved to {args.model}")
+        if report["holdout"]:
+            print(f"Holdout of {report['holdout']}: accuracy {report['accuracy']:.0%}, "
+                  f"confident on {report['answered']:.0%}, {report['solve_ms']:.1f} ms per CAPTCHA")
+        return
+
+    model = OfflineSolver.load(args.model)
+    for path in args.images:
+        with open(path, "rb") as f:
+            answer, confidence = model.predict(f.read())
+        print(f"{path}: {answer or '?'} ({confidence:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Finds the Chrome/Chromium and chromedriver binaries once, not on every launch.
+
+Starting a browser used to run `chromium --version`, probe /usr/bin and call
+ChromeDriverManager().install(), which checks versions online, every time.
+discover() does that work once per process and saves the answer to a small
+JSON file, so later processes skip it too:
+
+    {"browser": "/usr/bin/chromium", "driver": "/usr/bin/chromedriver",
+     "version": "Chromium 120.0.6099.224", "source": "system", "stamp": {...}}
+
+The stamp records the size and mtime of every binary looked at (or that it
+was missing). When a browser or driver is upgraded, installed or removed,
+the stamp no longer matches and discovery runs again. If a browser fails to
+start from cached paths, launch_driver() rediscovers and tries once more.
+
+source is one of:
+
+    system              /usr/bin/chromium and /usr/bin/chromedriver (Streamlit Cloud, Docker)
+    webdriver-manager   a chromedriver downloaded for the local Chrome
+    selenium            neither; Selenium finds a driver itself
+
+Configuration:
+    FOIS_DRIVER_CACHE   file the discovery is saved to (default: .fois_drivers.json; empty: memory only)
+"""
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+DRIVER_CACHE = os.environ.get("FOIS_DRIVER_CACHE", ".fois_drivers.json")
+
+SYSTEM_BROWSER = "/usr/bin/chromium"
+SYSTEM_DRIVER = "/usr/bin/chromedriver"
+BROWSER_NAMES = ("chromium", "chromium-browser", "google-chrome", "google-chrome-stable", "chrome")
+# Bumped when the saved format changes, so old files are ignored
+CACHE_VERSION = 1
+
+_lock = threading.Lock()
+_found = None
+
+
+def _stamp(paths):
+    """Size and mtime of each path, or None for a missing one."""
+    stamp = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamp[path] = [st.st_size, st.st_mtime_ns]
+        except OSError:
+            stamp[path] = None
+    return stamp
+
+
+def _watched(found=None):
+    """The binaries whose change invalidates a discovery."""
+    paths = {SYSTEM_BROWSER, SYSTEM_DRIVER}
+    for name in BROWSER_NAMES + ("chromedriver",):
+        path = shutil.which(name)
+        if path:
+            paths.add(path)
+    if found:
+        paths.update(p for p in (found.get("browser"), found.get("driver")) if p)
+    return sorted(paths)
+
+
+def _version(browser):
+    if not browser:
+        return None
+    try:
+        res = subprocess.run([browser, "--version"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if res.returncode != 0:
+        return None
+    return res.stdout.strip() or None
+
+
+def _find():
+    """Looks for the binaries the slow way."""
+    if os.path.exists(SYSTEM_BROWSER) and os.path.exists(SYSTEM_DRIVER):
+        browser, driver, source = SYSTEM_BROWSER, SYSTEM_DRIVER, "system"
+    else:
+        browser = next((path for path in map(shutil.which, BROWSER_NAMES) if path), None)
+        driver, source = None, "selenium"
+        try:
+            from webdriver_manager.chrome import ChromeDriverManager
+            driver, source = ChromeDriverManager().install(), "webdriver-manager"
+        except ImportError:
+            pass
+        except Exception as e:
+            print(f"webdriver-manager could not provide a chromedriver, leaving it to Selenium: {e}")
+    found = {"browser": browser, "driver": driver, "version": _version(browser), "source": source}
+    print(f"Found Chrome via {source}: {found['version'] or browser or 'unknown browser'}, "
+          f"driver {driver or 'from Selenium'}")
+    return found
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            found = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(found, dict) or found.get("cache_version") != CACHE_VERSION:
+        return None
+    stamp = found.get("stamp") or {}
+    if _stamp(_watched(found)) != stamp:
+        return None
+    found["cached"] = True
+    return found
+
+
+def _save(path, found):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(found, f, indent=2)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not save the driver discovery to {path}: {e}")
+
+
+def discover(refresh=False, cache_path=None):
+    """The browser and driver to launch: from memory, the cache file, or a fresh search."""
+    global _found
+    path = DRIVER_CACHE if cache_path is None else cache_path
+    with _lock:
+        if _found is not None and not refresh:
+            return _found
+        found = None if refresh or not path else _load(path)
+        if found is None:
+            found = _find()
+            found["cache_version"] = CACHE_VERSION
+            found["stamp"] = _stamp(_watched(found))
+            if path:
+                _save(path, found)
+        _found = found
+        return found
+
+
+def _start(found, options):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+
+    if found["source"] == "system":
+        options.binary_location = found["browser"]
+    service = Service(found["driver"]) if found["driver"] else None
+    return webdriver.Chrome(service=service, options=options)
+
+
+def launch_driver(options):
+    """Starts Chrome with the discovered binaries; cached ones that fail are rediscovered once."""
+    found = discover()
+    try:
+        return _start(found, options)
+    except Exception:
+        if not found.get("cached"):
+            raise
+    print("Could not start Chrome with the cached binaries; looking for them again.")
+    return _start(discover(refresh=True), options)
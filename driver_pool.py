@@ -0,0 +1,259 @@
+"""A process-wide pool of warm Chrome drivers shared by the Streamlit sessions.
+
+Starting Chrome takes seconds, so the pool keeps a few browsers launched
+ahead of time and hands one to each session that needs it. The first ones
+are launched on a background thread, so creating the pool (inside
+st.cache_resource, on the first page render) doesn't wait for them.
+
+A checked-out driver is leased until it is checked back in. Sessions that
+end without doing so never check it in, so leases are reclaimed: a lease
+tied to a holder (hold(), e.g. the extractor using the driver) once that
+object has been garbage-collected, however long it was kept, and any other
+lease after ``lease_timeout`` seconds.
+"""
+import threading
+import time
+import weakref
+
+from instrumentation import METRICS
+
+
+class PoolExhausted(Exception):
+    """Raised when no driver could be checked out before the timeout."""
+
+
+class _PooledDriver:
+    """Bookkeeping wrapper around a live WebDriver."""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.created_at = time.time()
+        self.leased_at = None
+        # weakref to the object the lease lasts as long as, if any
+        self.holder = None
+
+
+class DriverPool:
+    """A process-wide pool of pre-launched Chrome drivers.
+
+    Keeps ``size`` idle drivers warm and never runs more than ``max_size`` at once.
+    Each Streamlit session checks out one driver and checks it back in when it
+    is done; drivers that crash or reach ``max_uses`` are quit and replaced.
+    """
+
+    def __init__(self, factory, size=2, max_size=4, max_uses=25, lease_timeout=1800):
+        self.factory = factory
+        self.size = max(0, size)
+        self.max_size = max(1, max_size, self.size)
+        self.max_uses = max_uses
+        self.lease_timeout = lease_timeout
+
+        self._idle = []
+        self._leased = {}
+        # Launches under way, and how many of them are warm-ups that will end up idle
+        self._launching = 0
+        self._warming = 0
+        # Callers of checkout() waiting for a warm-up instead of launching their own browser
+        self._waiting = 0
+        self._lock = threading.Condition()
+        # Why the last launch failed, for the PoolExhausted message
+        self.last_error = None
+        self.warm_async()
+
+    # --- Public API ---
+
+    def warm(self):
+        """Launches drivers until ``size`` of them are idle or ``max_size`` is reached."""
+        while True:
+            with self._lock:
+                total = len(self._idle) + len(self._leased) + self._launching
+                if len(self._idle) + self._launching >= self.size or total >= self.max_size:
+                    return
+                self._launching += 1
+                self._warming += 1
+            entry = None
+            try:
+                entry = self._launch()
+            finally:
+                with self._lock:
+                    self._launching -= 1
+                    self._warming -= 1
+                    if entry is not None:
+                        self._idle.append(entry)
+                    # Waiters re-check: they take this driver or, if the launch failed, start their own
+                    self._lock.notify_all()
+            if entry is None:
+                return
+
+    def warm_async(self):
+        """Refills the pool on a background thread so checkout never waits on it."""
+        threading.Thread(target=self.warm, name="driver-pool-warm", daemon=True).start()
+
+    def checkout(self, timeout=60):
+        """Returns a healthy driver, launching one if the pool has room."""
+        started = time.perf_counter()
+        deadline = time.time() + timeout
+        while True:
+            entry = None
+            launch = False
+            with self._lock:
+                stale = self._reclaim_stale_leases()
+            # Quitting a browser can take seconds; other callers shouldn't wait on it
+            for driver in stale:
+                self._quit(driver)
+            with self._lock:
+                remaining = deadline - time.time()
+                if self._idle:
+                    entry = self._idle.pop()
+                elif self._warming > self._waiting and remaining > 0:
+                    # A warm-up is already launching a browser; wait for it rather than start another
+                    self._waiting += 1
+                    self._lock.wait(min(remaining, 1.0))
+                    self._waiting -= 1
+                    continue
+                elif len(self._leased) + self._launching < self.max_size:
+                    # Reserve the slot so concurrent callers don't overshoot max_size
+                    launch = True
+                    self._launching += 1
+                else:
+                    if remaining <= 0:
+                        raise PoolExhausted(f"All {self.max_size} browsers are in use. Please try again shortly.")
+                    self._lock.wait(min(remaining, 1.0))
+                    continue
+
+            if launch:
+                try:
+                    entry = self._launch()
+                finally:
+                    with self._lock:
+                        self._launching -= 1
+                if entry is None:
+                    raise PoolExhausted(f"Could not launch a new browser: {self.last_error}")
+            elif not self.is_healthy(entry.driver):
+                self._quit(entry.driver)
+                continue
+
+            with self._lock:
+                entry.uses += 1
+                entry.leased_at = time.time()
+                self._leased[id(entry.driver)] = entry
+            METRICS.observe("fois_pool_wait_seconds", time.perf_counter() - started)
+            self._publish_stats()
+            self.warm_async()
+            return entry.driver
+
+    def hold(self, driver, holder):
+        """Ties the lease of ``driver`` to ``holder``: it is kept as long as the holder exists.
+
+        Use it for drivers that may sit unused for a long time, like the one
+        of a failed query kept for a retry; lease_timeout doesn't apply to them.
+        """
+        with self._lock:
+            entry = self._leased.get(id(driver))
+            if entry is not None:
+                entry.holder = weakref.ref(holder)
+
+    def checkin(self, driver, broken=False):
+        """Returns a driver to the pool, recycling it if needed."""
+        if driver is None:
+            return
+        with self._lock:
+            entry = self._leased.pop(id(driver), None)
+        if entry is None:
+            # Lease was reclaimed or the driver never came from this pool
+            self._quit(driver)
+            return
+
+        if broken or entry.uses >= self.max_uses or not self._reset(driver):
+            self._quit(driver)
+            self.warm_async()
+            return
+
+        entry.leased_at = None
+        entry.holder = None
+        with self._lock:
+            self._idle.append(entry)
+            self._lock.notify()
+        self._publish_stats()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "leased": len(self._leased),
+                "size": self.size,
+                "max_size": self.max_size,
+            }
+
+    def close(self):
+        """Quits every driver the pool knows about."""
+        with self._lock:
+            entries = self._idle + list(self._leased.values())
+            self._idle = []
+            self._leased = {}
+        for entry in entries:
+            self._quit(entry.driver)
+
+    # --- Internals ---
+
+    def _launch(self):
+        start = time.perf_counter()
+        try:
+            entry = _PooledDriver(self.factory())
+            METRICS.observe("fois_driver_start_seconds", time.perf_counter() - start)
+            return entry
+        except Exception as e:
+            METRICS.inc("fois_driver_launch_failures_total")
+            self.last_error = str(e)
+            return None
+
+    def _publish_stats(self):
+        stats = self.stats()
+        METRICS.set("fois_pool_drivers", stats["idle"], state="idle")
+        METRICS.set("fois_pool_drivers", stats["leased"], state="leased")
+
+    def _reclaim_stale_leases(self):
+        """Drops stale leases and returns their drivers for the caller to quit. Call with the lock held."""
+        # Sessions that were closed without "Reset / Close Browser" never check their driver in
+        cutoff = time.time() - self.lease_timeout if self.lease_timeout else None
+        drivers = []
+        for key, entry in list(self._leased.items()):
+            if entry.holder is not None:
+                stale = entry.holder() is None
+            else:
+                stale = cutoff is not None and entry.leased_at and entry.leased_at < cutoff
+            if stale:
+                del self._leased[key]
+                drivers.append(entry.driver)
+        return drivers
+
+    @staticmethod
+    def is_healthy(driver):
+        try:
+            driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _reset(driver):
+        """Clears cookies and storage so the next user starts from a blank page."""
+        try:
+            driver.switch_to.default_content()
+            try:
+                driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+            except Exception:
+                pass
+            driver.delete_all_cookies()
+            driver.get("about:blank")
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
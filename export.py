@@ -0,0 +1,245 @@
+"""Export of result tables to Excel, CSV, NDJSON, Parquet and Arrow.
+
+The XLSX writer feeds rows in chunks to XlsxWriter's constant-memory mode
+(or openpyxl's write-only mode when XlsxWriter is not installed), so memory
+stays flat however large the table is, instead of building the whole
+workbook in memory like DataFrame.to_excel does.
+
+RowWriter writes rows as NDJSON or CSV while they are still being parsed,
+for pipelines that should not wait for the whole table.
+"""
+import csv
+import gzip
+import io
+import json
+import math
+import os
+import threading
+import time
+
+import pandas as pd
+
+from instrumentation import record_export
+
+# XlsxWriter is optional; it writes about 1.6x faster than openpyxl
+try:
+    import xlsxwriter
+    HAS_XLSXWRITER = True
+except ImportError:
+    HAS_XLSXWRITER = False
+
+CHUNK_ROWS = 10000
+
+FORMATS = {
+    "xlsx": {"label": "Excel (.xlsx)", "ext": ".xlsx",
+             "mime": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"},
+    "csv": {"label": "CSV", "ext": ".csv", "mime": "text/csv"},
+    "csv.gz": {"label": "CSV (gzip)", "ext": ".csv.gz", "mime": "application/gzip"},
+    "ndjson": {"label": "NDJSON", "ext": ".ndjson", "mime": "application/x-ndjson"},
+    "parquet": {"label": "Parquet", "ext": ".parquet", "mime": "application/vnd.apache.parquet"},
+    "arrow": {"label": "Arrow IPC", "ext": ".arrow", "mime": "application/vnd.apache.arrow.file"},
+}
+
+
+def flatten_columns(df):
+    """Joins MultiIndex column levels into single strings, in place; returns df."""
+    if isinstance(df.columns, pd.MultiIndex) or any(isinstance(c, tuple) for c in df.columns):
+        df.columns = [' '.join(str(c) for c in col if not str(c).startswith("Unnamed")).strip()
+                      if isinstance(col, tuple) else col for col in df.columns]
+    return df
+
+
+def format_for_path(path):
+    """Picks the export format from a file name, defaulting to xlsx."""
+    name = str(path).lower()
+    for fmt, spec in sorted(FORMATS.items(), key=lambda item: -len(item[1]["ext"])):
+        if name.endswith(spec["ext"]):
+            return fmt
+    return "xlsx"
+
+
+def file_name(stem, fmt):
+    return stem + FORMATS[fmt]["ext"]
+
+
+def _cell_columns(chunk):
+    """Converts a chunk into per-column lists of plain Python values for the xlsx writers."""
+    columns = []
+    for col in chunk.columns:
+        values = chunk[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            if getattr(values.dt, "tz", None) is not None:
+                values = values.dt.tz_localize(None)
+            columns.append([None if pd.isna(v) else v.to_pydatetime() for v in values])
+        elif pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+            columns.append([None if pd.isna(v) else int(v) for v in values.astype(object)])
+        elif pd.api.types.is_float_dtype(values):
+            columns.append([None if isinstance(v, float) and math.isnan(v) else float(v) for v in values.astype(object)])
+        else:
+            columns.append([v if isinstance(v, str) else (None if pd.isna(v) else str(v))
+                            for v in values.astype(object)])
+    return columns
+
+
+def write_xlsx(df, target, sheet_name="FOIS Data", chunk_rows=CHUNK_ROWS):
+    """Streams ``df`` into an .xlsx file or binary file object with constant memory."""
+    if HAS_XLSXWRITER:
+        _write_xlsx_xlsxwriter(df, target, sheet_name, chunk_rows)
+    else:
+        _write_xlsx_openpyxl(df, target, sheet_name, chunk_rows)
+
+
+def _write_xlsx_xlsxwriter(df, target, sheet_name, chunk_rows):
+    wb = xlsxwriter.Workbook(target, {"constant_memory": True, "in_memory": not isinstance(target, str)})
+    ws = wb.add_worksheet(sheet_name)
+    date_format = wb.add_format({"num_format": "dd-mm-yyyy"})
+    for i, col in enumerate(df.columns):
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            ws.set_column(i, i, 12, date_format)
+    ws.write_row(0, 0, [str(c) for c in df.columns])
+    row_num = 1
+    for start in range(0, len(df), chunk_rows):
+        for row in zip(*_cell_columns(df.iloc[start:start + chunk_rows])):
+            ws.write_row(row_num, 0, row)
+            row_num += 1
+    wb.close()
+
+
+def _write_xlsx_openpyxl(df, target, sheet_name, chunk_rows):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append([str(c) for c in df.columns])
+    for start in range(0, len(df), chunk_rows):
+        for row in zip(*_cell_columns(df.iloc[start:start + chunk_rows])):
+            ws.append(row)
+    wb.save(target)
+
+
+def write_csv(df, target, compress=False, chunk_rows=CHUNK_ROWS):
+    is_path = isinstance(target, str) or hasattr(target, "__fspath__")
+    if is_path:
+        opener = gzip.open if compress else open
+        with opener(target, "wt", encoding="utf-8", newline="") as f:
+            _write_csv_chunks(df, f, chunk_rows)
+        return
+
+    raw = gzip.GzipFile(fileobj=target, mode="wb", compresslevel=6) if compress else target
+    f = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    _write_csv_chunks(df, f, chunk_rows)
+    f.flush()
+    # Detach so the caller's file object stays open
+    f.detach()
+    if compress:
+        raw.close()
+
+
+def _write_csv_chunks(df, f, chunk_rows):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        df.iloc[start:start + chunk_rows].to_csv(f, index=False, header=start == 0)
+
+
+def write_ndjson(df, target, chunk_rows=CHUNK_ROWS):
+    """One JSON object per row; dates as ISO 8601."""
+    is_path = isinstance(target, str) or hasattr(target, "__fspath__")
+    f = open(target, "w", encoding="utf-8") if is_path else io.TextIOWrapper(target, encoding="utf-8")
+    try:
+        for start in range(0, len(df), chunk_rows):
+            lines = df.iloc[start:start + chunk_rows].to_json(orient="records", lines=True, date_format="iso",
+                                                              force_ascii=False)
+            f.write(lines if lines.endswith("\n") else lines + "\n")
+        f.flush()
+    finally:
+        if is_path:
+            f.close()
+        else:
+            # Detach so the caller's file object stays open
+            f.detach()
+
+
+def write_parquet(df, target):
+    df.to_parquet(target, index=False, compression="zstd")
+
+
+def write_arrow(df, target):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.ipc.new_file(target, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=CHUNK_ROWS * 5):
+            writer.write_batch(batch)
+
+
+_WRITERS = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "csv.gz": lambda df, target: write_csv(df, target, compress=True),
+    "ndjson": write_ndjson,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+
+def export(df, target, fmt=None):
+    """Writes ``df`` to a path or binary file object; the format defaults to the file extension."""
+    fmt = fmt or format_for_path(target)
+    if fmt not in _WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of {list(FORMATS)}")
+    start = time.perf_counter()
+    _WRITERS[fmt](flatten_columns(df), target)
+    record_export(fmt, time.perf_counter() - start, _written_size(target), len(df))
+    return target
+
+
+def _written_size(target):
+    try:
+        if isinstance(target, (str, os.PathLike)):
+            return os.path.getsize(target)
+        return target.tell()
+    except (OSError, AttributeError, ValueError):
+        return None
+
+
+def export_bytes(df, fmt):
+    """Returns the exported table as bytes, e.g. for st.download_button."""
+    buffer = io.BytesIO()
+    export(df, buffer, fmt)
+    return buffer.getvalue()
+
+
+# Formats RowWriter can write a row at a time
+STREAM_FORMATS = ("ndjson", "csv")
+
+
+class RowWriter:
+    """Writes rows (dicts) to a text stream as they arrive, as NDJSON or CSV.
+
+    The CSV header is taken from the first row; later rows are written in
+    its column order. Every write() is flushed, so a reader at the other end
+    of a pipe sees the rows straight away. Safe to call from several threads.
+    """
+
+    def __init__(self, stream, fmt="ndjson"):
+        if fmt not in STREAM_FORMATS:
+            raise ValueError(f"Cannot stream {fmt!r}; expected one of {list(STREAM_FORMATS)}")
+        self.stream = stream
+        self.fmt = fmt
+        self.rows = 0
+        self._csv = None
+        self._lock = threading.Lock()
+
+    def write(self, rows):
+        if not rows:
+            return
+        with self._lock:
+            if self.fmt == "ndjson":
+                self.stream.write("".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in rows))
+            else:
+                if self._csv is None:
+                    self._csv = csv.DictWriter(self.stream, fieldnames=list(rows[0]), restval="",
+                                               extrasaction="ignore", lineterminator="\n")
+                    self._csv.writeheader()
+                self._csv.writerows(rows)
+            self.stream.flush()
+            self.rows += len(rows)
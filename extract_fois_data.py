@@ -1,156 +1,184 @@
 
+import argparse
+import contextlib
+import sys
+import threading
 import time
 import os
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
-from webdriver_manager.chrome import ChromeDriverManager
-
-def setup_driver():
-    """Initializes the Chrome WebDriver."""
-    options = webdriver.ChromeOptions()
-    # options.add_argument("--headless") # Commented out to see the browser
-    options.add_argument("--start-maximized")
-    service = Service(ChromeDriverManager().install())
-    driver = webdriver.Chrome(service=service, options=options)
-    return driver
+
+from batch import DEFAULT_WORKERS, BatchRun, build_jobs
+from captcha_solver import MANUAL, MODEL_PATH, CommandSolver, load_solver, prompt_solver, save_captcha
+from driver_discovery import launch_driver
+from driver_profiles import DEFAULT_PROFILE, PROFILES, apply_profile, build_options
+from export import FORMATS as EXPORT_FORMATS, STREAM_FORMATS, RowWriter, export, format_for_path
+from extractors import ENGINES, FOIS_URL, QUERY_TYPES, ZONES, PERIODS, HttpExtractor, SeleniumExtractor
+from fois_parser import RowFeed, parse_fois_table
+from fois_replay import Recorder
+from history import HISTORY_DIR, HistoryStore
+from instrumentation import METRICS, configure as configure_instrumentation, record_query, start_metrics_server
+from readiness import QueryTimer, ReadinessError, ReadinessTimeout, mark_results_stale, wait_for_results
+from result_cache import ResultCache
+from resilience import MAX_RETRIES
+
+def setup_driver(profile=None):
+    """Initializes the Chrome WebDriver with a launch profile (driver_profiles.py)."""
+    driver = launch_driver(build_options(profile))
+    return apply_profile(driver, profile)
 
 def main():
-    driver = setup_driver()
+    # Only the interactive walk-through needs these; the batch and extract commands don't
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import Select, WebDriverWait
+
+    # Phases of this run, reported at the end and recorded in the metrics/trace
+    timer = QueryTimer(budget=900)
+    labels = {"engine": "selenium", "query": "ODR_RK_OTSG", "zone": "ECO", "period": None}
+    stats = {}
+    outcome = "error"
+
+    with timer.phase("driver_start"):
+        # The CAPTCHA is read off the browser window, so it has to be visible
+        driver = setup_driver("debug")
     try:
         url = "https://www.fois.indianrail.gov.in/FOISWebPortal/pages/FWP_ODROtsgDtls.jsp"
         print(f"Navigating to {url}...")
-        driver.get(url)
+        with timer.phase("navigate"):
+            driver.get(url)
 
         wait = WebDriverWait(driver, 20)
 
         # 1. Select "Outstanding ODR(s)"
         print("Locating 'Outstanding ODR(s)' radio button...")
-        try:
-            # Try finding by label text
-            outstanding_odr_radio = wait.until(EC.element_to_be_clickable(
-                (By.XPATH, "//label[contains(text(), 'Outstanding ODR')]/preceding-sibling::input[@type='radio'] | //input[@type='radio' and @value='O'] | //td[contains(text(), 'Outstanding ODR')]//input")
-            ))
-            if not outstanding_odr_radio.is_selected():
-                outstanding_odr_radio.click()
-                print("Selected 'Outstanding ODR(s)'.")
-            else:
-                print("'Outstanding ODR(s)' is already selected.")
-        except Exception as e:
-            print(f"Warning: Could not specifically select 'Outstanding ODR(s)' radio. It might be default or the selector failed. \nError: {e}")
+        with timer.phase("query_select"):
+            try:
+                # Try finding by label text
+                outstanding_odr_radio = wait.until(EC.element_to_be_clickable(
+                    (By.XPATH, "//label[contains(text(), 'Outstanding ODR')]/preceding-sibling::input[@type='radio'] | //input[@type='radio' and @value='O'] | //td[contains(text(), 'Outstanding ODR')]//input")
+                ))
+                if not outstanding_odr_radio.is_selected():
+                    outstanding_odr_radio.click()
+                    print("Selected 'Outstanding ODR(s)'.")
+                else:
+                    print("'Outstanding ODR(s)' is already selected.")
+            except Exception as e:
+                print(f"Warning: Could not specifically select 'Outstanding ODR(s)' radio. It might be default or the selector failed. \nError: {e}")
 
         # 2. Select Zone "ECO"
         print("Locating Zone dropdown...")
-        try:
-            # Look for a select element that contains "ECO" option
-            zone_dropdown_element = wait.until(EC.presence_of_element_located((By.TAG_NAME, "select")))
-            
-            # If there are multiple selects, we might need to be more specific. 
-            # For now, let's try to find the one that has "CR" (default) or "ECO".
-            select = Select(zone_dropdown_element)
-            
-            # Debug: print options to be sure
-            # options = [o.text for o in select.options]
-            # print(f"Dropdown options found: {options[:5]}...")
-
-            select.select_by_value('ECO') 
-            print("Selected Zone 'ECO'.")
-        except Exception as e:
-            print(f"Could not select 'ECO' by value. Trying by visible text...")
+        with timer.phase("zone_select"):
             try:
-                select.select_by_visible_text('ECO')
-                print("Selected Zone 'ECO' by text.")
-            except Exception as e2:
-                 print(f"Error selecting Zone: {e2}")
+                # Look for a select element that contains "ECO" option
+                zone_dropdown_element = wait.until(EC.presence_of_element_located((By.TAG_NAME, "select")))
+
+                # If there are multiple selects, we might need to be more specific.
+                # For now, let's try to find the one that has "CR" (default) or "ECO".
+                select = Select(zone_dropdown_element)
+
+                # Debug: print options to be sure
+                # options = [o.text for o in select.options]
+                # print(f"Dropdown options found: {options[:5]}...")
+
+                select.select_by_value('ECO')
+                print("Selected Zone 'ECO'.")
+            except Exception:
+                print("Could not select 'ECO' by value. Trying by visible text...")
+                try:
+                    select.select_by_visible_text('ECO')
+                    print("Selected Zone 'ECO' by text.")
+                except Exception as e2:
+                     print(f"Error selecting Zone: {e2}")
 
         # 3. Handling CAPTCHA
         print("\nPlease look at the browser window causing the CAPTCHA image.")
         captcha_input = input("Enter the CAPTCHA text shown in the browser: ")
 
         print("Locating CAPTCHA input field...")
-        # Assuming the input is near the captcha image or by name/id. 
-        # Common IDs/Names: 'txtCaptcha', 'captcha', 'securityCode'. 
-        # Since I can't see the source, I'll try generic input text fields.
-        try:
-             # Try identifying the input field. 
-             # Usually the captcha input is type='text' and often has a max length or specific class.
-             # We can try to find the input that is empty and visible.
-            captcha_box = driver.find_element(By.ID, "txtCaptcha") # Common guess
-        except:
+        with timer.phase("submit"):
+            # Assuming the input is near the captcha image or by name/id.
+            # Common IDs/Names: 'txtCaptcha', 'captcha', 'securityCode'.
+            # Since I can't see the source, I'll try generic input text fields.
             try:
-                 captcha_box = driver.find_element(By.NAME, "txtCaptcha")
+                 # Try identifying the input field.
+                 # Usually the captcha input is type='text' and often has a max length or specific class.
+                 # We can try to find the input that is empty and visible.
+                captcha_box = driver.find_element(By.ID, "txtCaptcha") # Common guess
             except:
-                 # Fallback: find all text inputs and ask user which one or pick the most likely (e.g. following the zone dropdown)
-                 inputs = driver.find_elements(By.CSS_SELECTOR, "input[type='text']")
-                 print(f"Found {len(inputs)} text inputs. Using the last one (often captcha).")
-                 captcha_box = inputs[-1]
-        
-        captcha_box.clear()
-        captcha_box.send_keys(captcha_input)
-        print("Entered CAPTCHA.")
-
-        # 4. Submit
-        print("Locating Submit button...")
-        try:
-            submit_btn = driver.find_element(By.XPATH, "//input[@type='button' and @value='Submit'] | //button[text()='Submit']")
-            submit_btn.click()
-            print("Clicked Submit.")
-        except Exception as e:
-            print(f"Error finding Submit button: {e}")
-            # Try JavaScript click if standard click fails
+                try:
+                     captcha_box = driver.find_element(By.NAME, "txtCaptcha")
+                except:
+                     # Fallback: find all text inputs and ask user which one or pick the most likely (e.g. following the zone dropdown)
+                     inputs = driver.find_elements(By.CSS_SELECTOR, "input[type='text']")
+                     print(f"Found {len(inputs)} text inputs. Using the last one (often captcha).")
+                     captcha_box = inputs[-1]
+
+            captcha_box.clear()
+            captcha_box.send_keys(captcha_input)
+            print("Entered CAPTCHA.")
+
+            # 4. Submit
+            print("Locating Submit button...")
+            mark_results_stale(driver)
             try:
-                print("Attempting JavaScript click...")
-                driver.execute_script("arguments[0].click();", submit_btn)
-            except:
-                 pass
+                submit_btn = driver.find_element(By.XPATH, "//input[@type='button' and @value='Submit'] | //button[text()='Submit']")
+                submit_btn.click()
+                print("Clicked Submit.")
+            except Exception as e:
+                print(f"Error finding Submit button: {e}")
+                # Try JavaScript click if standard click fails
+                try:
+                    print("Attempting JavaScript click...")
+                    driver.execute_script("arguments[0].click();", submit_btn)
+                except:
+                     pass
 
         # 5. Extract Data
         print("Waiting for data table to load...")
-        time.sleep(10) # wait for iframe load
-        
+        start = time.perf_counter()
+        with timer.phase("table_complete"):
+            try:
+                wait_for_results(driver, timer, timeout=300)
+                print(f"Results ready after {time.perf_counter() - start:.1f}s.")
+            except ReadinessError as e:
+                outcome = "server_error"
+                print(e)
+            except ReadinessTimeout as e:
+                print(f"{e} Attempting extraction anyway...")
+
         try:
             print("Switching to results iframe...")
-            # Switch to the iframe where results are loaded
-            driver.switch_to.frame("frmDtls")
-            
-            from io import StringIO
-            # Locate table by ID or tag
-            # We will grab the page source and use pandas
-            dfs = pd.read_html(StringIO(driver.page_source))
-            
-            # Filter for the correct table. It likely has many rows or specific headers.
-            # We'll save the largest table found.
-            target_df = None
-            max_rows = 0
-            
-            for i, df in enumerate(dfs):
-                print(f"Table {i}: {df.shape} shape")
-                if df.shape[0] > max_rows:
-                    max_rows = df.shape[0]
-                    target_df = df
-            
+            with timer.phase("html_fetch"):
+                # Switch to the iframe where results are loaded
+                driver.switch_to.frame("frmDtls")
+                page_source = driver.page_source
+            stats["html_bytes"] = len(page_source)
+
+            # Stream-parse the results table out of the frame
+            with timer.phase("parse"):
+                target_df = parse_fois_table(page_source)
+
             if target_df is not None:
+                print(f"Results table: {target_df.shape} shape")
+                stats["rows"] = len(target_df)
                 output_file = "fois_data.xlsx"
-                try:
-                    target_df.to_excel(output_file) # Default index=True handles MultiIndex columns
-                except:
-                     # Fallback: flatten columns
-                    target_df.columns = [' '.join(map(str, col)).strip() if isinstance(col, tuple) else col for col in target_df.columns]
-                    target_df.to_excel(output_file, index=False)
+                with timer.phase("export"):
+                    export(target_df, output_file)
+                outcome = "ok"
                 print(f"Data successfully saved to {output_file}")
+                if HISTORY_DIR:
+                    HistoryStore(HISTORY_DIR).append(target_df, labels["query"], labels["zone"], labels["period"])
             else:
+                if outcome != "server_error":
+                    outcome = "no_data"
                 print("No data tables found in the response.")
-                if "WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY" in driver.page_source:
+                if "WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY" in page_source:
+                    outcome = "server_error"
                     print("Server Error detected: 'WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY'.")
-                
+
                 with open("debug_iframe_source.html", "w", encoding="utf-8") as f:
-                    f.write(driver.page_source)
+                    f.write(page_source)
                 print("Saved debug_iframe_source.html for inspection.")
-                
+
             # Switch back to default content if needed later
             driver.switch_to.default_content()
 
@@ -164,8 +192,261 @@ def main():
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
+        print("Timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in timer.timings.items()))
+        record_query(timer, labels, outcome, stats)
         input("Press Enter to close the browser...")
         driver.quit()
 
+def batch_main(argv=None):
+    """Runs one query across several zones/query types/periods concurrently.
+
+    CAPTCHAs are saved as PNG files and asked for one after another while the
+    other jobs keep loading or fetching.
+    """
+    parser = argparse.ArgumentParser(prog="extract_fois_data.py batch", description=batch_main.__doc__)
+    parser.add_argument("--zones", nargs="+", default=ZONES, choices=ZONES, metavar="ZONE",
+                        help="Zones to query (default: all)")
+    parser.add_argument("--queries", nargs="+", default=["ODR_RK_OTSG"], choices=list(QUERY_TYPES.values()),
+                        help="Query types (default: ODR_RK_OTSG)")
+    parser.add_argument("--periods", nargs="+", default=["7"], choices=PERIODS,
+                        help="Periods for MATURED_INDENTS (default: 7)")
+    parser.add_argument("--engine", default="http", choices=list(ENGINES))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Concurrent sessions; keeps the load on FOIS bounded")
+    parser.add_argument("--captcha-dir", default="captchas", help="Where CAPTCHA images are saved")
+    parser.add_argument("--output", default="fois_batch.xlsx",
+                        help="Output file; the format follows the extension (.xlsx, .csv, .csv.gz, .parquet, .arrow)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached results and query FOIS again")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="New CAPTCHAs to ask for when FOIS cannot process a query")
+    parser.add_argument("--auto-solve", action="store_true",
+                        help="Solve CAPTCHAs with the trained offline model; ask only when it is unsure")
+    parser.add_argument("--trace", help="Append a JSON line per query to this file")
+    parser.add_argument("--profile", choices=["cprofile", "pyinstrument"], help="Profile every query")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--record", metavar="DIR", help="Save every page seen to DIR for offline replay (fois_replay.py)")
+    parser.add_argument("--driver-profile", default=DEFAULT_PROFILE, choices=list(PROFILES),
+                        help=f"Chrome launch profile for the selenium engine (default: {DEFAULT_PROFILE})")
+    parser.add_argument("--history", default=HISTORY_DIR,
+                        help="Append results to this history store (history.py); empty disables")
+    args = parser.parse_args(argv)
+
+    configure_instrumentation(trace_file=args.trace, profile=args.profile)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    solver = load_solver() if args.auto_solve else None
+    if args.auto_solve and solver is None:
+        parser.error(f"No CAPTCHA model at {MODEL_PATH}; run 'python captcha_solver.py train' first.")
+
+    recorder = Recorder(args.record) if args.record else None
+    if args.engine == "selenium":
+        factory = lambda: SeleniumExtractor(setup_driver(args.driver_profile), recorder=recorder)
+    else:
+        factory = lambda: HttpExtractor(recorder=recorder)
+
+    jobs = build_jobs(args.queries, args.zones, args.periods)
+    print(f"Running {len(jobs)} jobs on {args.workers} workers ({args.engine} engine)...")
+    # Cached results never reach the portal, so a recording run always queries it
+    cache = None if args.no_cache or args.record else ResultCache()
+    run = BatchRun(jobs, factory, max_workers=args.workers, cache=cache, max_retries=args.retries,
+                   solver=solver, history=HistoryStore(args.history) if args.history else None).start()
+
+    prompt = prompt_solver(args.captcha_dir)
+    try:
+        while not run.done:
+            request = run.next_captcha(timeout=0.5)
+            if request is None:
+                continue
+            answer = prompt(request.image, request.job)
+            if answer:
+                request.solve(answer)
+            else:
+                request.skip()
+    except KeyboardInterrupt:
+        print("Cancelling...")
+        run.cancel()
+    run.wait()
+
+    print(run.summary().to_string(index=False))
+    phases = METRICS.percentiles("fois_phase_seconds", by=("phase",))
+    if phases:
+        print("Phase latency: " + ", ".join(f"{p['phase']} p50 {p['p50']:.2f}s p95 {p['p95']:.2f}s" for p in phases))
+        print(f"Server error rate: {METRICS.server_error_rate():.0%}")
+    merged = run.results()
+    if merged is None:
+        print("No data extracted.")
+        return
+    export(merged, args.output)
+    print(f"{len(merged)} rows from {merged['zone'].nunique()} zone(s) saved to {args.output}")
+
+def file_answers(captcha_dir, timeout):
+    """Saves each CAPTCHA as <label>.png and waits for the answer in <label>.txt next to it."""
+    def solve(image, job):
+        path = save_captcha(captcha_dir, job, image)
+        answer_path = path[:-len(".png")] + ".txt"
+        print(f"[{job.label}] CAPTCHA saved to {path}; waiting for {answer_path}", file=sys.stderr, flush=True)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if os.path.exists(answer_path):
+                # Give the writer a moment to finish the file
+                time.sleep(0.2)
+                with open(answer_path, encoding="utf-8") as f:
+                    answer = f.read().strip()
+                os.remove(answer_path)
+                return answer or None
+            time.sleep(0.5)
+        return None
+    return solve
+
+
+def extract_main(argv=None):
+    """Extracts one query for one or more zones without any prompts on stdout.
+
+    Rows are written as NDJSON or CSV while the results table is still being
+    parsed, each with zone, query, period and attempt fields, so a pipeline
+    can start on them straight away. If an attempt fails after some of its
+    rows were written, stderr names it; its rows should be discarded. Other
+    formats (xlsx, parquet, ...) are written to --output once every zone is
+    done. CAPTCHAs are answered by the offline model (--auto-solve), a
+    command (--solver-command), answer files or stdin, in that order.
+    Progress and errors go to stderr; the exit status is 0 if every zone
+    returned data, 2 if some did, 1 if none did.
+    """
+    parser = argparse.ArgumentParser(prog="extract_fois_data.py extract", description=extract_main.__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query", default="ODR_RK_OTSG", choices=list(QUERY_TYPES.values()))
+    parser.add_argument("--zones", nargs="+", default=["ECO"], choices=ZONES, metavar="ZONE")
+    parser.add_argument("--period", choices=PERIODS, help="Period for MATURED_INDENTS (default: 7)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS),
+                        help="Output format (default: from the --output extension, else ndjson)")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout (ndjson and csv only)")
+    parser.add_argument("--engine", default="http", choices=list(ENGINES))
+    parser.add_argument("--url", default=FOIS_URL, help="FOIS form URL, e.g. a fois_replay.py server")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Zones queried at once")
+    parser.add_argument("--captcha", default="stdin", choices=["stdin", "file"],
+                        help="stdin: read each answer as a line of stdin; file: wait for "
+                             "CAPTCHA_DIR/<label>.txt next to the saved image")
+    parser.add_argument("--captcha-dir", default="captchas", help="Where CAPTCHA images are saved")
+    parser.add_argument("--captcha-timeout", type=int, default=900, help="Seconds to wait for an answer")
+    parser.add_argument("--solver-command", help="Command that reads a CAPTCHA PNG on stdin and prints the answer")
+    parser.add_argument("--auto-solve", action="store_true", help="Try the trained offline CAPTCHA model first")
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES,
+                        help="New CAPTCHAs to ask for when FOIS cannot process a query")
+    parser.add_argument("--driver-profile", default=DEFAULT_PROFILE, choices=list(PROFILES),
+                        help="Chrome launch profile for the selenium engine")
+    parser.add_argument("--history", default=HISTORY_DIR,
+                        help="Append results to this history store (history.py); empty disables")
+    args = parser.parse_args(argv)
+
+    fmt = args.format or (format_for_path(args.output) if args.output != "-" else "ndjson")
+    if args.output == "-" and fmt not in STREAM_FORMATS:
+        parser.error(f"Only {' and '.join(STREAM_FORMATS)} can be written to stdout; pass --output FILE for {fmt}.")
+    period = (args.period or "7") if args.query == "MATURED_INDENTS" else None
+
+    auto_solver = load_solver() if args.auto_solve else None
+    if args.auto_solve and auto_solver is None:
+        parser.error(f"No CAPTCHA model at {MODEL_PATH}; run 'python captcha_solver.py train' first.")
+    if args.solver_command:
+        solver = CommandSolver(args.solver_command, timeout=args.captcha_timeout)
+    elif args.captcha == "file":
+        solver = file_answers(args.captcha_dir, args.captcha_timeout)
+    else:
+        # stdout carries the rows, so the prompts go to stderr
+        solver = prompt_solver(args.captcha_dir, out=sys.stderr)
+
+    # stdout carries the rows; everything else that would print there goes to stderr
+    out = sys.stdout
+    streaming = fmt in STREAM_FORMATS
+    target = None
+    if streaming:
+        target = out if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    writer = RowWriter(target, fmt) if streaming else None
+    # Set when the reader went away (e.g. "| head"); the remaining work is cancelled
+    closed = threading.Event()
+    # Job label -> the RowFeed that streamed its rows
+    feeds = {}
+
+    def new_extractor():
+        if args.engine == "selenium":
+            extractor = SeleniumExtractor(setup_driver(args.driver_profile), url=args.url)
+        else:
+            extractor = HttpExtractor(args.url)
+        if writer is not None:
+            def on_rows(columns, rows):
+                labels = extractor.labels
+                fields = {"zone": labels.get("zone"), "query": labels.get("query"), "period": labels.get("period"),
+                          "attempt": feed.attempt}
+                feeds["/".join(str(labels[k]) for k in ("zone", "query", "period") if labels.get(k))] = feed
+                try:
+                    writer.write([{**fields, **dict(zip(columns, row))} for row in rows])
+                except BrokenPipeError:
+                    closed.set()
+                    extractor.cancel()
+            feed = extractor.progress = RowFeed(on_rows)
+        return extractor
+
+    jobs = build_jobs([args.query], args.zones, [period] if period else [])
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            run = BatchRun(jobs, new_extractor, max_workers=args.workers, max_retries=args.retries,
+                           captcha_timeout=args.captcha_timeout, solver=auto_solver,
+                           history=HistoryStore(args.history) if args.history else None).start()
+            try:
+                while not run.done:
+                    if closed.is_set():
+                        run.cancel()
+                    request = run.next_captcha(timeout=0.5)
+                    if request is None:
+                        continue
+                    if closed.is_set():
+                        request.skip()
+                        continue
+                    try:
+                        answer = solver(request.image, request.job)
+                    except Exception as e:
+                        print(f"[{request.job.label}] CAPTCHA solver failed: {e}")
+                        answer = None
+                    if answer:
+                        request.solve(answer, solver=getattr(solver, "name", MANUAL))
+                    else:
+                        request.skip()
+            except KeyboardInterrupt:
+                print("Cancelling...")
+                run.cancel()
+            run.wait()
+
+            for job in run.jobs:
+                rows = len(job.df) if job.df is not None else 0
+                print(f"[{job.label}] {job.status}: {rows} rows{' (' + job.error + ')' if job.error else ''}")
+                # Rows already streamed by attempts that then failed can't be taken back; say which to drop
+                feed = feeds.get(job.label)
+                incomplete = list(feed.discarded) if feed is not None else []
+                if feed is not None and feed.sent and job.df is None:
+                    incomplete.append((feed.attempt, feed.sent))
+                for attempt, sent in incomplete:
+                    print(f"[{job.label}] attempt {attempt} failed after {sent} streamed rows; "
+                          f"discard the rows with attempt {attempt}")
+            merged = run.results()
+            if not streaming and merged is not None:
+                export(merged, args.output, fmt)
+                print(f"{len(merged)} rows saved to {args.output}")
+    finally:
+        if closed.is_set():
+            # Nothing reads stdout any more; keep the interpreter from failing to flush it at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), out.fileno())
+        elif target is not None and target is not out:
+            target.close()
+
+    if closed.is_set():
+        sys.exit(0)
+    succeeded = sum(job.df is not None for job in run.jobs)
+    sys.exit(0 if succeeded == len(run.jobs) else 2 if succeeded else 1)
+
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == "extract":
+        extract_main(sys.argv[2:])
+    else:
+        main()
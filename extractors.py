@@ -0,0 +1,646 @@
+import os
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from captcha_solver import MANUAL, capture_captcha, record_answer
+from fois_parser import CHUNK_SIZE, parse_fois_table
+from fois_replay import Recorder
+from instrumentation import METRICS, profiled, record_query
+from readiness import (
+    INVALID_CAPTCHA_TEXT, SERVER_ERROR_TEXT, QueryCancelled, QueryTimer, ReadinessError, ReadinessTimeout,
+    mark_results_stale, refresh_captcha, wait_for_captcha, wait_for_document, wait_for_results,
+)
+from resilience import ZONE_BREAKER, backoff_delay
+
+PORTAL_URL = "https://www.fois.indianrail.gov.in/FOISWebPortal/pages/FWP_ODROtsgDtls.jsp"
+FOIS_URL = os.environ.get("FOIS_URL", PORTAL_URL)
+
+# UI label -> value of the query-type radio button on the FOIS form
+QUERY_TYPES = {
+    "Outstanding ODR(s)": "ODR_RK_OTSG",
+    "Matured Indents (Last 30 Days)": "MATURED_INDENTS",
+}
+
+ZONES = [
+    "CR", "DFCR", "EC", "ECO", "ER", "KR", "NC", "NE", "NF",
+    "NPLR", "NR", "NW", "SC", "SE", "SEC", "SR", "SW", "WC", "WR"
+]
+
+PERIODS = ["7", "15", "30"]
+
+# When set, every page the extractors see is saved here for fois_replay.py
+RECORD_DIR = os.environ.get("FOIS_RECORD_DIR")
+
+
+
+class FoisServerError(Exception):
+    """FOIS answered with its 'unable to process' page."""
+
+
+class CaptchaRejected(Exception):
+    """FOIS answered that the CAPTCHA text was wrong."""
+
+
+# Failures that mean the portal itself is struggling; they count against the zone's breaker.
+# SeleniumExtractor adds Selenium's own timeout, so the http engine never loads Selenium.
+PORTAL_TIMEOUTS = (ReadinessTimeout, requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+
+def parse_results(html, progress=None):
+    """Returns the results table in the frmDtls HTML as a typed DataFrame, or None."""
+    return parse_fois_table(html, progress=progress)
+
+
+class BaseExtractor:
+    """Common interface of the extraction engines.
+
+    A query is a two-step round trip: ``load()`` fills in the form and returns
+    the CAPTCHA as PNG bytes, ``submit()`` sends the CAPTCHA answer and returns
+    the HTML of the frmDtls results frame. Engines implement ``_load()`` and
+    ``submit()``; every query is recorded in the instrumentation metrics.
+    With a ``recorder`` (a fois_replay.Recorder), the form, CAPTCHA and
+    results pages are saved for offline replay.
+    """
+
+    engine = None
+    # Exceptions that count as the portal timing out
+    portal_timeouts = PORTAL_TIMEOUTS
+
+    def __init__(self, url=FOIS_URL, timeout=300, recorder=None):
+        self.url = url
+        # Only the live portal checks CAPTCHA answers; a stand-in's are no use as training labels
+        self.live = urlsplit(url).hostname == urlsplit(PORTAL_URL).hostname
+        self.recorder = recorder if recorder is not None else (Recorder(RECORD_DIR) if RECORD_DIR else None)
+        # Latency budget of one query, spread over all of its phases
+        self.timeout = timeout
+        self.warnings = []
+        self.timer = QueryTimer(timeout)
+        # engine/query/zone/period of the current query, and its html_bytes/rows/retries
+        self.labels = {"engine": self.engine}
+        self.stats = {}
+        # The CAPTCHA last returned by load()/retry()/reload_captcha()
+        self.captcha_image = None
+        # Called with the results table as its rows are parsed (fois_parser.iter_tables);
+        # its reset(), if it has one, is called before every attempt
+        self.progress = None
+
+    @property
+    def timings(self):
+        """Seconds spent per phase of the current query."""
+        return self.timer.timings
+
+    def load(self, query_type, zone, period=None):
+        """Opens the form for a query and returns the CAPTCHA image as PNG bytes.
+
+        Raises resilience.CircuitOpen while the zone's breaker is open.
+        """
+        ZONE_BREAKER.check(zone)
+        self._start_query(query_type, zone, period)
+        try:
+            with profiled(f"{zone}_{query_type}_load"):
+                self.captcha_image = self._load(query_type, zone, period)
+                return self.captcha_image
+        except self.portal_timeouts:
+            self._finish("timeout")
+            raise
+        except Exception:
+            self._finish("load_error")
+            raise
+
+    def extract(self, captcha_text, solver=MANUAL):
+        """Submits the CAPTCHA and parses the results table.
+
+        Raises CaptchaRejected if FOIS says the answer was wrong. ``solver``
+        names who answered the CAPTCHA, for the solver accuracy metrics.
+        Raises QueryCancelled after cancel() was called from another thread.
+        """
+        outcome = "error"
+        reset = getattr(self.progress, "reset", None)
+        if reset is not None:
+            reset()
+        try:
+            with profiled(f"{self.labels.get('zone')}_{self.labels.get('query')}_extract"):
+                df = self._extract(captcha_text)
+            outcome = "ok" if df is not None else "no_data"
+            self.stats["rows"] = 0 if df is None else len(df)
+            record_answer(self.captcha_image, captcha_text, True, solver, label=self.live)
+            return df
+        except CaptchaRejected:
+            outcome = "captcha_rejected"
+            record_answer(self.captcha_image, captcha_text, False, solver)
+            raise
+        except QueryCancelled:
+            outcome = "cancelled"
+            raise
+        except FoisServerError:
+            outcome = "server_error"
+            raise
+        except self.portal_timeouts:
+            outcome = "timeout"
+            raise
+        finally:
+            self._finish(outcome)
+
+    def cancel(self):
+        """Asks the running query to stop at its next wait or chunk; safe from any thread."""
+        self.timer.cancel()
+
+    def retry(self, attempt):
+        """Gets a new CAPTCHA for the current query after FOIS failed it.
+
+        Waits a jittered exponential backoff first, then stays in the same
+        browser/session and, where the form is still on screen, fetches only
+        a new CAPTCHA. Raises resilience.CircuitOpen if the zone's breaker
+        opened in the meantime, and QueryCancelled after cancel().
+        """
+        query_type, zone = self.labels["query"], self.labels["zone"]
+        # Sleep in short steps, so cancel() stops the query during the backoff too
+        deadline = time.monotonic() + backoff_delay(attempt)
+        while True:
+            self.timer.check_cancelled()
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            time.sleep(min(left, 0.1))
+        ZONE_BREAKER.check(zone)
+        METRICS.inc("fois_query_retries_total", engine=self.engine, query=query_type, zone=zone)
+        return self.reload_captcha(attempt)
+
+    def reload_captcha(self, attempt=None):
+        """Gets a new CAPTCHA for the current query right away, e.g. after a wrong answer."""
+        query_type, zone, period = self.labels["query"], self.labels["zone"], self.labels.get("period")
+        self._start_query(query_type, zone, period)
+        if attempt is not None:
+            self.stats["attempt"] = attempt
+        try:
+            with profiled(f"{zone}_{query_type}_reload"):
+                self.captcha_image = self._refresh_captcha()
+                return self.captcha_image
+        except self.portal_timeouts:
+            self._finish("timeout")
+            raise
+        except Exception:
+            self._finish("load_error")
+            raise
+
+    def _load(self, query_type, zone, period=None):
+        raise NotImplementedError
+
+    def _refresh_captcha(self):
+        return self._load(self.labels["query"], self.labels["zone"], self.labels.get("period"))
+
+    def submit(self, captcha_text):
+        raise NotImplementedError
+
+    def _extract(self, captcha_text):
+        html = self.submit(captcha_text)
+        # Characters; the FOIS pages are ASCII, so this is also the byte count
+        self.stats["html_bytes"] = len(html or "")
+        self._record_results(html)
+        with self.timer.phase("parse"):
+            df = parse_results(html, progress=self.progress)
+        if df is None:
+            self._check_captcha(html or "")
+        return df
+
+    @staticmethod
+    def _check_captcha(page):
+        if INVALID_CAPTCHA_TEXT in page.upper():
+            raise CaptchaRejected("FOIS rejected the CAPTCHA text.")
+
+    def _finish(self, outcome):
+        """Records the query and reports it to the zone's circuit breaker."""
+        record_query(self.timer, self.labels, outcome, self.stats)
+        zone = self.labels.get("zone")
+        if outcome in ("ok", "no_data"):
+            ZONE_BREAKER.record_success(zone)
+        elif outcome in ("server_error", "timeout"):
+            ZONE_BREAKER.record_failure(zone)
+
+    def _record_results(self, html):
+        if self.recorder is not None and html:
+            labels = self.labels
+            self.recorder.save_results(labels["query"], labels["zone"], labels.get("period"), html)
+
+    def _start_query(self, query_type, zone, period=None):
+        self.warnings = []
+        self.timer = QueryTimer(self.timeout)
+        self.labels = {"engine": self.engine, "query": query_type, "zone": zone, "period": period}
+        self.stats = {"retries": 0}
+
+    def close(self, broken=False):
+        pass
+
+    def _warn(self, message):
+        self.warnings.append(message)
+        print(f"Warning: {message}")
+
+
+# --- Selenium engine ---
+
+class SeleniumExtractor(BaseExtractor):
+    """Drives a real browser through the FOIS form."""
+
+    engine = "selenium"
+
+    def __init__(self, driver, url=FOIS_URL, timeout=300, release=None, recorder=None):
+        from selenium.common.exceptions import TimeoutException
+
+        super().__init__(url, timeout, recorder)
+        self.portal_timeouts = PORTAL_TIMEOUTS + (TimeoutException,)
+        self.driver = driver
+        # Called instead of driver.quit() on close, e.g. DriverPool.checkin
+        self.release = release
+
+    def _load(self, query_type, zone, period=None):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import Select, WebDriverWait
+
+        driver = self.driver
+        timer = self.timer
+        wait = WebDriverWait(driver, 15)
+
+        with timer.phase("navigate"):
+            driver.switch_to.default_content()
+            driver.get(self.url)
+            wait_for_document(driver, timer)
+        if self.recorder is not None:
+            self.recorder.save_form(driver.page_source)
+
+        with timer.phase("query_select"):
+            # A. Select Query Type
+            try:
+                radio_btn = wait.until(EC.element_to_be_clickable((By.CSS_SELECTOR, f"input[value='{query_type}']")))
+                if not radio_btn.is_selected():
+                    radio_btn.click()
+                    # The radio may reload the form; wait for it instead of sleeping
+                    wait_for_document(driver, timer, timeout=15)
+            except Exception as e:
+                self._warn(f"Could not select Query Type (might be default). Error: {e}")
+
+        with timer.phase("zone_select"):
+            # B. Select Zone
+            select = None
+            try:
+                zone_dropdown = wait.until(EC.presence_of_element_located((By.TAG_NAME, "select")))
+                select = Select(zone_dropdown)
+                select.select_by_value(zone)
+            except Exception:
+                try:
+                    select.select_by_visible_text(zone)
+                except Exception as e:
+                    self._warn(f"Failed to select Zone {zone}: {e}")
+
+            # C. Select Period
+            if period:
+                try:
+                    period_rad = driver.find_element(By.CSS_SELECTOR, f"input[name='Optn'][value='{period}']")
+                    if not period_rad.is_selected():
+                        period_rad.click()
+                except Exception as e:
+                    self._warn(f"Could not select Period: {e}")
+
+        return self._capture_captcha()
+
+    def _refresh_captcha(self):
+        self.driver.switch_to.default_content()
+        if not refresh_captcha(self.driver):
+            # The error page replaced the form; load it again in the same browser
+            return self._load(self.labels["query"], self.labels["zone"], self.labels.get("period"))
+        return self._capture_captcha()
+
+    def _capture_captcha(self):
+        """Waits for the CAPTCHA image and returns it as PNG bytes, cropped to the image."""
+        timer = self.timer
+        with timer.phase("captcha"):
+            try:
+                wait_for_captcha(self.driver, timer, timeout=15)
+            except ReadinessTimeout:
+                self._warn("CAPTCHA image did not finish loading.")
+
+        with timer.phase("screenshot"):
+            image = capture_captcha(self.driver)
+        if self.recorder is not None:
+            self.recorder.save_captcha(image)
+        return image
+
+    def submit(self, captcha_text):
+        from selenium.webdriver.common.by import By
+
+        driver = self.driver
+        timer = self.timer
+
+        with timer.phase("submit"):
+            # 1. Enter CAPTCHA
+            try:
+                try:
+                    captcha_box = driver.find_element(By.ID, "txtCaptcha")
+                except Exception:
+                    captcha_box = driver.find_element(By.NAME, "txtCaptcha")
+                captcha_box.clear()
+                captcha_box.send_keys(captcha_text)
+            except Exception:
+                inputs = driver.find_elements(By.CSS_SELECTOR, "input[type='text']")
+                if inputs:
+                    inputs[-1].send_keys(captcha_text)
+
+            # 2. Click Submit
+            mark_results_stale(driver)
+            submitted_at = time.perf_counter()
+            submit_btn = driver.find_element(By.XPATH, "//input[@type='button' and @value='Submit'] | //button[text()='Submit']")
+            try:
+                submit_btn.click()
+            except Exception:
+                driver.execute_script("arguments[0].click();", submit_btn)
+
+        # 3. Wait for the frame to hold a complete answer (or the error sentinel)
+        with timer.phase("table_complete"):
+            try:
+                state = wait_for_results(driver, timer, submitted_at=submitted_at)
+            except ReadinessError as e:
+                raise FoisServerError(str(e))
+            except ReadinessTimeout:
+                state = None
+                self._warn("Table might not have loaded fully, attempting extraction anyway...")
+
+        with timer.phase("html_fetch"):
+            if state is not None and not state.get("frame"):
+                # FOIS answered with a whole page instead of filling the frame
+                page = driver.execute_script("return document.body.innerHTML;")
+                self._check_captcha(page)
+                return page
+            driver.switch_to.frame("frmDtls")
+            try:
+                # Use JS to get content (faster/safer than page_source)
+                return driver.execute_script("return document.body.innerHTML;")
+            finally:
+                driver.switch_to.default_content()
+
+    def close(self, broken=False):
+        if self.driver is None:
+            return
+        if self.release:
+            self.release(self.driver, broken=broken)
+        else:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.driver = None
+
+
+# --- HTTP engine ---
+
+# One adapter (and therefore one urllib3 connection pool) is shared by every
+# HttpExtractor, while each extractor keeps its own cookie jar: the CAPTCHA is
+# tied to the JSESSIONID of the session that fetched it.
+_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=int(os.environ.get("FOIS_HTTP_POOL_SIZE", "32")),
+    max_retries=Retry(total=2, backoff_factor=0.5, allowed_methods=["GET"]),
+)
+
+
+def new_session():
+    session = requests.Session()
+    session.mount("http://", _ADAPTER)
+    session.mount("https://", _ADAPTER)
+    session.headers["User-Agent"] = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+    return session
+
+
+class FoisForm:
+    """The fields of the FWP_ODROtsgDtls.jsp form, discovered from its HTML."""
+
+    def __init__(self, page_html, page_url):
+        doc = lxml_html.fromstring(page_html, base_url=page_url)
+        doc.make_links_absolute(page_url)
+
+        captcha_inputs = doc.xpath("//input[@id='txtCaptcha' or @name='txtCaptcha']")
+        forms = captcha_inputs[0].xpath("ancestor::form") if captcha_inputs else doc.xpath("//form")
+        form = forms[0] if forms else doc
+
+        self.action = form.get("action") or page_url
+        self.method = (form.get("method") or "post").lower()
+
+        # Hidden fields (view state, tokens) are sent back unchanged
+        self.fields = {}
+        for inp in form.xpath(".//input[@type='hidden' and @name]"):
+            self.fields[inp.get("name")] = inp.get("value", "")
+
+        query_values = set(QUERY_TYPES.values())
+        self.query_field = None
+        for inp in form.xpath(".//input[@type='radio' and @name]"):
+            if inp.get("value") in query_values:
+                self.query_field = inp.get("name")
+                break
+
+        selects = form.xpath(".//select[@name]")
+        self.zone_field = selects[0].get("name") if selects else None
+
+        if captcha_inputs:
+            self.captcha_field = captcha_inputs[0].get("name") or "txtCaptcha"
+        else:
+            text_inputs = form.xpath(".//input[@type='text' and @name]")
+            self.captcha_field = text_inputs[-1].get("name") if text_inputs else "txtCaptcha"
+
+        self.captcha_url = None
+        for img in doc.xpath("//img[@src]"):
+            marker = " ".join([img.get("src", ""), img.get("id", ""), img.get("name", "")]).lower()
+            if "captcha" in marker:
+                self.captcha_url = img.get("src")
+                break
+
+    def build(self, query_type, zone, period=None):
+        data = dict(self.fields)
+        if self.query_field:
+            data[self.query_field] = query_type
+        if self.zone_field:
+            data[self.zone_field] = zone
+        if period:
+            data["Optn"] = period
+        return data
+
+
+class HttpExtractor(BaseExtractor):
+    """Replays the FOIS form submit with plain HTTP requests, no browser."""
+
+    engine = "http"
+
+    def __init__(self, url=FOIS_URL, timeout=300, connect_timeout=10, session=None, recorder=None):
+        super().__init__(url, timeout, recorder)
+        self.connect_timeout = connect_timeout
+        self.session = session or new_session()
+        self.form = None
+        self._data = None
+        self._first_chunk = ""
+
+    def _timeout(self):
+        """Per-request timeout: whatever is left of the query's budget."""
+        self.timer.check_cancelled()
+        remaining = self.timer.remaining()
+        if remaining <= 0:
+            raise ReadinessTimeout(f"Query exceeded its {self.timeout}s budget.")
+        return (min(self.connect_timeout, remaining), remaining)
+
+    def _load(self, query_type, zone, period=None):
+        timer = self.timer
+
+        with timer.phase("navigate"):
+            resp = self._request("get", self.url)
+            resp.raise_for_status()
+
+        if self.recorder is not None:
+            self.recorder.save_form(resp.text)
+
+        with timer.phase("form_fill"):
+            self.form = FoisForm(resp.text, resp.url)
+            self._data = self.form.build(query_type, zone, period)
+
+        if not self.form.query_field:
+            self._warn("Could not find the Query Type radio (might be default).")
+        if not self.form.captcha_url:
+            raise RuntimeError("Could not find the CAPTCHA image on the FOIS form.")
+
+        with timer.phase("captcha"):
+            captcha = self._request("get", self.form.captcha_url)
+            captcha.raise_for_status()
+        if self.recorder is not None:
+            self.recorder.save_captcha(captcha.content)
+        return captcha.content
+
+    def _refresh_captcha(self):
+        if self.form is None or not self.form.captcha_url:
+            return super()._refresh_captcha()
+        # The form fields are already known; a new CAPTCHA is all the retry needs
+        with self.timer.phase("captcha"):
+            captcha = self._request("get", self.form.captcha_url)
+            captcha.raise_for_status()
+        if self.recorder is not None:
+            self.recorder.save_captcha(captcha.content)
+        return captcha.content
+
+    def submit(self, captcha_text):
+        resp, frame_url = self._post_form(captcha_text)
+        if frame_url is None:
+            return resp.text
+
+        with self.timer.phase("table_complete"):
+            start = time.perf_counter()
+            frame = self._request("get", frame_url)
+            self.timer.mark("first_byte", start)
+            frame.raise_for_status()
+            self._record_results(frame.text)
+            self._check_error(frame.text)
+            return frame.text
+
+    def _extract(self, captcha_text):
+        """Streams the frmDtls response straight into the table parser."""
+        resp, frame_url = self._post_form(captcha_text)
+        if frame_url is None:
+            self.stats["html_bytes"] = len(resp.content)
+            self._record_results(resp.text)
+            with self.timer.phase("parse"):
+                df = parse_fois_table(resp.text, progress=self.progress)
+            if df is None:
+                self._check_captcha(resp.text)
+            return df
+
+        with self.timer.phase("table_complete"):
+            start = time.perf_counter()
+            self.stats["html_bytes"] = 0
+            with self._request("get", frame_url, stream=True) as frame:
+                # With stream=True, get() returns as soon as the headers arrive
+                self.timer.mark("first_byte", start)
+                frame.raise_for_status()
+                if frame.encoding is None:
+                    frame.encoding = "utf-8"
+                chunks = frame.iter_content(chunk_size=CHUNK_SIZE, decode_unicode=True)
+                if self.recorder is None:
+                    df = parse_fois_table(self._check_chunks(chunks), progress=self.progress)
+                else:
+                    # Keep the page for the recording while it streams through the parser
+                    page = []
+                    try:
+                        df = parse_fois_table(self._check_chunks(self._tee(chunks, page)), progress=self.progress)
+                    finally:
+                        self._record_results("".join(page))
+        if df is None:
+            # A rejected CAPTCHA is a short page; its first chunk holds the message
+            self._check_captcha(self._first_chunk)
+        return df
+
+    def _post_form(self, captcha_text):
+        """Submits the form; returns the response and the frmDtls URL it points at, if any."""
+        if self.form is None:
+            raise RuntimeError("load() must be called before submit().")
+
+        with self.timer.phase("submit"):
+            data = dict(self._data)
+            data[self.form.captcha_field] = captcha_text
+            if self.form.method == "get":
+                resp = self._request("get", self.form.action, params=data)
+            else:
+                resp = self._request("post", self.form.action, data=data)
+            resp.raise_for_status()
+            if SERVER_ERROR_TEXT in resp.text:
+                self._record_results(resp.text)
+            self._check_error(resp.text)
+
+            # The form either targets the frmDtls iframe directly, or answers with
+            # a page whose frmDtls iframe points at the results
+            doc = lxml_html.fromstring(resp.text)
+            frames = doc.xpath("//iframe[(@id='frmDtls' or @name='frmDtls') and @src]")
+            if not frames:
+                return resp, None
+            return resp, urljoin(resp.url, frames[0].get("src"))
+
+    def _request(self, method, url, **kwargs):
+        """Sends a request within the query's budget, counting transport retries."""
+        resp = self.session.request(method, url, timeout=self._timeout(), **kwargs)
+        retries = getattr(resp.raw, "retries", None)
+        if retries is not None:
+            self.stats["retries"] = self.stats.get("retries", 0) + len(retries.history)
+        return resp
+
+    @staticmethod
+    def _tee(chunks, page):
+        for chunk in chunks:
+            page.append(chunk)
+            yield chunk
+
+    def _check_chunks(self, chunks):
+        # Keep a tail so the sentinel is found even when split across chunks
+        tail = ""
+        self._first_chunk = ""
+        for chunk in chunks:
+            self.timer.check_cancelled()
+            if not self._first_chunk:
+                self._first_chunk = chunk
+            self.stats["html_bytes"] += len(chunk)
+            window = tail + chunk
+            self._check_error(window)
+            tail = window[-len(SERVER_ERROR_TEXT):]
+            yield chunk
+
+    def close(self, broken=False):
+        # Don't session.close(): that would also close the shared adapter
+        self.session.cookies.clear()
+        self.form = None
+
+    @staticmethod
+    def _check_error(page):
+        if SERVER_ERROR_TEXT in page:
+            raise FoisServerError("FOIS Server Error: Unable to process request. Please try again.")
+
+
+ENGINES = {
+    "selenium": SeleniumExtractor,
+    "http": HttpExtractor,
+}
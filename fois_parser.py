@@ -0,0 +1,327 @@
+"""Streaming parser for the FOIS frmDtls results table.
+
+pd.read_html builds a DOM for the whole page and a DataFrame for every table
+on it. This parser feeds the HTML to lxml in chunks, drops each row from the
+tree as soon as it has been read, and recognises the results table by its
+header row instead of keeping every table to pick the largest one.
+
+pandas is only imported once a DataFrame is built, so importing the
+extractors (and loading the app's first page) does not pay for it.
+"""
+import re
+
+from lxml import etree
+
+CHUNK_SIZE = 64 * 1024
+
+# Words found in the header row of the outstanding-ODR and matured-indent
+# tables. A table whose header mentions enough of them is the results table.
+HEADER_KEYWORDS = (
+    "ZONE", "DVSN", "DIVISION", "STTN", "STATION", "ODR", "INDENT", "DATE",
+    "CNSR", "CONSIGNOR", "CMDT", "COMMODITY", "WAGON", "WGON", "RAKE", "TYPE",
+)
+MIN_HEADER_MATCHES = 3
+
+# Columns stored as categoricals (few distinct values, many repeats)
+CATEGORY_KEYWORDS = ("ZONE", "DVSN", "DIVISION", "STTN", "STATION", "CMDT", "COMMODITY", "TYPE")
+
+DATE_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%d-%m-%Y %H:%M", "%d/%m/%Y %H:%M", "%d-%b-%Y", "%Y-%m-%d")
+
+# First cell of a summary row ("Total", "Grand Total", ...), which is not data
+_TOTAL_RE = re.compile(r"^(GRAND |SUB ?-?)?TOTALS?\s*:?$", re.IGNORECASE)
+_INT_RE = re.compile(r"^-?\d+$")
+_NUM_RE = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+class _Table:
+    """Rows collected so far for one <table> element."""
+
+    def __init__(self):
+        self.header_rows = []
+        self.columns = None
+        self.data = None
+        self.n_rows = 0
+        # Set once the </table> has been read
+        self.closed = False
+
+    def add_row(self, cells, all_th):
+        if not cells:
+            return
+        # Leading rows made only of <th> cells form the (possibly multi-level) header
+        if self.columns is None and (all_th or not self.header_rows):
+            self.header_rows.append(cells)
+            if not all_th:
+                self._freeze_header()
+            return
+        if self.columns is None:
+            self._freeze_header()
+
+        width = len(self.columns)
+        # A cell spanning columns (e.g. a "Total" label) fills each of them, as in the header
+        values = [text for text, span in cells for _ in range(span)]
+        # Totals would pollute the typed columns and every sum taken over them
+        first = next((text for text in values if text), "")
+        if _TOTAL_RE.match(first):
+            return
+        if len(values) < width:
+            values += [""] * (width - len(values))
+        for i in range(width):
+            self.data[i].append(values[i])
+        self.n_rows += 1
+
+    def _freeze_header(self):
+        # Expand colspans and join the header levels, like flattening a MultiIndex
+        levels = []
+        for row in self.header_rows:
+            expanded = []
+            for text, span in row:
+                expanded.extend([text] * span)
+            levels.append(expanded)
+        width = max(len(level) for level in levels)
+        columns = []
+        for i in range(width):
+            parts = []
+            for level in levels:
+                text = level[i] if i < len(level) else ""
+                if text and text not in parts:
+                    parts.append(text)
+            columns.append(" ".join(parts) or f"Column {i + 1}")
+        self.columns = _dedupe(columns)
+        self.data = [[] for _ in columns]
+
+    def header_score(self):
+        if self.columns is None:
+            if not self.header_rows:
+                return 0
+            self._freeze_header()
+        score = 0
+        for col in self.columns:
+            upper = col.upper()
+            if any(word in upper for word in HEADER_KEYWORDS):
+                score += 1
+        return score
+
+    def preview(self, limit):
+        """The first ``limit`` rows read so far, as strings; safe while rows are still being added."""
+        import pandas as pd
+
+        if self.columns is None:
+            return None
+        # n_rows only counts rows whose every column has been appended
+        limit = min(limit, self.n_rows)
+        return pd.DataFrame({col: values[:limit] for col, values in zip(self.columns, self.data)},
+                            columns=self.columns)
+
+    def to_frame(self, typed=True):
+        import pandas as pd
+
+        if self.columns is None:
+            self._freeze_header()
+        df = pd.DataFrame(dict(zip(self.columns, self.data)), columns=self.columns)
+        return convert_types(df) if typed else df
+
+
+def _dedupe(columns):
+    seen = {}
+    result = []
+    for col in columns:
+        if col in seen:
+            seen[col] += 1
+            result.append(f"{col}.{seen[col]}")
+        else:
+            seen[col] = 0
+            result.append(col)
+    return result
+
+
+def _cell_text(el):
+    if len(el):
+        text = "".join(el.itertext())
+    else:
+        # Common case: a plain <td>text</td>
+        text = el.text or ""
+    return " ".join(text.split())
+
+
+def _chunks(source, chunk_size):
+    if isinstance(source, (str, bytes)):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        # Any iterable of str/bytes chunks, e.g. requests' iter_content()
+        yield from source
+
+
+def iter_tables(source, chunk_size=CHUNK_SIZE, progress=None):
+    """Yields a _Table for every table in the HTML as soon as it is closed.
+
+    Rows are removed from the lxml tree as they are read, so memory stays
+    proportional to the extracted values rather than to the page. After
+    every chunk, ``progress`` (if given) is called with the open table that
+    has the most rows so far.
+    """
+    parser = etree.HTMLPullParser(events=("start", "end"), tag=("table", "tr"))
+    stack = []
+    for chunk in _chunks(source, chunk_size):
+        parser.feed(chunk)
+        yield from _drain(parser, stack)
+        if progress is not None and stack:
+            progress(max(stack, key=lambda table: table.n_rows))
+    parser.close()
+    yield from _drain(parser, stack)
+
+
+def _drain(parser, stack):
+    for event, el in parser.read_events():
+        if el.tag == "table":
+            if event == "start":
+                stack.append(_Table())
+            elif stack:
+                table = stack.pop()
+                table.closed = True
+                yield table
+                _drop(el)
+        elif event == "end" and stack:
+            # Read a whole row at once; cells of nested tables were dropped already
+            cells = []
+            all_th = True
+            for cell in el:
+                tag = cell.tag
+                if tag == "td":
+                    all_th = False
+                elif tag != "th":
+                    continue
+                span = cell.get("colspan")
+                if span is not None:
+                    try:
+                        span = max(1, int(span))
+                    except ValueError:
+                        span = 1
+                else:
+                    span = 1
+                cells.append((_cell_text(cell), span))
+            stack[-1].add_row(cells, all_th)
+            _drop(el)
+
+
+def _drop(el):
+    el.clear()
+    parent = el.getparent()
+    if parent is not None:
+        parent.remove(el)
+
+
+def parse_fois_table(source, typed=True, chunk_size=CHUNK_SIZE, progress=None):
+    """Returns the FOIS results table from HTML as a DataFrame, or None.
+
+    ``source`` may be a string, bytes, a file object or an iterable of chunks.
+    The first table whose header matches HEADER_KEYWORDS is returned and the
+    rest of the page is not parsed. If no header matches, the table with the
+    most rows is returned, which is what the old read_html path did.
+    ``progress`` is passed on to iter_tables(), and called once more with
+    the finished table that is returned.
+    """
+    fallback = None
+    for table in iter_tables(source, chunk_size=chunk_size, progress=progress):
+        if table.n_rows and table.header_score() >= MIN_HEADER_MATCHES:
+            break
+        if table.n_rows and (fallback is None or table.n_rows > fallback.n_rows):
+            fallback = table
+    else:
+        if fallback is None:
+            return None
+        table = fallback
+    if progress is not None:
+        progress(table)
+    return table.to_frame(typed=typed)
+
+
+class RowFeed:
+    """A ``progress`` callback that hands on the rows of the results table as they are parsed.
+
+    ``on_rows(columns, rows)`` is called with the rows added since the last
+    call, as lists of cell strings (untyped, unlike parse_fois_table()'s
+    result). It follows the first table with rows whose header matches
+    HEADER_KEYWORDS, or the finished table parse_fois_table() fell back to.
+
+    Extractors call reset() before every attempt at a query (a retry, or an
+    answer to a new CAPTCHA), so each attempt's table is followed from its
+    first row. ``attempt`` numbers the attempts from 1, and ``discarded`` lists
+    (attempt, rows) for those that were given up after some of their rows
+    had been handed on.
+    """
+
+    def __init__(self, on_rows):
+        self.on_rows = on_rows
+        self.attempt = 0
+        self.discarded = []
+        self.table = None
+        self.sent = 0
+
+    def reset(self):
+        if self.sent:
+            self.discarded.append((self.attempt, self.sent))
+        self.attempt += 1
+        self.table = None
+        self.sent = 0
+
+    def __call__(self, table):
+        if self.table is None:
+            if table.columns is None or not table.n_rows:
+                return
+            if not table.closed and table.header_score() < MIN_HEADER_MATCHES:
+                return
+            self.table = table
+        elif table is not self.table:
+            return
+        n_rows = table.n_rows
+        if n_rows > self.sent:
+            rows = [[column[i] for column in table.data] for i in range(self.sent, n_rows)]
+            self.sent = n_rows
+            self.on_rows(table.columns, rows)
+
+
+def convert_types(df):
+    """Turns the string columns of a results table into dates, numbers and categoricals."""
+    import pandas as pd
+
+    for col in df.columns:
+        values = df[col]
+        non_empty = values[values != ""]
+        if non_empty.empty:
+            continue
+        upper = str(col).upper()
+
+        if "DATE" in upper or "TIME" in upper:
+            parsed = _parse_dates(values)
+            if parsed is not None:
+                df[col] = parsed
+                continue
+
+        if non_empty.str.match(_NUM_RE).all():
+            numbers = pd.to_numeric(values.replace("", None), errors="coerce")
+            # Counts stay 64-bit: a downcast int8/int16 column overflows silently when summed or diffed
+            if non_empty.str.match(_INT_RE).all():
+                numbers = numbers.astype("int64" if len(non_empty) == len(values) else "Int64")
+            df[col] = numbers
+            continue
+
+        if any(word in upper for word in CATEGORY_KEYWORDS):
+            df[col] = values.astype("category")
+    return df
+
+
+def _parse_dates(values):
+    import pandas as pd
+
+    sample = values[values != ""].head(50)
+    for fmt in DATE_FORMATS:
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().all():
+            return pd.to_datetime(values.replace("", None), format=fmt, errors="coerce")
+    return None
@@ -0,0 +1,364 @@
+"""Record/replay of the FOIS FWP_ODROtsgDtls.jsp form.
+
+A Recorder saves the pages an extractor sees on the live portal (set
+FOIS_RECORD_DIR, or pass ``--record`` to a batch run); ReplayServer serves
+them back from a local port, so the extractors can be exercised and
+benchmarked without the live portal or a real CAPTCHA. A recording
+directory may contain:
+
+    form.html                                   the form page
+    captcha.png                                 the CAPTCHA image
+    results/<QUERY>_<ZONE>[_<PERIOD>].html      a saved frmDtls response
+    results/default.html                        used when no exact match exists
+    errors/*.html                               saved "unable to process" pages
+
+Anything missing is replaced by a built-in synthetic page. The server can
+also imitate a struggling portal: ``delay`` holds every results response
+back, ``chunk_delay`` drips it out in pieces and ``error_rate`` answers
+that share of queries with the error page.
+
+Usage:
+    python fois_replay.py [--dir recordings] [--port 8765] [--captcha ABC12] [--delay 2] [--error-rate 0.1]
+"""
+import argparse
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from readiness import SERVER_ERROR_TEXT
+
+FORM_PATH = "/FOISWebPortal/pages/FWP_ODROtsgDtls.jsp"
+CAPTCHA_PATH = "/FOISWebPortal/Captcha.png"
+RESULTS_PATH = "/FOISWebPortal/pages/FWP_ODROtsgDtlsRslt.jsp"
+
+FORM_HTML = """<html><head><title>FOIS - Outstanding ODR(s)</title></head>
+<body>
+<form name="frmODR" method="post" action="FWP_ODROtsgDtls.jsp" target="_self">
+<input type="hidden" name="hdnAction" value="SUBMIT">
+<table>
+<tr><td><input type="radio" name="rdQryType" value="ODR_RK_OTSG" checked> Outstanding ODR(s)</td>
+<td><input type="radio" name="rdQryType" value="MATURED_INDENTS"> Matured Indents (Last 30 Days)</td></tr>
+<tr><td>Zone</td><td><select name="ddlZone">{zone_options}</select></td></tr>
+<tr><td>Period</td><td>
+<input type="radio" name="Optn" value="7" checked> Last 7 Days
+<input type="radio" name="Optn" value="15"> Last 15 Days
+<input type="radio" name="Optn" value="30"> Last 30 Days</td></tr>
+<tr><td><img id="imgCaptcha" src="../Captcha.png"></td>
+<td><input type="text" id="txtCaptcha" name="txtCaptcha" maxlength="6"></td></tr>
+<tr><td colspan="2"><input type="button" value="Submit" onclick="document.frmODR.submit();"></td></tr>
+</table>
+</form>
+<iframe id="frmDtls" name="frmDtls" {frame_src}width="100%" height="600"></iframe>
+</body></html>
+"""
+
+ERROR_HTML = """<html><body><table><tr><td>
+<b>WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY. PLEASE TRY AFTER SOME TIME.</b>
+</td></tr></table></body></html>
+"""
+
+INVALID_CAPTCHA_HTML = """<html><body><p>Invalid Captcha. Please try again.</p></body></html>
+"""
+
+ZONES = [
+    "CR", "DFCR", "EC", "ECO", "ER", "KR", "NC", "NE", "NF",
+    "NPLR", "NR", "NW", "SC", "SE", "SEC", "SR", "SW", "WC", "WR"
+]
+
+ODR_HEADERS = [
+    "S.No", "Zone", "Division", "Station", "ODR No", "ODR Date", "Consignor",
+    "Commodity", "Wagon Type", "Wagons Demanded", "Wagons Outstanding",
+]
+
+INDENT_HEADERS = [
+    "S.No", "Zone", "Division", "Station", "Indent No", "Indent Date", "Maturity Date",
+    "Consignor", "Commodity", "Wagon Type", "Wagons",
+]
+
+# Bytes written at a time when dripping out a slow response
+SLOW_CHUNK_SIZE = 16 * 1024
+
+_COMMODITIES = ["COAL", "IRON ORE", "CEMENT", "FOODGRAINS", "FERTILIZERS", "CONTAINER", "POL", "STEEL"]
+_WAGON_TYPES = ["BOXN", "BCN", "BTPN", "BOST", "BCNA", "BLC", "BOBRN"]
+
+
+def results_name(query_type, zone, period=None):
+    """File name of a saved frmDtls response in a recording."""
+    return "_".join([query_type, zone] + ([period] if period else [])) + ".html"
+
+
+def sample_png():
+    """A 1x1 grey PNG standing in for the CAPTCHA image."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(b"\x00\x80")) + chunk(b"IEND", b"")
+
+
+def sample_form_html(frame_src=None):
+    zone_options = "".join(f'<option value="{z}">{z}</option>' for z in ZONES)
+    src = f'src="{frame_src}" ' if frame_src else ""
+    return FORM_HTML.format(zone_options=zone_options, frame_src=src)
+
+
+def sample_results_html(query_type, zone, period=None, rows=200, seed=None):
+    """Builds a frmDtls-like page with a title table and one results table."""
+    rng = random.Random(seed if seed is not None else f"{query_type}-{zone}-{period}")
+    matured = query_type == "MATURED_INDENTS"
+    headers = INDENT_HEADERS if matured else ODR_HEADERS
+    today = date(2024, 1, 31)
+
+    parts = [
+        "<html><body>",
+        f"<table><tr><td>Zone: {zone}</td><td>Query: {query_type}</td></tr></table>",
+        '<table border="1"><tr>' + "".join(f"<th>{h}</th>" for h in headers) + "</tr>",
+    ]
+    for i in range(1, rows + 1):
+        division = f"{zone[:2]}{rng.randint(1, 6)}"
+        station = "".join(rng.choice("ABCDEFGHIJKLMNOPRSTUVW") for _ in range(rng.randint(3, 4)))
+        raised = today - timedelta(days=rng.randint(0, 60))
+        consignor = f"M/S {station} TRADERS"
+        commodity = rng.choice(_COMMODITIES)
+        wagon_type = rng.choice(_WAGON_TYPES)
+        if matured:
+            cells = [i, zone, division, station, f"IND{rng.randint(100000, 999999)}",
+                     raised.strftime("%d-%m-%Y"), (raised + timedelta(days=rng.randint(1, 10))).strftime("%d-%m-%Y"),
+                     consignor, commodity, wagon_type, rng.randint(1, 58)]
+        else:
+            demanded = rng.randint(1, 58)
+            cells = [i, zone, division, station, f"ODR{rng.randint(100000, 999999)}",
+                     raised.strftime("%d-%m-%Y"), consignor, commodity, wagon_type,
+                     demanded, rng.randint(0, demanded)]
+        parts.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+    parts.append("</table></body></html>")
+    return "\n".join(parts)
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Request handler; configuration lives on the server object."""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == FORM_PATH:
+            self._send(self.server.form_html(), "text/html")
+        elif url.path == CAPTCHA_PATH:
+            self._send(self.server.captcha_png(), "image/png")
+        elif url.path == RESULTS_PATH:
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            self._send_results(query)
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if urlsplit(self.path).path != FORM_PATH:
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        fields = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+        answer = self.server.captcha_answer
+        if answer and fields.get("txtCaptcha", "").strip().upper() != answer.upper():
+            self._send(INVALID_CAPTCHA_HTML, "text/html")
+            return
+
+        # Like FOIS, answer with the form page whose results frame points at the data
+        params = {
+            "q": fields.get("rdQryType", "ODR_RK_OTSG"),
+            "z": fields.get("ddlZone", "CR"),
+        }
+        if params["q"] == "MATURED_INDENTS":
+            params["p"] = fields.get("Optn", "7")
+        self._send(self.server.form_html(frame_src=f"{RESULTS_PATH}?{urlencode(params)}"), "text/html")
+
+    def _send_results(self, query):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        if server.roll_error():
+            body = server.error_html()
+        else:
+            body = server.results_html(query.get("q", ""), query.get("z", ""), query.get("p"))
+        self._send(body, "text/html", chunk_delay=server.chunk_delay)
+
+    def _send(self, body, content_type, chunk_delay=0):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+            content_type += "; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not chunk_delay:
+            self.wfile.write(body)
+            return
+        try:
+            for start in range(0, len(body), SLOW_CHUNK_SIZE):
+                self.wfile.write(body[start:start + SLOW_CHUNK_SIZE])
+                self.wfile.flush()
+                time.sleep(chunk_delay)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. a cancelled extraction
+            pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Serves a recording directory, falling back to synthetic pages."""
+
+    daemon_threads = True
+
+    def __init__(self, address, directory=None, captcha_answer=None, rows=200, verbose=False,
+                 delay=0.0, chunk_delay=0.0, error_rate=0.0, seed=0):
+        super().__init__(address, ReplayHandler)
+        self.directory = directory
+        self.captcha_answer = captcha_answer
+        self.rows = rows
+        self.verbose = verbose
+        # Seconds before each results response, and between its chunks
+        self.delay = delay
+        self.chunk_delay = chunk_delay
+        # Share of results responses replaced by the "unable to process" page
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def form_url(self):
+        return self.base_url + FORM_PATH
+
+    def _read(self, *parts, binary=False):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, *parts)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb" if binary else "r", **({} if binary else {"encoding": "utf-8"})) as f:
+            return f.read()
+
+    def form_html(self, frame_src=None):
+        saved = self._read("form.html")
+        if saved is None:
+            return sample_form_html(frame_src)
+        if frame_src:
+            saved = saved.replace('id="frmDtls"', f'id="frmDtls" src="{frame_src}"', 1)
+        return saved
+
+    def captcha_png(self):
+        return self._read("captcha.png", binary=True) or sample_png()
+
+    def roll_error(self):
+        if not self.error_rate:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+    def error_html(self):
+        errors = os.path.join(self.directory, "errors") if self.directory else None
+        if errors and os.path.isdir(errors):
+            names = sorted(n for n in os.listdir(errors) if n.endswith(".html"))
+            if names:
+                return self._read("errors", names[0])
+        return ERROR_HTML
+
+    def results_html(self, query_type, zone, period=None):
+        names = [results_name(query_type, zone, period)]
+        if period:
+            names.append(results_name(query_type, zone))
+        names.append("default.html")
+        for name in names:
+            saved = self._read("results", name)
+            if saved is not None:
+                return saved
+        return sample_results_html(query_type, zone, period, rows=self.rows)
+
+
+class Recorder:
+    """Saves the pages an extractor sees, in the layout ReplayServer serves.
+
+    The form page and CAPTCHA are overwritten by every query; results are
+    kept per query type, zone and period, and "unable to process" pages go
+    to errors/ so they never replace a good recording.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def save_form(self, html):
+        self._write(html, "form.html")
+
+    def save_captcha(self, png):
+        self._write(png, "captcha.png")
+
+    def save_results(self, query_type, zone, period, html):
+        if SERVER_ERROR_TEXT in html:
+            name = results_name(query_type, zone, period)[:-len(".html")] + time.strftime("_%Y%m%dT%H%M%S.html")
+            self._write(html, "errors", name)
+        else:
+            self._write(html, "results", results_name(query_type, zone, period))
+
+    def _write(self, data, *parts):
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename, so a concurrent replay never reads half a page
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data.encode("utf-8") if isinstance(data, str) else data)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def start_server(directory=None, host="127.0.0.1", port=0, **kwargs):
+    """Starts a ReplayServer on a background thread and returns it."""
+    server = ReplayServer((host, port), directory=directory, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="fois-replay", daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve saved FOIS pages locally.")
+    parser.add_argument("--dir", help="Recording directory (defaults to synthetic pages)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--captcha", help="Expected CAPTCHA answer (any answer is accepted if omitted)")
+    parser.add_argument("--rows", type=int, default=200, help="Rows in synthetic result tables")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds before each results response")
+    parser.add_argument("--chunk-delay", type=float, default=0.0,
+                        help="Seconds between 16 KB chunks of a results response")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of queries answered with the 'unable to process' page")
+    args = parser.parse_args()
+
+    server = ReplayServer((args.host, args.port), directory=args.dir, captcha_answer=args.captcha,
+                          rows=args.rows, verbose=True, delay=args.delay, chunk_delay=args.chunk_delay,
+                          error_rate=args.error_rate)
+    print(f"Serving FOIS stand-in at {server.form_url}")
+    print(f"Point the extractor at it with: FOIS_URL={server.form_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""Scheduled background harvester with incremental snapshots and diffs.
+
+Pulls the configured zone/query combinations every ``interval`` seconds,
+stores each result as a timestamped Parquet snapshot, and writes a delta
+against the previous snapshot of the same combination: ODRs/indents that
+appeared ("added"), cleared ("removed") or had fields change ("changed").
+Downstream consumers read only the deltas.
+
+Layout of the store directory:
+
+    snapshots/<QUERY>__<ZONE>__<PERIOD>/<YYYYmmddTHHMMSSffffff>.parquet
+    deltas/<QUERY>__<ZONE>__<PERIOD>/<YYYYmmddTHHMMSSffffff>.parquet
+
+CAPTCHAs are handled by a solver: any callable ``solver(image, job)``
+returning the answer, or None to skip the job. Without one, CAPTCHAs wait in
+``Harvester.captchas`` for a human operator to drain, passing over requests
+whose ``expired`` is set (their jobs gave up waiting). An ``auto_solver``
+(captcha_solver.OfflineSolver) gets every CAPTCHA first and leaves only the
+ones it is unsure about to the solver or operator, so a trained model lets
+cycles run unattended.
+
+Usage:
+    python harvester.py --zones ECO SEC --queries ODR_RK_OTSG --interval 900 [--once]
+"""
+import argparse
+import collections
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from batch import DEFAULT_WORKERS, BatchJob, BatchRun, build_jobs
+from captcha_solver import MANUAL, MODEL_PATH, CommandSolver, load_solver, prompt_solver
+from driver_profiles import DEFAULT_PROFILE, PROFILES
+from extractors import ENGINES, PERIODS, QUERY_TYPES, ZONES, HttpExtractor, SeleniumExtractor
+from instrumentation import configure as configure_instrumentation, start_metrics_server
+from result_cache import ResultCache
+
+DEFAULT_STORE = os.environ.get("FOIS_HARVEST_DIR", "harvest")
+# Cycle summaries kept in Harvester.history
+HISTORY_CYCLES = 100
+
+# Identifier columns, by the words their header contains
+KEY_COLUMN_HINTS = ("ODR NO", "INDENT NO", "ODR ID", "INDENT ID", "DEMAND NO")
+
+CHANGE_COLUMN = "change"
+CHANGED_FIELDS_COLUMN = "changed_fields"
+
+
+def find_key_columns(df):
+    """Guesses the ODR/indent identifier columns of a results table."""
+    keys = [c for c in df.columns if any(hint in str(c).upper() for hint in KEY_COLUMN_HINTS)]
+    if not keys:
+        raise ValueError(f"No ODR/indent identifier column found in {list(df.columns)}; pass key_columns.")
+    return keys
+
+
+def diff_snapshots(old, new, key_columns=None):
+    """Row-level diff of two snapshots keyed on the identifier columns.
+
+    Returns the added and changed rows as they are in ``new`` and the
+    removed rows as they were in ``old``, with a ``change`` column and, for
+    changed rows, a ``changed_fields`` column listing what changed.
+    """
+    key_columns = key_columns or find_key_columns(new)
+    # Serial numbers are positional and change whenever rows come and go
+    compare = [
+        c for c in new.columns
+        if c in old.columns and c not in key_columns and str(c).upper() not in ("S.NO", "SR.NO", "SL.NO")
+    ]
+
+    old = old.drop_duplicates(key_columns, keep="last")
+    new = new.drop_duplicates(key_columns, keep="last")
+    merged = old[key_columns + compare].merge(
+        new[key_columns + compare], on=key_columns, how="outer", suffixes=("_old", ""), indicator=True
+    )
+
+    added = new.merge(merged.loc[merged["_merge"] == "right_only", key_columns], on=key_columns)
+    removed = old.merge(merged.loc[merged["_merge"] == "left_only", key_columns], on=key_columns)
+
+    both = merged[merged["_merge"] == "both"]
+    changed_mask = pd.Series(False, index=both.index)
+    fields = pd.Series("", index=both.index)
+    for col in compare:
+        a, b = both[f"{col}_old"], both[col]
+        # The outer merge turns int columns into floats, so compare numbers as numbers
+        if not (pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b)):
+            a, b = a.astype("string"), b.astype("string")
+        differs = ~((a == b).fillna(False) | (a.isna() & b.isna()))
+        changed_mask |= differs
+        prefix = fields.where(fields.eq(""), fields + ",")
+        fields = fields.mask(differs, prefix + str(col))
+    changed_keys = both.loc[changed_mask, key_columns].assign(**{CHANGED_FIELDS_COLUMN: fields[changed_mask].values})
+    changed = new.merge(changed_keys, on=key_columns)
+
+    parts = []
+    for label, frame in (("added", added), ("removed", removed), ("changed", changed)):
+        if not frame.empty:
+            parts.append(frame.assign(**{CHANGE_COLUMN: label}))
+    if not parts:
+        return pd.DataFrame(columns=list(new.columns) + [CHANGE_COLUMN, CHANGED_FIELDS_COLUMN])
+    delta = pd.concat(parts, ignore_index=True, sort=False)
+    if CHANGED_FIELDS_COLUMN not in delta:
+        delta[CHANGED_FIELDS_COLUMN] = pd.NA
+    return delta
+
+
+class SnapshotStore:
+    """Timestamped snapshots and deltas per (query type, zone, period)."""
+
+    def __init__(self, directory=DEFAULT_STORE):
+        self.directory = directory
+
+    def _dir(self, kind, query_type, zone, period):
+        path = os.path.join(self.directory, kind, ResultCache.key(query_type, zone, period))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def _stamp(when=None):
+        # Microseconds, so two snapshots taken within a second don't overwrite each other
+        return (when or datetime.now(timezone.utc)).strftime("%Y%m%dT%H%M%S%f")
+
+    def _list(self, kind, query_type, zone, period):
+        path = self._dir(kind, query_type, zone, period)
+        return sorted(os.path.join(path, n) for n in os.listdir(path) if n.endswith(".parquet"))
+
+    def latest(self, query_type, zone, period=None):
+        snapshots = self._list("snapshots", query_type, zone, period)
+        return pd.read_parquet(snapshots[-1]) if snapshots else None
+
+    def add(self, query_type, zone, period, df, key_columns=None, when=None):
+        """Stores ``df`` as the newest snapshot and returns its delta (None for the first one).
+
+        Raises ValueError, before writing anything, if ``df`` has no identifier column.
+        """
+        key_columns = key_columns or find_key_columns(df)
+        previous = self.latest(query_type, zone, period)
+        stamp = self._stamp(when)
+        df.to_parquet(os.path.join(self._dir("snapshots", query_type, zone, period), f"{stamp}.parquet"), index=False)
+        if previous is None:
+            return None
+
+        delta = diff_snapshots(previous, df, key_columns)
+        delta.to_parquet(os.path.join(self._dir("deltas", query_type, zone, period), f"{stamp}.parquet"), index=False)
+        return delta
+
+    def read_deltas(self, query_type, zone, period=None, since=None):
+        """Concatenates the deltas written after ``since`` (a YYYYmmddTHHMMSS[ffffff] stamp)."""
+        frames = []
+        for path in self._list("deltas", query_type, zone, period):
+            stamp = os.path.basename(path)[:-len(".parquet")]
+            # A stamp to the second covers the deltas written during that second
+            if since and stamp[:len(since)] <= since:
+                continue
+            frames.append(pd.read_parquet(path).assign(snapshot=stamp))
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+
+class Harvester:
+    """Runs the configured jobs on a schedule and records snapshots and deltas."""
+
+    def __init__(self, combos, extractor_factory, store=None, interval=900, solver=None,
+                 max_workers=DEFAULT_WORKERS, key_columns=None, auto_solver=None):
+        # combos: (query_type, zone, period) tuples
+        self.combos = list(combos)
+        self.extractor_factory = extractor_factory
+        self.store = store or SnapshotStore()
+        self.interval = interval
+        self.solver = solver
+        self.auto_solver = auto_solver
+        self.max_workers = max_workers
+        self.key_columns = key_columns
+
+        # CAPTCHA requests waiting for an operator when there is no solver
+        self.captchas = queue.Queue()
+        # Summaries of the most recent cycles; a long-running harvester keeps only the last few
+        self.history = collections.deque(maxlen=HISTORY_CYCLES)
+        self._stop = threading.Event()
+
+    def run_once(self):
+        """Runs one harvest cycle; returns {combo: delta} for the combos that succeeded."""
+        jobs = [BatchJob(*combo) for combo in self.combos]
+        run = BatchRun(jobs, self.extractor_factory, max_workers=self.max_workers, captchas=self.captchas,
+                       solver=self.auto_solver).start()
+        if self.solver is not None:
+            self._drain_with_solver(run)
+        run.wait()
+
+        deltas = {}
+        for job in run.jobs:
+            combo = (job.query_type, job.zone, job.period)
+            if job.df is None:
+                print(f"[{job.label}] {job.status}{': ' + job.error if job.error else ''}")
+                continue
+            try:
+                delta = self.store.add(*combo, job.df, key_columns=self.key_columns)
+            except Exception as e:
+                # One odd table must not cost the other combos their snapshots
+                job.status, job.error = "failed", f"Could not store the snapshot: {e}"
+                print(f"[{job.label}] {job.error}")
+                continue
+            deltas[combo] = delta
+            if delta is None:
+                print(f"[{job.label}] first snapshot, {len(job.df)} rows")
+            else:
+                counts = delta[CHANGE_COLUMN].value_counts().to_dict() if not delta.empty else {}
+                print(f"[{job.label}] {len(job.df)} rows; delta: {counts or 'no changes'}")
+        self.history.append({"finished_at": time.time(), "summary": run.summary()})
+        return deltas
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Harvest cycle failed: {e}")
+            self._stop.wait(max(0, self.interval - (time.time() - started)))
+
+    def start(self):
+        """Runs the schedule on a daemon thread."""
+        thread = threading.Thread(target=self.run_forever, name="fois-harvester", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _drain_with_solver(self, run):
+        while not run.done:
+            request = run.next_captcha(timeout=0.5)
+            if request is None:
+                continue
+            try:
+                answer = self.solver(request.image, request.job)
+            except Exception as e:
+                print(f"[{request.job.label}] CAPTCHA solver failed: {e}")
+                answer = None
+            if answer:
+                request.solve(answer, solver=getattr(self.solver, "name", MANUAL))
+            else:
+                request.skip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Harvest FOIS results on a schedule and store snapshots and deltas.")
+    parser.add_argument("--zones", nargs="+", default=ZONES, choices=ZONES, metavar="ZONE")
+    parser.add_argument("--queries", nargs="+", default=["ODR_RK_OTSG"], choices=list(QUERY_TYPES.values()))
+    parser.add_argument("--periods", nargs="+", default=["7"], choices=PERIODS)
+    parser.add_argument("--engine", default="http", choices=list(ENGINES))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--interval", type=int, default=900, help="Seconds between harvest cycles")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Snapshot/delta directory")
+    parser.add_argument("--solver-command", help="Command that reads a CAPTCHA PNG on stdin and prints the answer")
+    parser.add_argument("--auto-solve", action="store_true",
+                        help="Solve CAPTCHAs with the trained offline model first (captcha_solver.py train)")
+    parser.add_argument("--driver-profile", default=DEFAULT_PROFILE, choices=list(PROFILES),
+                        help="Chrome launch profile for the selenium engine")
+    parser.add_argument("--once", action="store_true", help="Run a single cycle and exit")
+    parser.add_argument("--trace", help="Append a JSON line per query to this file")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+    args = parser.parse_args(argv)
+
+    configure_instrumentation(trace_file=args.trace)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.engine == "selenium":
+        from extract_fois_data import setup_driver
+        factory = lambda: SeleniumExtractor(setup_driver(args.driver_profile))
+    else:
+        factory = HttpExtractor
+
+    solver = CommandSolver(args.solver_command) if args.solver_command else prompt_solver()
+    auto_solver = load_solver() if args.auto_solve else None
+    if args.auto_solve and auto_solver is None:
+        parser.error(f"No CAPTCHA model at {MODEL_PATH}; run 'python captcha_solver.py train' first.")
+    combos = [(job.query_type, job.zone, job.period) for job in build_jobs(args.queries, args.zones, args.periods)]
+    harvester = Harvester(combos, factory, store=SnapshotStore(args.store), interval=args.interval,
+                          solver=solver, max_workers=args.workers, auto_solver=auto_solver)
+
+    if args.once:
+        harvester.run_once()
+        return
+    try:
+        harvester.run_forever()
+    except KeyboardInterrupt:
+        harvester.stop()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""Analytical history of every extraction, queried in place with DuckDB.
+
+Each successful extraction is appended as one Parquet file to a dataset
+partitioned by capture month and zone:
+
+    <FOIS_HISTORY_DIR>/month=2024-01/zone=ECO/ODR_RK_OTSG-20240131T101500-1a2b3c.parquet
+
+Column names are normalised to snake_case ("ODR Date" -> odr_date), and
+every row carries query_type, period, captured_at and capture_date; month
+and zone come from the directory names. A results column that clashes with
+these is stored with a ``row_`` prefix (e.g. the table's own Zone column
+becomes row_zone).
+
+Queries run in DuckDB straight over the Parquet files, so an aggregation
+only reads the columns it needs, and a date window skips other months'
+directories and, within compacted files, row groups of other days:
+
+    counts()       rows per station/commodity/zone/... in the latest capture
+    ageing()       days since the ODR/indent was raised, with age buckets
+    trend()        rows per day (last capture of each day) and group
+    outstanding()  first and last capture each ODR/indent was seen in
+    sql()          any SQL against the ``history`` view, on a connection that
+                   can only touch files within the store's directory
+
+Every file opened costs time, and a harvester appends dozens a day, so
+run compact() daily: it merges each month's files per zone into one, sorted
+by capture time. Run it from one place only.
+
+Configuration:
+    FOIS_HISTORY_DIR   dataset directory (default: fois_history; empty disables)
+
+Usage:
+    python history.py counts --by station commodity [--since 2024-01-01] [--zones ECO]
+    python history.py ageing --by station | trend --by zone | outstanding --station ABC
+    python history.py sql "SELECT zone, count(*) FROM history GROUP BY zone"
+    python history.py compact
+"""
+import argparse
+import glob
+import os
+import re
+import secrets
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except ImportError:
+    HAS_DUCKDB = False
+
+from export import flatten_columns
+
+HISTORY_DIR = os.environ.get("FOIS_HISTORY_DIR", "fois_history")
+
+# Columns every row has, besides the results table's own
+META_COLUMNS = ("month", "zone", "query_type", "period", "captured_at", "capture_date")
+
+# Rows per row group of compacted files; small enough for date filters to skip most of them
+ROW_GROUP_ROWS = 128 * 1024
+
+# Grouping names accepted by the query API, by the words their column name contains
+DIMENSION_HINTS = {
+    "station": ("station", "sttn", "stn"),
+    "commodity": ("commodity", "cmdt"),
+    "division": ("division", "dvsn"),
+    "consignor": ("consignor", "cnsr"),
+    "wagon_type": ("wagon_type", "wgon_type", "wagon_typ"),
+}
+
+# ODR/indent identifier columns (cf. harvester.KEY_COLUMN_HINTS)
+KEY_HINTS = ("odr_no", "indent_no", "odr_id", "indent_id", "demand_no")
+
+AGE_BUCKETS = ((0, 7), (8, 15), (16, 30), (31, None))
+
+
+def column_name(name):
+    """Snake_case form of a results column name."""
+    name = re.sub(r"[^0-9a-z]+", "_", str(name).lower()).strip("_")
+    return name or "column"
+
+
+def _normalize(df):
+    df = flatten_columns(df.copy())
+    names, seen = [], set()
+    for column in df.columns:
+        name = column_name(column)
+        if name in META_COLUMNS:
+            name = "row_" + name
+        base, n = name, 1
+        while name in seen:
+            n += 1
+            name = f"{base}_{n}"
+        seen.add(name)
+        names.append(name)
+    df.columns = names
+    # Categoricals become plain strings: files are read together, by column name
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _select(group):
+    return ", ".join(expr if expr == alias else f"{expr} AS {alias}" for expr, alias in group)
+
+
+class HistoryStore:
+    """Append-only, month/zone-partitioned Parquet dataset of extraction results."""
+
+    def __init__(self, directory=HISTORY_DIR):
+        self.directory = directory
+        self._columns = None
+
+    # --- Writing ---
+
+    def append(self, df, query_type, zone, period=None, captured_at=None):
+        """Stores one extraction result; returns the file written, or None for an empty result."""
+        if df is None or df.empty:
+            return None
+        captured_at = captured_at or datetime.now()
+        data = _normalize(df)
+        data.insert(0, "capture_date", captured_at.date())
+        data.insert(0, "captured_at", pd.Timestamp(captured_at))
+        data.insert(0, "period", None if period is None else str(period))
+        data.insert(0, "query_type", query_type)
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        table = table.cast(table.schema.set(table.schema.get_field_index("period"), pa.field("period", pa.string())))
+
+        directory = self._partition(captured_at.date(), zone)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{query_type}-{captured_at:%Y%m%dT%H%M%S}-{secrets.token_hex(3)}.parquet"
+        self._write(table, os.path.join(directory, name))
+        return os.path.join(directory, name)
+
+    def compact(self, before=None):
+        """Merges each month/zone partition's files captured before ``before`` (default: today) into one.
+
+        Returns the number of files merged.
+        """
+        stamp = (before or date.today()).strftime("%Y%m%d")
+        merged = 0
+        for directory in sorted(glob.glob(os.path.join(self.directory, "month=*", "zone=*"))):
+            # Appended files are named <query>-<stamp>-<random>; compacted ones are always old enough
+            files = sorted(
+                f for f in glob.glob(os.path.join(directory, "*.parquet"))
+                if os.path.basename(f).startswith("compacted-") or os.path.basename(f).split("-")[1][:8] < stamp
+            )
+            if len(files) < 2:
+                continue
+            table = pa.concat_tables([pq.read_table(f) for f in files], promote_options="permissive")
+            table = table.sort_by([("captured_at", "ascending")])
+            self._write(table, os.path.join(directory, f"compacted-{secrets.token_hex(3)}.parquet"))
+            for f in files:
+                os.remove(f)
+            merged += len(files)
+        return merged
+
+    def stats(self):
+        files = self._files()
+        months = {os.path.basename(os.path.dirname(os.path.dirname(f))) for f in files}
+        return {"files": len(files), "months": len(months), "bytes": sum(os.path.getsize(f) for f in files)}
+
+    def _files(self):
+        return glob.glob(os.path.join(self.directory, "month=*", "zone=*", "*.parquet"))
+
+    def _partition(self, day, zone):
+        return os.path.join(self.directory, f"month={day:%Y-%m}", f"zone={zone}")
+
+    @staticmethod
+    def _write(table, path):
+        # Write to a temp file and rename, so queries never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp, compression="zstd", row_group_size=ROW_GROUP_ROWS)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # --- Querying ---
+
+    def sql(self, query, params=None, select_only=False):
+        """Runs ``query`` against the ``history`` view and returns a DataFrame.
+
+        With ``select_only``, anything but a single SELECT raises ValueError;
+        pass it for SQL typed in by users of the app.
+        """
+        con = self._connect()
+        if con is None:
+            return pd.DataFrame()
+        try:
+            if select_only:
+                statements = con.extract_statements(query)
+                if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+                    raise ValueError("Only a single SELECT statement can be run here.")
+            return con.execute(query, params or []).df()
+        finally:
+            con.close()
+
+    def columns(self):
+        """Column name -> DuckDB type, across every file."""
+        # Other processes append too; new files may bring new columns
+        files = len(self._files())
+        if self._columns is None or self._columns[0] != files:
+            described = self.sql("DESCRIBE history")
+            self._columns = (files, dict(zip(described.get("column_name", []), described.get("column_type", []))))
+        return self._columns[1]
+
+    def counts(self, by=("station",), **filters):
+        """Rows per group in the latest capture of each query type/zone/period in the window."""
+        group = self._dimensions(by)
+        if group is None:
+            return pd.DataFrame()
+        where, params, rows, row_params = self._where(**filters)
+        return self.sql(f"""
+            WITH latest AS (
+                SELECT * FROM history WHERE {where}
+                QUALIFY captured_at = max(captured_at) OVER (PARTITION BY query_type, zone, period)
+            )
+            SELECT {_select(group)}, count(*) AS rows
+            FROM latest WHERE {rows} GROUP BY ALL ORDER BY rows DESC
+        """, params + row_params)
+
+    def ageing(self, by=("station",), date_column=None, **filters):
+        """Age in days of the ODRs/indents in the latest captures, per group, with age buckets."""
+        group = self._dimensions(by)
+        raised = self._raised_expr(date_column)
+        if group is None or raised is None:
+            return pd.DataFrame()
+        where, params, rows, row_params = self._where(**filters)
+        buckets = ", ".join(
+            f"count(*) FILTER (WHERE age_days BETWEEN {low} AND {high}) AS \"{low}-{high}d\"" if high is not None
+            else f"count(*) FILTER (WHERE age_days >= {low}) AS \"{low}+d\""
+            for low, high in AGE_BUCKETS
+        )
+        return self.sql(f"""
+            WITH latest AS (
+                SELECT *, date_diff('day', CAST({raised} AS DATE), CAST(captured_at AS DATE)) AS age_days
+                FROM history WHERE {where}
+                QUALIFY captured_at = max(captured_at) OVER (PARTITION BY query_type, zone, period)
+            )
+            SELECT {_select(group)}, count(*) AS rows,
+                   round(avg(age_days), 1) AS avg_age_days, median(age_days) AS median_age_days,
+                   max(age_days) AS max_age_days, {buckets}
+            FROM latest WHERE {rows} GROUP BY ALL ORDER BY avg_age_days DESC NULLS LAST
+        """, params + row_params)
+
+    def trend(self, by=(), **filters):
+        """Rows per capture day (the day's last capture of each query type/zone/period) and group."""
+        group = self._dimensions(by)
+        if group is None:
+            return pd.DataFrame()
+        where, params, rows, row_params = self._where(**filters)
+        return self.sql(f"""
+            WITH daily AS (
+                SELECT * FROM history WHERE {where}
+                QUALIFY captured_at = max(captured_at) OVER (PARTITION BY query_type, zone, period, capture_date)
+            )
+            SELECT {_select([("capture_date", "capture_date")] + group)}, count(*) AS rows
+            FROM daily WHERE {rows} GROUP BY ALL ORDER BY ALL
+        """, params + row_params)
+
+    def outstanding(self, key_column=None, date_column=None, **filters):
+        """Per ODR/indent: first and last capture it was seen in, and days outstanding since raised."""
+        columns = self.columns()
+        keys = [key_column] if key_column else [c for c in columns if any(h in c for h in KEY_HINTS)]
+        if not keys:
+            return pd.DataFrame()
+        # ODR and indent tables name their identifier differently
+        key = f"coalesce({', '.join(_quote(k) for k in keys)})" if len(keys) > 1 else _quote(keys[0])
+        group = self._dimensions(("station", "commodity"), required=False) or []
+        raised = self._raised_expr(date_column)
+        where, params, rows, row_params = self._where(**filters)
+        first_raised = f"min(CAST({raised} AS DATE))" if raised else "NULL"
+        return self.sql(f"""
+            SELECT {key} AS key, zone, query_type,
+                   {"".join(f"any_value({expr}) AS {alias}, " for expr, alias in group)}
+                   {first_raised} AS raised, min(captured_at) AS first_seen, max(captured_at) AS last_seen,
+                   count(DISTINCT captured_at) AS captures,
+                   date_diff('day', coalesce({first_raised}, CAST(min(captured_at) AS DATE)),
+                             CAST(max(captured_at) AS DATE)) AS days_outstanding
+            FROM history WHERE {where} AND {rows} AND {key} IS NOT NULL
+            GROUP BY {key}, zone, query_type ORDER BY days_outstanding DESC
+        """, params + row_params)
+
+    def _connect(self):
+        if not HAS_DUCKDB:
+            raise RuntimeError("The history store needs DuckDB: pip install duckdb")
+        if not self._files():
+            return None
+        files = os.path.join(self.directory, "month=*", "zone=*", "*.parquet")
+        con = duckdb.connect()
+        # Queries may come from users: no files outside the store, no extensions, no way to undo this
+        con.execute("SET allowed_directories = ?", [[os.path.abspath(self.directory) + os.sep]])
+        con.execute("SET enable_external_access = false")
+        con.execute("SET lock_configuration = true")
+        con.execute(f"""
+            CREATE VIEW history AS SELECT * FROM read_parquet('{files.replace("'", "''")}',
+                hive_partitioning = true, union_by_name = true, hive_types = {{'month': VARCHAR, 'zone': VARCHAR}})
+        """)
+        return con
+
+    def _dimensions(self, by, required=True):
+        """(column, alias) pairs for grouping names (station, commodity, ...) or raw column names."""
+        columns = self.columns()
+        if not columns:
+            return None
+        if isinstance(by, str):
+            by = [by]
+        resolved = []
+        for name in by or ():
+            if name in columns:
+                resolved.append((_quote(name), _quote(name)))
+                continue
+            hints = DIMENSION_HINTS.get(name, (name,))
+            column = next((c for c in columns if c not in META_COLUMNS and any(h in c for h in hints)), None)
+            if column is None:
+                if required:
+                    raise ValueError(f"No column for {name!r}; history has {', '.join(columns)}")
+                continue
+            resolved.append((_quote(column), _quote(name)))
+        return resolved
+
+    def _raised_expr(self, date_column=None):
+        """The date an ODR/indent was raised: ``date_column`` or the first date column found per row."""
+        if date_column:
+            return _quote(date_column)
+        columns = self.columns()
+        candidates = [
+            _quote(c) for c, kind in columns.items()
+            if c not in META_COLUMNS and "date" in c and "maturity" not in c
+            and (kind.startswith("TIMESTAMP") or kind == "DATE")
+        ]
+        if not candidates:
+            return None
+        return candidates[0] if len(candidates) == 1 else f"coalesce({', '.join(candidates)})"
+
+    def _where(self, since=None, until=None, days=None, zones=None, query_type=None, period=None, **values):
+        """SQL filters and parameters for the captures and, separately, for rows within them.
+
+        ``values`` filters on grouping names, e.g. station="ABC". Queries pick
+        the latest capture with the first filter and only then apply the
+        second; otherwise a station with no rows left in the latest capture
+        would show its rows from an older one as current.
+        """
+        clauses, params = ["true"], []
+        if days is not None:
+            since = date.today() - timedelta(days=days)
+        # The month condition prunes directories, the date one row groups
+        if since is not None:
+            since = pd.Timestamp(since)
+            clauses.append("month >= ? AND capture_date >= ?")
+            params += [f"{since:%Y-%m}", since.date()]
+        if until is not None:
+            until = pd.Timestamp(until)
+            clauses.append("month <= ? AND capture_date <= ?")
+            params += [f"{until:%Y-%m}", until.date()]
+        if zones:
+            clauses.append(f"zone IN ({', '.join('?' for _ in zones)})")
+            params.extend(zones)
+        if query_type:
+            clauses.append("query_type = ?")
+            params.append(query_type)
+        if period:
+            clauses.append("period = ?")
+            params.append(str(period))
+        rows, row_params = ["true"], []
+        for name, value in values.items():
+            if value is None:
+                continue
+            column = self._dimensions([name])[0][0]
+            rows.append(f"CAST({column} AS VARCHAR) = ?")
+            row_params.append(str(value))
+        return " AND ".join(clauses), params, " AND ".join(rows), row_params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the history of FOIS extractions.")
+    parser.add_argument("command", choices=["counts", "ageing", "trend", "outstanding", "sql", "compact", "stats"])
+    parser.add_argument("query", nargs="?", help="SQL for the 'sql' command")
+    parser.add_argument("--dir", default=HISTORY_DIR, help="History directory")
+    parser.add_argument("--by", nargs="*", default=None, help="Grouping: station, commodity, zone, ... or a column")
+    parser.add_argument("--since", help="First capture date (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last capture date (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, help="Only the last N days")
+    parser.add_argument("--zones", nargs="+")
+    parser.add_argument("--query-type")
+    parser.add_argument("--station")
+    parser.add_argument("--commodity")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.dir)
+    if args.command == "compact":
+        print(f"Merged {store.compact()} files.")
+        return
+    if args.command == "stats":
+        print(store.stats())
+        return
+    if args.command == "sql":
+        result = store.sql(args.query)
+    else:
+        filters = dict(since=args.since, until=args.until, days=args.days, zones=args.zones,
+                       query_type=args.query_type, station=args.station, commodity=args.commodity)
+        if args.command == "outstanding":
+            result = store.outstanding(**filters)
+        else:
+            by = args.by if args.by is not None else (["station"] if args.command != "trend" else [])
+            result = getattr(store, args.command)(by=by, **filters)
+    print(result.to_string(index=False) if not result.empty else "No history.")
+
+
+if __name__ == "__main__":
+    main()
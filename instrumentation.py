@@ -0,0 +1,379 @@
+"""Performance instrumentation of FOIS queries: metrics, JSONL traces and profiles.
+
+Every phase a QueryTimer records (navigate, zone select, screenshot, submit,
+table complete, HTML fetch, parse, ...) is a span. When a query finishes,
+record_query() feeds its spans, HTML size, row count, retries and outcome
+into the process-wide METRICS registry and, if a trace file is configured,
+appends them to it as one JSON line. Exports and driver launches are
+recorded the same way.
+
+METRICS renders in the Prometheus text format (start_metrics_server() serves
+it on /metrics) and reports p50/p95 per phase and zone, so timeouts and pool
+sizes can be tuned from measurements.
+
+Configuration (environment, or configure()):
+    FOIS_TRACE_FILE    append a JSON line per query/export to this file
+    FOIS_PROFILE       "cprofile" or "pyinstrument": profile every query
+    FOIS_PROFILE_DIR   where profiles are written (default: profiles)
+
+Usage:
+    python instrumentation.py trace.jsonl    # p50/p95 per phase and zone from a trace
+"""
+import argparse
+import bisect
+import cProfile
+import collections
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# pyinstrument is optional; cProfile is the fallback
+try:
+    import pyinstrument
+    HAS_PYINSTRUMENT = True
+except ImportError:
+    HAS_PYINSTRUMENT = False
+
+# Seconds; FOIS answers take anything from under a second to several minutes
+TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BYTE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+ROW_BUCKETS = (0, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Recent samples kept per label set, for percentiles
+RESERVOIR_SIZE = 2048
+
+HELP = {
+    "fois_phase_seconds": "Time spent per phase of a FOIS query.",
+    "fois_query_seconds": "Time spent per FOIS query, excluding time waiting on the operator.",
+    "fois_queries_total": "FOIS queries by outcome.",
+    "fois_retries_total": "HTTP requests retried during FOIS queries.",
+    "fois_query_retries_total": "FOIS queries retried in the same session after a server error.",
+    "fois_breaker_open": "1 while the zone's circuit breaker is open or probing.",
+    "fois_captcha_solve_seconds": "Time a CAPTCHA solver took per image.",
+    "fois_captcha_solves_total": "CAPTCHAs a solver answered, or was unsure about.",
+    "fois_captcha_answers_total": "CAPTCHA answers FOIS accepted or rejected, by solver.",
+    "fois_html_bytes": "Size of the frmDtls results HTML.",
+    "fois_table_rows": "Rows in the extracted results table.",
+    "fois_export_seconds": "Time spent exporting a results table.",
+    "fois_export_bytes": "Size of exported files.",
+    "fois_driver_start_seconds": "Time to launch a browser for the driver pool.",
+    "fois_driver_launch_failures_total": "Browsers the driver pool failed to launch.",
+    "fois_pool_wait_seconds": "Time spent waiting to check out a pooled browser.",
+    "fois_pool_drivers": "Browsers in the driver pool by state.",
+}
+
+_config = {
+    "trace_file": os.environ.get("FOIS_TRACE_FILE") or None,
+    "profile": os.environ.get("FOIS_PROFILE", "").lower() or None,
+    "profile_dir": os.environ.get("FOIS_PROFILE_DIR", "profiles"),
+}
+_trace_lock = threading.Lock()
+
+
+def configure(trace_file=None, profile=None, profile_dir=None):
+    """Overrides the environment configuration, e.g. from command-line flags."""
+    if trace_file is not None:
+        _config["trace_file"] = trace_file or None
+    if profile is not None:
+        _config["profile"] = profile or None
+    if profile_dir is not None:
+        _config["profile_dir"] = profile_dir
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile ``q`` (0-100) of ``values``."""
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class Histogram:
+    """Prometheus-style cumulative buckets plus a reservoir of recent samples."""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.samples = collections.deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.samples.append(value)
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters, gauges and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(dict)
+        self._gauges = collections.defaultdict(dict)
+        self._histograms = collections.defaultdict(dict)
+
+    def inc(self, name, value=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[name][_labels_key(labels)] = value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self._histograms[name]
+            if key not in series:
+                series[key] = Histogram(buckets)
+            series[key].observe(value)
+
+    def counter(self, name, **labels):
+        """Sum of the counter over every series matching ``labels``."""
+        wanted = set(_labels_key(labels))
+        with self._lock:
+            return sum(v for key, v in self._counters.get(name, {}).items() if wanted <= set(key))
+
+    def label_values(self, name, label):
+        """Distinct values of ``label`` across the series of a counter."""
+        with self._lock:
+            return sorted({dict(key).get(label) for key in self._counters.get(name, {})} - {None})
+
+    def percentiles(self, name, by=(), quantiles=(50, 95)):
+        """Count and percentiles of a histogram's recent samples, grouped by the labels in ``by``."""
+        groups = collections.defaultdict(list)
+        with self._lock:
+            for key, hist in self._histograms.get(name, {}).items():
+                labels = dict(key)
+                groups[tuple(labels.get(b, "") for b in by)].extend(hist.samples)
+        rows = []
+        for group, samples in sorted(groups.items()):
+            row = dict(zip(by, group))
+            row["count"] = len(samples)
+            for q in quantiles:
+                row[f"p{q}"] = percentile(samples, q)
+            rows.append(row)
+        return rows
+
+    def server_error_rate(self):
+        total = self.counter("fois_queries_total")
+        return self.counter("fois_queries_total", outcome="server_error") / total if total else 0.0
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for kind, store in (("counter", self._counters), ("gauge", self._gauges)):
+                for name, series in sorted(store.items()):
+                    lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} {kind}"]
+                    lines += [f"{name}{_format_labels(key)} {_format_number(v)}" for key, v in sorted(series.items())]
+            for name, series in sorted(self._histograms.items()):
+                lines += [f"# HELP {name} {HELP.get(name, name)}", f"# TYPE {name} histogram"]
+                for key, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets + (float("inf"),), hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', _format_number(bound)))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_number(hist.sum)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+METRICS = Metrics()
+
+
+def write_trace(record):
+    """Appends ``record`` to the configured JSONL trace file, if any."""
+    path = _config["trace_file"]
+    if not path:
+        return
+    line = json.dumps(record, default=str)
+    with _trace_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def record_query(timer, labels, outcome, stats=None, metrics=METRICS):
+    """Records a finished query: its spans, sizes, retries and outcome.
+
+    ``labels`` holds engine, query, zone and period; ``stats`` optional
+    html_bytes, rows and retries counts.
+    """
+    stats = stats or {}
+    base = {k: labels.get(k) for k in ("engine", "query", "zone")}
+    for phase, seconds in timer.timings.items():
+        metrics.observe("fois_phase_seconds", seconds, phase=phase, **base)
+    metrics.observe("fois_query_seconds", timer.total(), outcome=outcome, **base)
+    metrics.inc("fois_queries_total", outcome=outcome, **base)
+    if stats.get("retries"):
+        metrics.inc("fois_retries_total", stats["retries"], **base)
+    if stats.get("html_bytes") is not None:
+        metrics.observe("fois_html_bytes", stats["html_bytes"], buckets=BYTE_BUCKETS, **base)
+    if stats.get("rows") is not None:
+        metrics.observe("fois_table_rows", stats["rows"], buckets=ROW_BUCKETS, **base)
+
+    write_trace({
+        "event": "query",
+        "ts": time.time(),
+        **labels,
+        "outcome": outcome,
+        "total_s": round(timer.total(), 4),
+        "phases": {k: round(v, 4) for k, v in timer.timings.items()},
+        "spans": timer.spans,
+        **stats,
+    })
+
+
+def record_export(fmt, seconds, size, rows, metrics=METRICS):
+    metrics.observe("fois_export_seconds", seconds, format=fmt)
+    if size is not None:
+        metrics.observe("fois_export_bytes", size, buckets=BYTE_BUCKETS, format=fmt)
+    write_trace({"event": "export", "ts": time.time(), "format": fmt, "seconds": round(seconds, 4),
+                 "bytes": size, "rows": rows})
+
+
+@contextmanager
+def profiled(name):
+    """Profiles the block with cProfile or pyinstrument when profiling is enabled.
+
+    Profiles land in the profile directory as <timestamp>_<name>.prof
+    (open with snakeviz or pstats) or .html for pyinstrument.
+    """
+    mode = _config["profile"]
+    if not mode:
+        yield
+        return
+
+    os.makedirs(_config["profile_dir"], exist_ok=True)
+    stem = os.path.join(_config["profile_dir"],
+                        time.strftime("%Y%m%dT%H%M%S") + "_" + re.sub(r"[^A-Za-z0-9_.-]", "_", name))
+    if mode == "pyinstrument" and HAS_PYINSTRUMENT:
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(stem + ".html", "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one cProfile can be active at a time on Python 3.12+
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stem + ".prof")
+
+
+def start_metrics_server(port, host="0.0.0.0", metrics=METRICS):
+    """Serves ``metrics`` on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="fois-metrics", daemon=True).start()
+    return server
+
+
+def summarize_trace(path, by=("phase", "zone"), quantiles=(50, 95)):
+    """p50/p95 per phase and zone, and the server-error rate per zone, from a JSONL trace."""
+    import pandas as pd
+
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+    queries = [r for r in rows if r.get("event") == "query"]
+    if not queries:
+        return None, None
+
+    spans = pd.DataFrame([
+        {"phase": phase, "seconds": seconds, "zone": q.get("zone"), "query": q.get("query"),
+         "engine": q.get("engine")}
+        for q in queries for phase, seconds in {**q.get("phases", {}), "total": q.get("total_s")}.items()
+    ])
+    grouped = spans.groupby(list(by), observed=True)["seconds"]
+    phases = grouped.count().to_frame("count")
+    for q in quantiles:
+        phases[f"p{q}"] = grouped.quantile(q / 100).round(3)
+
+    outcomes = pd.DataFrame(queries)
+    errors = outcomes.groupby("zone")["outcome"].agg(
+        queries="count", server_error_rate=lambda s: round((s == "server_error").mean(), 3)
+    )
+    return phases.reset_index(), errors.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise a FOIS JSONL trace: p50/p95 per phase and zone.")
+    parser.add_argument("trace", help="Trace file written with FOIS_TRACE_FILE or --trace")
+    parser.add_argument("--by", nargs="+", default=["phase", "zone"], choices=["phase", "zone", "query", "engine"])
+    args = parser.parse_args(argv)
+
+    phases, errors = summarize_trace(args.trace, by=args.by)
+    if phases is None:
+        print("No queries in the trace.")
+        return
+    print(phases.to_string(index=False))
+    print()
+    print(errors.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Background execution of extractions, off the Streamlit script thread.
+
+Submitting a CAPTCHA answer used to run the whole extraction (submit, wait
+for FOIS, fetch, parse) inside the script run, freezing the session for up
+to several minutes. A JobExecutor runs each extraction on a bounded thread
+pool instead and returns a job id straight away. The page then polls the
+ExtractionJob for its status, the phase it is in and the rows parsed so
+far, and can cancel it; meanwhile the user is free to start other queries.
+
+The job takes over the extractor. When it finishes the extractor is closed
+(its browser goes back to the pool), unless FOIS failed the query or
+rejected the CAPTCHA. Then, as in a batch, the job itself loads a new
+CAPTCHA in the same session, after a jittered backoff for a server error
+(status "retrying"), up to ``max_retries`` server errors per query. The
+extractor stays with the job until the page takes it back to try again
+with the new CAPTCHA (take_extractor()). A retry nobody takes within
+``retry_timeout`` seconds is given up, so its browser goes back to the pool.
+
+Finished jobs are kept, newest first, up to ``max_jobs``; older ones and
+their results are dropped.
+"""
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from captcha_solver import MANUAL
+from extractors import CaptchaRejected, FoisServerError
+from readiness import QueryCancelled
+from resilience import MAX_RETRIES, CircuitOpen
+
+JOB_WORKERS = int(os.environ.get("FOIS_JOB_WORKERS", "8"))
+MAX_JOBS = int(os.environ.get("FOIS_JOB_HISTORY", "50"))
+RETRY_TIMEOUT = int(os.environ.get("FOIS_JOB_RETRY_TIMEOUT", "900"))
+PREVIEW_ROWS = 50
+
+# Statuses of jobs that have not finished yet
+ACTIVE_STATUSES = ("queued", "running", "retrying", "cancelling")
+# Finished statuses after which the job may hold a new CAPTCHA and its extractor for a retry
+RETRYABLE_STATUSES = ("server error", "captcha rejected")
+
+
+class ExtractionJob:
+    """One CAPTCHA submit and everything after it, run in the background."""
+
+    def __init__(self, job_id, extractor, captcha_text, solver=MANUAL, retries=0):
+        self.id = job_id
+        self.extractor = extractor
+        self.captcha_text = captcha_text
+        self.solver = solver
+        self.query = dict(extractor.labels)
+        # Server-error retries of this query so far, and the CAPTCHA loaded for the next try
+        self.retries = retries
+        self.captcha_image = None
+
+        self.status = "queued"
+        self.error = None
+        self.df = None
+        self.warnings = []
+        self.timings = {}
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._table = None
+
+    @property
+    def label(self):
+        parts = [self.query.get("zone"), self.query.get("query"), self.query.get("period")]
+        return "/".join(p for p in parts if p)
+
+    @property
+    def done(self):
+        return self.status not in ACTIVE_STATUSES
+
+    @property
+    def phase(self):
+        """The phase the extraction is in now (submit, table_complete, parse, ...)."""
+        extractor = self.extractor
+        if self.status != "running" or extractor is None:
+            return None
+        return extractor.timer.current
+
+    @property
+    def rows(self):
+        """Rows parsed so far, or in the final result."""
+        if self.df is not None:
+            return len(self.df)
+        table = self._table
+        return table.n_rows if table is not None else 0
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def preview(self, limit=PREVIEW_ROWS):
+        """The first rows, while they are still being parsed or from the result."""
+        if self.df is not None:
+            return self.df.head(limit)
+        table = self._table
+        return table.preview(limit) if table is not None else None
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "query": self.label,
+            "status": self.status,
+            "phase": self.phase,
+            "rows": self.rows,
+            "elapsed_s": round(self.elapsed(), 1),
+            "error": self.error,
+        }
+
+    def _on_progress(self, table):
+        self._table = table
+
+
+class JobExecutor:
+    """Runs ExtractionJobs on a thread pool and keeps the most recent ones.
+
+    ``on_result`` is called from the worker thread with (job) for every
+    result, e.g. to store it in the result cache.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, max_jobs=MAX_JOBS, on_result=None, max_retries=MAX_RETRIES,
+                 retry_timeout=RETRY_TIMEOUT):
+        self.max_jobs = max_jobs
+        self.retry_timeout = retry_timeout
+        self.on_result = on_result
+        self.max_retries = max_retries
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="fois-job")
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, extractor, captcha_text, solver=MANUAL, retries=0):
+        """Starts extracting with ``extractor``, which the job now owns; returns the job id.
+
+        ``retries`` counts the server-error retries the query has had already.
+        """
+        with self._lock:
+            job = ExtractionJob(f"job-{next(self._ids)}", extractor, captcha_text, solver, retries)
+            self._jobs[job.id] = job
+        self._evict()
+        self._pool.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, ids=None):
+        """Jobs, newest first; only those in ``ids`` if given."""
+        # The page polls this, so abandoned retries are given up even when nothing new is submitted
+        self._evict()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if ids is not None:
+            wanted = set(ids)
+            jobs = [job for job in jobs if job.id in wanted]
+        return jobs[::-1]
+
+    def cancel(self, job_id):
+        """Stops the job at its next wait or chunk of the response."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            if job.status == "queued":
+                # _run() will see this and not start
+                job.status = "cancelled"
+                return True
+            job.status = "cancelling"
+        job.extractor.cancel()
+        return True
+
+    def take_extractor(self, job_id):
+        """Hands the extractor of a finished job back, e.g. to retry a query FOIS failed."""
+        job = self.get(job_id)
+        if job is None or not job.done:
+            return None
+        with self._lock:
+            extractor, job.extractor = job.extractor, None
+        return extractor
+
+    def shutdown(self):
+        for job in self.jobs():
+            self.cancel(job.id)
+        self._pool.shutdown(wait=False)
+
+    def _run(self, job):
+        extractor = job.extractor
+        with self._lock:
+            cancelled = job.status == "cancelled"
+            if not cancelled:
+                job.status = "running"
+                job.started_at = time.time()
+        if cancelled:
+            self._release(job)
+            return
+        extractor.progress = job._on_progress
+        status, broken = "failed", False
+        try:
+            try:
+                job.df = extractor.extract(job.captcha_text, solver=job.solver)
+                status = "done" if job.df is not None else "no data"
+                if job.df is not None and self.on_result is not None:
+                    try:
+                        self.on_result(job)
+                    except Exception as e:
+                        print(f"[{job.label}] Could not store the result: {e}")
+            except QueryCancelled:
+                status = "cancelled"
+            except CaptchaRejected as e:
+                status, job.error = "captcha rejected", str(e)
+            except FoisServerError as e:
+                status, job.error = "server error", str(e)
+            except Exception as e:
+                status, job.error, broken = "failed", str(e), True
+            # Taken before a retry starts the extractor's next query
+            job.warnings = list(extractor.warnings)
+            job.timings = dict(extractor.timings)
+            if status in RETRYABLE_STATUSES:
+                status, broken = self._new_captcha(job, status)
+        finally:
+            extractor.progress = None
+            job.finished_at = time.time()
+            # Set last: pollers treat the job as finished from here on
+            job.status = status
+            if job.captcha_image is None:
+                self._release(job, broken)
+            self._evict()
+
+    def _new_captcha(self, job, status):
+        """Loads the CAPTCHA for another try at a query FOIS failed; returns (status, broken).
+
+        Runs on the job's thread, so the backoff before a server-error retry
+        never holds up a script run.
+        """
+        if status == "server error" and job.retries >= self.max_retries:
+            return status, False
+        with self._lock:
+            if job.status == "cancelling":
+                return "cancelled", False
+            job.status = "retrying"
+        try:
+            if status == "server error":
+                job.retries += 1
+                job.captcha_image = job.extractor.retry(job.retries)
+            else:
+                job.captcha_image = job.extractor.reload_captcha()
+        except QueryCancelled:
+            return "cancelled", False
+        except CircuitOpen as e:
+            job.error = f"{job.error} {e}"
+            return status, False
+        except Exception as e:
+            job.error = f"{job.error} A new CAPTCHA could not be loaded: {e}"
+            return status, True
+        with self._lock:
+            if job.status == "cancelling":
+                job.captcha_image = None
+                return "cancelled", False
+        return status, False
+
+    def _release(self, job, broken=False):
+        with self._lock:
+            extractor, job.extractor = job.extractor, None
+        if extractor is not None:
+            extractor.close(broken=broken)
+
+    def _evict(self):
+        """Drops the oldest finished jobs beyond max_jobs and gives up retries nobody took.
+
+        Both close the extractors the jobs still hold; a held pooled driver is
+        exempt from the pool's lease timeout, so nothing else would free it.
+        """
+        cutoff = time.time() - self.retry_timeout
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.done]
+            excess = len(self._jobs) - self.max_jobs
+            evicted = finished[:max(0, excess)]
+            for job in evicted:
+                del self._jobs[job.id]
+            abandoned = [
+                job for job in finished[max(0, excess):]
+                if job.extractor is not None and job.captcha_image is not None and job.finished_at < cutoff
+            ]
+            for job in abandoned:
+                job.captcha_image = None
+                job.error = f"{job.error} The new CAPTCHA was not answered within {self.retry_timeout}s."
+        for job in evicted + abandoned:
+            self._release(job)
@@ -0,0 +1,274 @@
+"""Event-driven waits for the FOIS pages, replacing fixed time.sleep() calls.
+
+Each query gets one QueryTimer: it records how long every phase took
+(navigate, form fill, submit, first byte, table complete) and is also the
+query's latency budget, so every wait polls only for as long as the budget
+has time left. Polling starts fast and backs off, so a quick FOIS answer is
+picked up within tens of milliseconds while a slow one costs few round trips.
+"""
+import time
+from contextlib import contextmanager
+
+SERVER_ERROR_TEXT = "WE ARE UNABLE TO PROCESS YOUR REQUEST CURRENTLY"
+
+# FOIS's answer to a wrong CAPTCHA (compared upper-cased)
+INVALID_CAPTCHA_TEXT = "INVALID CAPTCHA"
+
+# Final answers without a results table; no point waiting for rows to settle
+EMPTY_RESULT_TEXTS = ("NO RECORD FOUND", "NO RECORDS FOUND", "NO DATA FOUND", INVALID_CAPTCHA_TEXT)
+
+DEFAULT_BUDGET = 300
+
+
+class ReadinessTimeout(TimeoutError):
+    """The page did not become ready before the query's budget ran out."""
+
+
+class ReadinessError(Exception):
+    """A wait detected a terminal state, e.g. the FOIS error page."""
+
+
+class QueryCancelled(Exception):
+    """The query was cancelled through its QueryTimer."""
+
+
+class QueryTimer:
+    """Per-phase timings of one query, doubling as its latency budget.
+
+    Only time spent inside phases counts against the budget, so the minutes
+    an operator takes to read a CAPTCHA don't eat into it. cancel() may be
+    called from another thread; waits then stop with QueryCancelled.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.timings = {}
+        # (name, offset from the timer's creation, duration) of each phase, for traces
+        self.spans = []
+        self._created = time.perf_counter()
+        self._spent = 0.0
+        self._phase_start = None
+        # Name of the phase running now, for progress displays
+        self.current = None
+        self.cancelled = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._phase_start = start
+        self.current = name
+        try:
+            yield
+        finally:
+            self.current = None
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            self.spans.append((name, round(start - self._created, 4), round(elapsed, 4)))
+            self._spent += elapsed
+            self._phase_start = None
+
+    def mark(self, name, since):
+        """Records a milestone inside a phase, e.g. time to first byte."""
+        self.timings[name] = time.perf_counter() - since
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise QueryCancelled("Query cancelled.")
+
+    def remaining(self):
+        spent = self._spent
+        if self._phase_start is not None:
+            spent += time.perf_counter() - self._phase_start
+        return self.budget - spent
+
+    def total(self):
+        return sum(v for k, v in self.timings.items() if k != "first_byte")
+
+
+def poll(condition, timer=None, timeout=None, interval=0.05, max_interval=1.0, backoff=1.5, what="condition"):
+    """Calls ``condition`` until it returns something truthy and returns that.
+
+    The wait ends at ``timeout`` seconds or when ``timer`` runs out of budget,
+    whichever comes first, or with QueryCancelled when ``timer`` is
+    cancelled. Exceptions from ``condition`` count as "not yet": the page may
+    be mid-navigation.
+    """
+    limit = timeout if timeout is not None else DEFAULT_BUDGET
+    if timer is not None:
+        limit = min(limit, timer.remaining())
+    deadline = time.perf_counter() + max(0.0, limit)
+
+    while True:
+        if timer is not None:
+            timer.check_cancelled()
+        try:
+            value = condition()
+        except ReadinessError:
+            raise
+        except Exception:
+            value = None
+        if value:
+            return value
+        now = time.perf_counter()
+        if now >= deadline:
+            raise ReadinessTimeout(f"Timed out after {limit:.0f}s waiting for {what}.")
+        time.sleep(min(interval, deadline - now))
+        interval = min(interval * backoff, max_interval)
+
+
+# --- Selenium signals ---
+
+_DOCUMENT_READY_JS = "return document.readyState === 'complete';"
+
+# True once the CAPTCHA image has finished loading (or there is none to wait for)
+_CAPTCHA_LOADED_JS = """
+var imgs = document.getElementsByTagName('img');
+for (var i = 0; i < imgs.length; i++) {
+    var key = ((imgs[i].src || '') + ' ' + (imgs[i].id || '') + ' ' + (imgs[i].name || '')).toLowerCase();
+    if (key.indexOf('captcha') >= 0) {
+        return imgs[i].complete && imgs[i].naturalWidth > 0;
+    }
+}
+return document.readyState === 'complete';
+"""
+
+# Tags the current results frame document, and the page itself, so a stale
+# one can be told apart from the response to the next submit
+_MARK_FRAME_JS = """
+window.__foisStale = true;
+var f = document.getElementById('frmDtls') || document.getElementsByName('frmDtls')[0];
+if (f && f.contentWindow) { try { f.contentWindow.__foisStale = true; } catch (e) {} }
+"""
+
+# State of the results frame, read from the top document in one round trip
+_FRAME_STATE_JS = """
+var sentinel = arguments[0], empties = arguments[1];
+var state = {frame: false, fresh: false, ready: '', rows: 0, error: false, empty: false, text: 0};
+var top = document.body ? document.body.innerText : '';
+if (top.indexOf(sentinel) >= 0) { state.error = true; return state; }
+var empty = function (text) {
+    var upper = text.toUpperCase();
+    for (var i = 0; i < empties.length; i++) {
+        if (upper.indexOf(empties[i]) >= 0) { return true; }
+    }
+    return false;
+};
+var f = document.getElementById('frmDtls') || document.getElementsByName('frmDtls')[0];
+if (!f) {
+    // The submit replaced the whole page, e.g. with a bare 'Invalid Captcha'
+    state.fresh = !window.__foisStale;
+    state.ready = document.readyState;
+    state.rows = document.getElementsByTagName('tr').length;
+    state.text = top.length;
+    state.empty = empty(top);
+    return state;
+}
+state.frame = true;
+try {
+    var w = f.contentWindow, d = f.contentDocument || w.document;
+    var text = d.body ? d.body.innerText : '';
+    state.fresh = !w.__foisStale && (d.URL !== 'about:blank' || text.length > 0);
+    state.ready = d.readyState;
+    state.rows = d.getElementsByTagName('tr').length;
+    state.text = text.length;
+    state.error = text.indexOf(sentinel) >= 0;
+    state.empty = empty(text);
+} catch (e) {
+    state.ready = 'cross-origin';
+}
+return state;
+"""
+
+
+# Reloads the CAPTCHA image in place, keeping the filled-in form; false if
+# there is no form to reuse (e.g. the error page replaced it)
+_REFRESH_CAPTCHA_JS = """
+if (document.body && document.body.innerText.indexOf(arguments[0]) >= 0) { return false; }
+var imgs = document.getElementsByTagName('img');
+for (var i = 0; i < imgs.length; i++) {
+    var key = ((imgs[i].src || '') + ' ' + (imgs[i].id || '') + ' ' + (imgs[i].name || '')).toLowerCase();
+    if (key.indexOf('captcha') >= 0) {
+        var src = imgs[i].src.replace(/[?&]_=\\d+$/, '');
+        imgs[i].src = src + (src.indexOf('?') >= 0 ? '&' : '?') + '_=' + Date.now();
+        return true;
+    }
+}
+return false;
+"""
+
+
+def wait_for_document(driver, timer=None, timeout=None):
+    return poll(lambda: driver.execute_script(_DOCUMENT_READY_JS), timer, timeout, what="page load")
+
+
+def wait_for_captcha(driver, timer=None, timeout=None):
+    return poll(lambda: driver.execute_script(_CAPTCHA_LOADED_JS), timer, timeout, what="CAPTCHA image")
+
+
+def refresh_captcha(driver):
+    """Asks the form for a new CAPTCHA image; returns False if the form is gone."""
+    try:
+        return bool(driver.execute_script(_REFRESH_CAPTCHA_JS, SERVER_ERROR_TEXT))
+    except Exception:
+        return False
+
+
+def mark_results_stale(driver):
+    """Call right before submitting, so the old frame isn't mistaken for the answer."""
+    try:
+        driver.execute_script(_MARK_FRAME_JS)
+    except Exception:
+        pass
+
+
+def wait_for_results(driver, timer=None, timeout=None, submitted_at=None, stable_polls=1):
+    """Waits until the frmDtls frame holds a complete response.
+
+    Complete means the frame's document is new since the submit, its
+    readyState is 'complete' and its row count has stopped changing for
+    ``stable_polls`` polls, or that it shows an empty-result page. A new
+    page that replaced the form and has no frame is final once it has
+    loaded; the returned state then has ``frame`` false. Raises
+    ReadinessError as soon as the FOIS 'unable to process' sentinel
+    appears, in the page or in the frame.
+    """
+    submitted_at = submitted_at or time.perf_counter()
+    seen = {"first_byte": False, "rows": -1, "stable": 0}
+
+    def check():
+        state = driver.execute_script(_FRAME_STATE_JS, SERVER_ERROR_TEXT, list(EMPTY_RESULT_TEXTS))
+        if not state:
+            return None
+        if state.get("error"):
+            raise ReadinessError("FOIS Server Error: Unable to process request. Please try again.")
+        if state.get("ready") == "cross-origin":
+            return state
+        if not state.get("fresh"):
+            return None
+
+        if not seen["first_byte"] and (state.get("text") or state.get("rows")):
+            seen["first_byte"] = True
+            if timer is not None:
+                timer.mark("first_byte", submitted_at)
+        if state.get("empty"):
+            return state
+
+        if state.get("ready") != "complete":
+            return None
+        if not state.get("frame"):
+            # A new top-level page without the results frame won't grow one
+            return state
+        if state.get("rows") == seen["rows"]:
+            seen["stable"] += 1
+        else:
+            seen["rows"] = state.get("rows")
+            seen["stable"] = 0
+        if seen["stable"] >= stable_polls or (state.get("rows") == 0 and state.get("text")):
+            return state
+        return None
+
+    # A short poll ceiling, so the error sentinel aborts the wait within half a second
+    return poll(check, timer, timeout, interval=0.1, max_interval=0.5, what="the results table")
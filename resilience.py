@@ -0,0 +1,127 @@
+"""Retry backoff and a per-zone circuit breaker for the FOIS portal.
+
+When FOIS is degraded it answers "unable to process" or times out for a
+while, often for one zone at a time. Failed queries are retried in the same
+session after a jittered exponential backoff, and once a zone keeps failing
+its breaker opens: new queries for that zone fail fast for ``cooldown``
+seconds instead of adding load, then a single probe query decides whether
+the breaker closes again.
+"""
+import os
+import random
+import threading
+import time
+
+from instrumentation import METRICS
+
+MAX_RETRIES = int(os.environ.get("FOIS_MAX_RETRIES", "2"))
+BREAKER_THRESHOLD = int(os.environ.get("FOIS_BREAKER_THRESHOLD", "3"))
+BREAKER_COOLDOWN = int(os.environ.get("FOIS_BREAKER_COOLDOWN", "120"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0, rng=random):
+    """Seconds to wait before retry ``attempt`` (1-based): exponential, capped, half of it jittered."""
+    ceiling = min(cap, base * 2 ** attempt)
+    return ceiling / 2 + rng.uniform(0, ceiling / 2)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of querying a zone whose breaker is open."""
+
+    def __init__(self, zone, retry_after):
+        super().__init__(f"FOIS is failing for zone {zone}; paused for another {retry_after:.0f}s.")
+        self.zone = zone
+        self.retry_after = retry_after
+
+
+class _Circuit:
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+
+class CircuitBreaker:
+    """Per-key (zone) breaker: opens after ``threshold`` consecutive failures."""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Raises CircuitOpen unless a query for ``key`` may go ahead."""
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == CLOSED:
+                return
+            now = time.time()
+            if circuit.state == OPEN:
+                remaining = circuit.opened_at + self.cooldown - now
+                if remaining > 0:
+                    raise CircuitOpen(key, remaining)
+                circuit.state = HALF_OPEN
+                circuit.probe_started = None
+            # Half-open: one probe at a time; a probe that never reported back expires
+            if circuit.probe_started is not None and now - circuit.probe_started < self.cooldown:
+                raise CircuitOpen(key, circuit.probe_started + self.cooldown - now)
+            circuit.probe_started = now
+        self._publish(key)
+
+    def record_success(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                return
+            circuit.state = CLOSED
+            circuit.failures = 0
+            circuit.opened_at = circuit.probe_started = None
+        self._publish(key)
+
+    def record_failure(self, key):
+        with self._lock:
+            circuit = self._circuits.setdefault(key, _Circuit())
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or circuit.failures >= self.threshold:
+                circuit.state = OPEN
+                circuit.opened_at = time.time()
+                circuit.probe_started = None
+        self._publish(key)
+
+    def state(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return circuit.state if circuit else CLOSED
+
+    def states(self):
+        """State, consecutive failures and seconds until the next probe, per key with failures."""
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "zone": key,
+                    "state": circuit.state,
+                    "failures": circuit.failures,
+                    "retry_in_s": round(max(0.0, circuit.opened_at + self.cooldown - now))
+                    if circuit.state == OPEN else 0,
+                }
+                for key, circuit in sorted(self._circuits.items())
+                if circuit.failures or circuit.state != CLOSED
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._circuits.clear()
+
+    def _publish(self, key):
+        METRICS.set("fois_breaker_open", 0 if self.state(key) == CLOSED else 1, zone=key)
+
+
+# Shared by every extractor in the process
+ZONE_BREAKER = CircuitBreaker()
@@ -0,0 +1,155 @@
+"""On-disk cache of extracted results, keyed by (query type, zone, period).
+
+Each result is one Parquet (or Feather) file in a shared directory, so the
+cache survives Streamlit restarts and is shared by every process on the
+host. Entries expire after a TTL, and the least recently used ones are
+evicted once the directory grows past its size limit.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+DEFAULT_DIR = os.environ.get("FOIS_CACHE_DIR", ".fois_cache")
+DEFAULT_TTL = int(os.environ.get("FOIS_CACHE_TTL", "900"))
+DEFAULT_MAX_MB = int(os.environ.get("FOIS_CACHE_MAX_MB", "512"))
+
+FORMATS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+
+_CREATED_KEY = b"fois_created_at"
+
+
+class CachedResult:
+    """A cache hit: the DataFrame and when it was extracted."""
+
+    def __init__(self, df, created_at):
+        self.df = df
+        self.created_at = created_at
+
+    @property
+    def age(self):
+        return time.time() - self.created_at
+
+    def age_text(self):
+        minutes = int(self.age // 60)
+        if minutes < 60:
+            return f"{minutes}m"
+        return f"{minutes // 60}h {minutes % 60}m"
+
+
+class ResultCache:
+    """TTL + LRU cache of result DataFrames stored as columnar files."""
+
+    def __init__(self, directory=DEFAULT_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, fmt="parquet"):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown cache format {fmt!r}; expected one of {list(FORMATS)}")
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(query_type, zone, period=None):
+        raw = f"{query_type}__{zone}__{period or '-'}"
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", raw)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + FORMATS[self.fmt])
+
+    def get(self, query_type, zone, period=None):
+        """Returns a CachedResult, or None on a miss or an expired entry."""
+        path = self._path(self.key(query_type, zone, period))
+        try:
+            if self.fmt == "parquet":
+                table = pq.read_table(path)
+            else:
+                table = feather.read_table(path)
+        except (FileNotFoundError, OSError, pa.ArrowInvalid):
+            return None
+
+        metadata = table.schema.metadata or {}
+        created_at = float(metadata.get(_CREATED_KEY, b"0"))
+        if self.ttl and time.time() - created_at > self.ttl:
+            self._remove(path)
+            return None
+
+        # mtime doubles as the last-access time for LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return CachedResult(table.to_pandas(), created_at)
+
+    def put(self, query_type, zone, period, df):
+        if df is None:
+            return
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_CREATED_KEY] = str(time.time()).encode()
+        table = table.replace_schema_metadata(metadata)
+
+        path = self._path(self.key(query_type, zone, period))
+        # Write to a temp file and rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            if self.fmt == "parquet":
+                pq.write_table(table, tmp, compression="zstd")
+            else:
+                feather.write_feather(table, tmp, compression="zstd")
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self._evict()
+
+    def invalidate(self, query_type, zone, period=None):
+        self._remove(self._path(self.key(query_type, zone, period)))
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+    def _entries(self):
+        suffix = FORMATS[self.fmt]
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            while entries and total > self.max_bytes:
+                path, size, _ = entries.pop(0)
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
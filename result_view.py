@@ -0,0 +1,151 @@
+"""Server-side filtering, sorting and paging of extracted results.
+
+A ResultView keeps a result as an Arrow table, so it can live in the
+Streamlit session across reruns. Filters and sorts run as vectorised Arrow
+compute kernels and yield an array of row indices; only the rows of the
+visible page are ever converted back to pandas and sent to the browser.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+PAGE_SIZE = 100
+
+# Columns offered as value filters, by the words their header contains
+FILTER_COLUMN_HINTS = {
+    "station": ("STATION", "STN"),
+    "commodity": ("COMMODITY", "CMDT"),
+    "zone": ("ZONE", "RLY"),
+}
+
+
+def _find_column(names, hints):
+    for name in names:
+        if any(hint in str(name).upper() for hint in hints):
+            return name
+    return None
+
+
+class Selection:
+    """The rows of a view that pass its filters, in sort order."""
+
+    def __init__(self, table, indices):
+        self.table = table
+        self.indices = indices
+
+    @property
+    def num_rows(self):
+        return len(self.indices)
+
+    def page_count(self, size=PAGE_SIZE):
+        return max(1, -(-self.num_rows // size))
+
+    def page(self, number, size=PAGE_SIZE):
+        """Returns page ``number`` (1-based) as a DataFrame."""
+        start = (number - 1) * size
+        return self.table.take(self.indices.slice(start, size)).to_pandas()
+
+    def to_pandas(self):
+        return self.table.take(self.indices).to_pandas()
+
+
+class ResultView:
+    """An extracted table kept in Arrow form, with filter/sort/page queries."""
+
+    def __init__(self, data):
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        self.table = data
+        names = [str(c) for c in data.column_names]
+        self.filter_columns = {}
+        for kind, hints in FILTER_COLUMN_HINTS.items():
+            column = _find_column(names, hints)
+            if column is not None:
+                self.filter_columns[kind] = column
+        self.date_columns = [
+            name for name, field in zip(names, data.schema)
+            if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type)
+        ]
+        self._options = {}
+        self._last = None
+
+    @property
+    def num_rows(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    def options(self, column):
+        """Sorted distinct non-null values of ``column``, for filter pickers."""
+        if column not in self._options:
+            values = self.table[column]
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            self._options[column] = sorted(v for v in pc.unique(values).to_pylist() if v is not None)
+        return self._options[column]
+
+    def date_bounds(self, column):
+        bounds = pc.min_max(self.table[column]).as_py()
+        if bounds["min"] is None:
+            return None
+        return tuple(v.date() if isinstance(v, datetime) else v for v in (bounds["min"], bounds["max"]))
+
+    def select(self, filters=None, date_column=None, date_range=None, sort_by=None, descending=False):
+        """Applies the filters and sort and returns a Selection.
+
+        ``filters`` maps column names to the values to keep; empty lists are
+        ignored. ``date_range`` is an inclusive (start, end) pair of dates
+        applied to ``date_column``. The last selection is memoised, so
+        paging through it costs only the ``take`` of one page.
+        """
+        filters = {c: tuple(v) for c, v in (filters or {}).items() if v}
+        key = (tuple(sorted(filters.items())), date_column, tuple(date_range or ()), sort_by, descending)
+        if self._last is not None and self._last[0] == key:
+            return self._last[1]
+
+        mask = None
+        for column, values in filters.items():
+            column_type = self.table.schema.field(column).type
+            if pa.types.is_dictionary(column_type):
+                column_type = column_type.value_type
+            value_set = pa.array(values, type=column_type)
+            mask = self._and(mask, pc.is_in(self.table[column], value_set=value_set))
+        if date_column and date_range:
+            mask = self._and(mask, self._date_mask(date_column, *date_range))
+
+        if mask is None:
+            indices = pa.array(np.arange(self.num_rows, dtype=np.uint64))
+        else:
+            indices = pc.indices_nonzero(pc.fill_null(mask, False))
+
+        if sort_by:
+            values = pc.take(self.table[sort_by], indices)
+            # Arrow cannot sort dictionary (categorical) arrays directly
+            if pa.types.is_dictionary(values.type):
+                values = values.cast(values.type.value_type)
+            order = pc.array_sort_indices(values, order="descending" if descending else "ascending",
+                                          null_placement="at_end")
+            indices = pc.take(indices, order)
+
+        selection = Selection(self.table, indices)
+        self._last = (key, selection)
+        return selection
+
+    def _date_mask(self, column, start, end):
+        values = self.table[column]
+        if pa.types.is_timestamp(values.type):
+            # The end date is inclusive, so compare against midnight of the next day
+            start = pa.scalar(datetime.combine(start, time.min)).cast(values.type)
+            end = pa.scalar(datetime.combine(end + timedelta(days=1), time.min)).cast(values.type)
+            return pc.and_(pc.greater_equal(values, start), pc.less(values, end))
+        return pc.and_(pc.greater_equal(values, pa.scalar(start, values.type)),
+                       pc.less_equal(values, pa.scalar(end, values.type)))
+
+    @staticmethod
+    def _and(mask, other):
+        return other if mask is None else pc.and_(mask, other)
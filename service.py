@@ -0,0 +1,807 @@
+"""HTTP service for extractions, run by a pool of worker processes.
+
+Other systems submit a query, poll it, fetch and answer its CAPTCHA and
+download the result over plain HTTP and JSON; the Streamlit app is only one
+possible client. The service itself just queues work. Each worker process
+owns one browser (selenium engine) or HTTP session and runs one job at a
+time through a BatchRun, so retries, the circuit breakers, the result cache
+and the history work as they do in a batch. Throughput grows with the
+number of worker processes and, with a Redis broker, with more nodes
+running ``service.py worker`` against the same Redis.
+
+Endpoints (JSON unless noted):
+
+    POST   /jobs               {"query": "ODR_RK_OTSG", "zone": "ECO", "period": null} -> 202 {"id": ...}
+    GET    /jobs               the most recent jobs
+    GET    /jobs/<id>          status, rows, attempts, error and timings of a job
+    GET    /jobs/<id>/captcha  the CAPTCHA waiting for an answer (image/png); 404 if there is none
+    POST   /jobs/<id>/captcha  {"answer": "AB12C"}
+    GET    /jobs/<id>/result   the result, ?format=parquet (default), csv, csv.gz, ndjson, arrow or xlsx
+    DELETE /jobs/<id>          cancel the job
+    GET    /health             live workers and queued jobs
+
+Workers and the API only meet in the broker, so it is pluggable; anything
+with LocalBroker's methods will do:
+
+    LocalBroker   a multiprocessing manager; the workers run on this host (default)
+    RedisBroker   a Redis server shared by any number of nodes (pip install redis)
+
+Configuration:
+    FOIS_SERVICE_PORT     port to listen on (default: 8800)
+    FOIS_SERVICE_TOKEN    if set, requests need "Authorization: Bearer <token>"
+    FOIS_SERVICE_REDIS    Redis URL for the broker (default: local)
+    FOIS_SERVICE_WORKERS  worker processes (default: 2)
+    FOIS_SERVICE_TTL      seconds finished jobs and their results are kept (default: 3600)
+
+Usage:
+    python service.py serve [--workers 4] [--engine http] [--redis redis://host:6379/0]
+    python service.py worker --redis redis://host:6379/0 [--workers 4]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+import pandas as pd
+
+try:
+    import redis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+from batch import ACTIVE_STATUSES, BatchJob, BatchRun
+from captcha_solver import MODEL_PATH, load_solver
+from driver_profiles import DEFAULT_PROFILE, PROFILES
+from export import FORMATS as EXPORT_FORMATS, export_bytes, file_name
+from extractors import ENGINES, FOIS_URL, PERIODS, QUERY_TYPES, ZONES, HttpExtractor, SeleniumExtractor, new_session
+from history import HISTORY_DIR, HistoryStore
+from resilience import MAX_RETRIES
+from result_cache import DEFAULT_DIR as CACHE_DIR, ResultCache
+
+SERVICE_PORT = int(os.environ.get("FOIS_SERVICE_PORT", "8800"))
+SERVICE_TOKEN = os.environ.get("FOIS_SERVICE_TOKEN", "")
+REDIS_URL = os.environ.get("FOIS_SERVICE_REDIS", "")
+SERVICE_WORKERS = int(os.environ.get("FOIS_SERVICE_WORKERS", "2"))
+JOB_TTL = int(os.environ.get("FOIS_SERVICE_TTL", "3600"))
+
+CAPTCHA_TIMEOUT = 900
+# How often a worker looks for a CAPTCHA answer or a cancel
+POLL_INTERVAL = 0.25
+# A worker that has not checked in for this long is reported as gone
+HEARTBEAT_TIMEOUT = 30
+# What a broker stores per job besides its state
+BLOB_KINDS = ("captcha", "answer", "result", "cancel")
+
+
+class ServiceError(Exception):
+    """A request the service cannot carry out; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# --- Brokers ---
+
+class LocalBroker:
+    """Jobs, CAPTCHAs, answers and results kept in a multiprocessing manager.
+
+    The manager is a small server process; the service and every worker
+    process it starts talk to it through proxies, so the broker can be
+    handed to a worker as a Process argument.
+    """
+
+    def __init__(self):
+        self._manager = multiprocessing.get_context("spawn").Manager()
+        self._queue = self._manager.Queue()
+        self._jobs = self._manager.dict()
+        self._blobs = self._manager.dict()
+        self._workers = self._manager.dict()
+
+    def __getstate__(self):
+        # The proxies can be pickled, the manager itself can't
+        state = dict(self.__dict__)
+        state["_manager"] = None
+        return state
+
+    def submit(self, state):
+        self._jobs[state["id"]] = state
+        self._queue.put(state["id"])
+
+    def next_job(self, timeout=1):
+        """The id of the next queued job, or None if there is none within ``timeout`` seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def update(self, job_id, **fields):
+        # After submit() only the job's worker writes its state, so there are no lost updates
+        state = self._jobs.get(job_id)
+        if state is not None:
+            state.update(fields)
+            self._jobs[job_id] = state
+
+    def jobs(self):
+        return list(self._jobs.values())
+
+    def forget(self, job_id):
+        self._jobs.pop(job_id, None)
+        for kind in BLOB_KINDS:
+            self._blobs.pop((kind, job_id), None)
+
+    def put(self, kind, job_id, data):
+        self._blobs[(kind, job_id)] = data
+
+    def get(self, kind, job_id):
+        return self._blobs.get((kind, job_id))
+
+    def delete(self, kind, job_id):
+        self._blobs.pop((kind, job_id), None)
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def heartbeat(self, worker):
+        self._workers[worker] = time.time()
+
+    def workers(self, max_age=HEARTBEAT_TIMEOUT):
+        now = time.time()
+        return sorted(name for name, seen in self._workers.items() if now - seen < max_age)
+
+    def close(self):
+        if self._manager is not None:
+            self._manager.shutdown()
+
+
+class RedisBroker:
+    """The LocalBroker interface on a Redis server, so workers can run on any node."""
+
+    prefix = "fois:"
+
+    def __init__(self, url=REDIS_URL):
+        if not HAS_REDIS:
+            raise RuntimeError("The Redis broker needs the redis package: pip install redis")
+        self.url = url
+        self._redis = redis.Redis.from_url(url)
+
+    def __getstate__(self):
+        return {"url": self.url}
+
+    def __setstate__(self, state):
+        self.__init__(state["url"])
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def submit(self, state):
+        job_id = state["id"]
+        pipe = self._redis.pipeline()
+        pipe.set(self._key("job", job_id), json.dumps(state))
+        pipe.zadd(self._key("jobs"), {job_id: state["created_at"]})
+        pipe.rpush(self._key("queue"), job_id)
+        pipe.execute()
+
+    def next_job(self, timeout=1):
+        item = self._redis.blpop(self._key("queue"), timeout=max(1, int(timeout)))
+        return item[1].decode() if item else None
+
+    def job(self, job_id):
+        raw = self._redis.get(self._key("job", job_id))
+        return json.loads(raw) if raw else None
+
+    def update(self, job_id, **fields):
+        state = self.job(job_id)
+        if state is not None:
+            state.update(fields)
+            self._redis.set(self._key("job", job_id), json.dumps(state))
+
+    def jobs(self):
+        ids = [job_id.decode() for job_id in self._redis.zrange(self._key("jobs"), 0, -1)]
+        if not ids:
+            return []
+        raws = self._redis.mget([self._key("job", job_id) for job_id in ids])
+        return [json.loads(raw) for raw in raws if raw]
+
+    def forget(self, job_id):
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._key("jobs"), job_id)
+        pipe.delete(self._key("job", job_id), *(self._key(kind, job_id) for kind in BLOB_KINDS))
+        pipe.execute()
+
+    def put(self, kind, job_id, data):
+        self._redis.set(self._key(kind, job_id), data)
+
+    def get(self, kind, job_id):
+        return self._redis.get(self._key(kind, job_id))
+
+    def delete(self, kind, job_id):
+        self._redis.delete(self._key(kind, job_id))
+
+    def queued(self):
+        return self._redis.llen(self._key("queue"))
+
+    def heartbeat(self, worker):
+        self._redis.hset(self._key("workers"), worker, time.time())
+
+    def workers(self, max_age=HEARTBEAT_TIMEOUT):
+        now = time.time()
+        seen = self._redis.hgetall(self._key("workers"))
+        return sorted(name.decode() for name, at in seen.items() if now - float(at) < max_age)
+
+    def close(self):
+        self._redis.close()
+
+
+def make_broker(redis_url=REDIS_URL):
+    return RedisBroker(redis_url) if redis_url else LocalBroker()
+
+
+# --- Workers ---
+
+class Worker:
+    """Takes jobs off a broker one at a time, with its own browser or HTTP session.
+
+    Every job is a one-job BatchRun. Its CAPTCHAs are first offered to the
+    offline model (``auto_solve``); the rest are posted to the broker for a
+    client to answer, and the worker waits up to ``captcha_timeout`` seconds.
+    """
+
+    def __init__(self, broker, name, engine="http", url=FOIS_URL, driver_profile=DEFAULT_PROFILE, auto_solve=False,
+                 captcha_timeout=CAPTCHA_TIMEOUT, max_retries=MAX_RETRIES, cache_dir=CACHE_DIR, history_dir=HISTORY_DIR):
+        self.broker = broker
+        self.name = name
+        self.engine = engine
+        self.url = url
+        self.driver_profile = driver_profile
+        self.captcha_timeout = captcha_timeout
+        self.max_retries = max_retries
+        self.auto_solver = load_solver() if auto_solve else None
+        self.cache = ResultCache(cache_dir) if cache_dir else None
+        self.history = HistoryStore(history_dir) if history_dir else None
+
+        self._session = None
+        self._driver = None
+        self._extractor = None
+        self._table = None
+
+    def new_extractor(self):
+        """An extractor on this worker's own session; the browser is launched on first use and kept."""
+        if self.engine == "selenium":
+            if self._driver is None:
+                from extract_fois_data import setup_driver
+                self._driver = setup_driver(self.driver_profile)
+            extractor = SeleniumExtractor(self._driver, url=self.url, release=self._release)
+        else:
+            if self._session is None:
+                self._session = new_session()
+            extractor = HttpExtractor(self.url, session=self._session)
+        self._table = None
+        extractor.progress = self._on_progress
+        self._extractor = extractor
+        return extractor
+
+    def _release(self, driver, broken=False):
+        if broken:
+            self._quit()
+
+    def _quit(self):
+        driver, self._driver = self._driver, None
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def _on_progress(self, table):
+        self._table = table
+
+    def run(self, stop):
+        """Runs jobs until ``stop`` (an Event) is set."""
+        print(f"[{self.name}] Ready ({self.engine} engine)")
+        try:
+            while not stop.is_set():
+                self.broker.heartbeat(self.name)
+                job_id = self.broker.next_job(timeout=1)
+                if job_id is None:
+                    continue
+                try:
+                    self.run_job(job_id)
+                except Exception as e:
+                    print(f"[{self.name}] Job {job_id} failed: {e}")
+                    self.broker.update(job_id, status="failed", error=str(e), finished_at=time.time())
+        finally:
+            self._quit()
+
+    def run_job(self, job_id):
+        state = self.broker.job(job_id)
+        if state is None:
+            # Pruned while it was queued
+            return
+        if self.broker.get("cancel", job_id):
+            self.broker.update(job_id, status="cancelled", finished_at=time.time())
+            return
+
+        job = BatchJob(state["query"], state["zone"], state.get("period"))
+        self.broker.update(job_id, worker=self.name, started_at=time.time())
+        run = BatchRun([job], self.new_extractor, max_workers=1, captcha_timeout=self.captcha_timeout,
+                       cache=self.cache, max_retries=self.max_retries, solver=self.auto_solver,
+                       history=self.history).start()
+        published = None
+        while not run.done:
+            self.broker.heartbeat(self.name)
+            if self.broker.get("cancel", job_id):
+                self._cancel(run)
+            request = run.next_captcha(timeout=POLL_INTERVAL)
+            if request is not None:
+                self._ask(job_id, job, request, run)
+            published = self._publish(job_id, job, published)
+        run.wait()
+
+        if job.df is not None:
+            self.broker.put("result", job_id, export_bytes(job.df, "parquet"))
+        elif self.broker.get("cancel", job_id):
+            job.status = "cancelled"
+        self._extractor = self._table = None
+        self._publish(job_id, job, finished_at=time.time())
+        print(f"[{self.name}] {job.label}: {job.status}, {job.rows} rows")
+
+    def _cancel(self, run):
+        run.cancel()
+        extractor = self._extractor
+        if extractor is not None:
+            extractor.cancel()
+
+    def _ask(self, job_id, job, request, run):
+        """Posts the CAPTCHA for a client and waits for its answer, a cancel or the timeout."""
+        self.broker.delete("answer", job_id)
+        self.broker.put("captcha", job_id, request.image)
+        self._publish(job_id, job)
+        answer = None
+        deadline = time.time() + self.captcha_timeout
+        try:
+            while time.time() < deadline:
+                self.broker.heartbeat(self.name)
+                answer = self.broker.get("answer", job_id)
+                if answer is not None:
+                    break
+                if self.broker.get("cancel", job_id):
+                    self._cancel(run)
+                    break
+                time.sleep(POLL_INTERVAL)
+        finally:
+            self.broker.delete("captcha", job_id)
+            self.broker.delete("answer", job_id)
+        if isinstance(answer, bytes):
+            answer = answer.decode("utf-8")
+        if answer:
+            request.solve(answer)
+        else:
+            request.skip()
+
+    def _publish(self, job_id, job, published=None, **fields):
+        """Writes the job's status to the broker if it changed; returns what was written."""
+        table = self._table
+        state = {
+            "status": job.status,
+            "rows": job.rows or (table.n_rows if table is not None else 0),
+            "attempts": job.attempts,
+            "solver": job.solver,
+            "error": job.error,
+            "timings": {phase: round(seconds, 2) for phase, seconds in job.timings.items()},
+            **fields,
+        }
+        if state != published:
+            self.broker.update(job_id, **state)
+        return state
+
+
+def run_worker(broker, name, settings, stop):
+    """Entry point of a worker process."""
+    try:
+        Worker(broker, name, **settings).run(stop)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(broker, count, settings, stop):
+    """Starts ``count`` worker processes; ``stop`` (a spawn-context Event) ends them."""
+    ctx = multiprocessing.get_context("spawn")
+    host = socket.gethostname()
+    processes = []
+    for i in range(count):
+        name = f"{host}-{os.getpid()}-{i + 1}"
+        process = ctx.Process(target=run_worker, args=(broker, name, settings, stop), name=f"fois-worker-{i + 1}",
+                              daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_workers(processes, stop, timeout=10):
+    stop.set()
+    deadline = time.time() + timeout
+    for process in processes:
+        process.join(max(0.1, deadline - time.time()))
+        if process.is_alive():
+            process.terminate()
+
+
+# --- API ---
+
+class ExtractionService:
+    """What the HTTP endpoints do, on top of a broker.
+
+    A job whose worker stops sending heartbeats for ``heartbeat_timeout``
+    seconds while running it (the process died or its node went away) is
+    marked failed the next time it is looked at, so clients stop polling.
+    """
+
+    def __init__(self, broker, ttl=JOB_TTL, heartbeat_timeout=HEARTBEAT_TIMEOUT):
+        self.broker = broker
+        self.ttl = ttl
+        self.heartbeat_timeout = heartbeat_timeout
+
+    def submit(self, query, zone, period=None):
+        if query not in QUERY_TYPES.values():
+            raise ServiceError(f"Unknown query {query!r}; expected one of {', '.join(QUERY_TYPES.values())}")
+        if zone not in ZONES:
+            raise ServiceError(f"Unknown zone {zone!r}")
+        if query == "MATURED_INDENTS":
+            period = str(period or "7")
+            if period not in PERIODS:
+                raise ServiceError(f"Unknown period {period!r}; expected one of {', '.join(PERIODS)}")
+        else:
+            period = None
+        self.prune()
+        state = {"id": secrets.token_hex(8), "query": query, "zone": zone, "period": period, "status": "queued",
+                 "rows": 0, "attempts": 0, "solver": None, "error": None, "timings": {}, "worker": None,
+                 "created_at": time.time(), "started_at": None, "finished_at": None}
+        self.broker.submit(state)
+        return state
+
+    def status(self, job_id):
+        state = self.broker.job(job_id)
+        if state is None:
+            raise ServiceError(f"No job {job_id}", 404)
+        return self._reap([state])[0]
+
+    def jobs(self, limit=100):
+        self.prune()
+        return sorted(self._reap(self.broker.jobs()), key=lambda state: state["created_at"], reverse=True)[:limit]
+
+    def captcha(self, job_id):
+        self.status(job_id)
+        image = self.broker.get("captcha", job_id)
+        if image is None:
+            raise ServiceError(f"Job {job_id} is not waiting for a CAPTCHA", 404)
+        return image
+
+    def answer(self, job_id, text):
+        self.status(job_id)
+        if not text:
+            raise ServiceError("The answer is empty")
+        if self.broker.get("captcha", job_id) is None:
+            raise ServiceError(f"Job {job_id} is not waiting for a CAPTCHA", 409)
+        self.broker.put("answer", job_id, text.strip())
+
+    def result(self, job_id, fmt="parquet"):
+        """The result as (bytes, mime type, file name)."""
+        if fmt not in EXPORT_FORMATS:
+            raise ServiceError(f"Unknown format {fmt!r}; expected one of {', '.join(EXPORT_FORMATS)}")
+        state = self.status(job_id)
+        if state["status"] in ("queued",) + ACTIVE_STATUSES:
+            raise ServiceError(f"Job {job_id} is still {state['status']}", 409)
+        data = self.broker.get("result", job_id)
+        if data is None:
+            raise ServiceError(f"Job {job_id} has no result ({state['status']})", 404)
+        if fmt != "parquet":
+            data = export_bytes(pd.read_parquet(io.BytesIO(data)), fmt)
+        stem = "_".join(p for p in (state["zone"], state["query"], state["period"]) if p)
+        return data, EXPORT_FORMATS[fmt]["mime"], file_name(stem, fmt)
+
+    def cancel(self, job_id):
+        state = self.status(job_id)
+        if state["status"] in ("queued",) + ACTIVE_STATUSES:
+            self.broker.put("cancel", job_id, b"1")
+        return self.status(job_id)
+
+    def health(self):
+        return {"workers": self.broker.workers(self.heartbeat_timeout), "queued": self.broker.queued()}
+
+    def _reap(self, states):
+        """Fails the jobs among ``states`` whose worker is gone; returns ``states``, updated."""
+        live = None
+        for state in states:
+            if state["status"] not in ("queued",) + ACTIVE_STATUSES or not state.get("worker"):
+                continue
+            if live is None:
+                live = set(self.broker.workers(self.heartbeat_timeout))
+            if state["worker"] in live:
+                continue
+            fields = {"status": "failed", "error": f"Worker {state['worker']} stopped while running the job",
+                      "finished_at": time.time()}
+            self.broker.update(state["id"], **fields)
+            self.broker.delete("captcha", state["id"])
+            state.update(fields)
+        return states
+
+    def prune(self):
+        """Forgets finished jobs, and their results, older than the TTL."""
+        cutoff = time.time() - self.ttl
+        for state in self.broker.jobs():
+            if (state.get("finished_at") or float("inf")) < cutoff:
+                self.broker.forget(state["id"])
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """Request handler; the ExtractionService and token live on the server object."""
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        service = self.server.service
+        try:
+            token = self.server.token
+            if token and not secrets.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                raise ServiceError("Missing or wrong token", 401)
+
+            if parts == ["health"] and method == "GET":
+                self._send_json(service.health())
+            elif parts == ["jobs"] and method == "GET":
+                self._send_json({"jobs": service.jobs(int(params.get("limit", 100)))})
+            elif parts == ["jobs"] and method == "POST":
+                body = self._read_json()
+                state = service.submit(body.get("query", "ODR_RK_OTSG"), body.get("zone"), body.get("period"))
+                self._send_json(state, 202)
+            elif len(parts) == 2 and parts[0] == "jobs" and method == "GET":
+                self._send_json(service.status(parts[1]))
+            elif len(parts) == 2 and parts[0] == "jobs" and method == "DELETE":
+                self._send_json(service.cancel(parts[1]))
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "captcha" and method == "GET":
+                self._send(service.captcha(parts[1]), "image/png")
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "captcha" and method == "POST":
+                service.answer(parts[1], str(self._read_json().get("answer") or ""))
+                self._send_json({"id": parts[1], "answered": True}, 202)
+            elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result" and method == "GET":
+                data, mime, name = service.result(parts[1], params.get("format", "parquet"))
+                self._send(data, mime, {"Content-Disposition": f'attachment; filename="{name}"'})
+            else:
+                raise ServiceError(f"No such endpoint: {method} {url.path}", 404)
+        except ServiceError as e:
+            self._send_json({"error": str(e)}, e.status)
+        except Exception as e:
+            self._send_json({"error": str(e)}, 500)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            raise ServiceError("The request body is not JSON")
+        if not isinstance(body, dict):
+            raise ServiceError("The request body must be a JSON object")
+        return body
+
+    def _send_json(self, data, status=200):
+        self._send(json.dumps(data).encode("utf-8"), "application/json", status=status)
+
+    def _send(self, body, content_type, headers=None, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, token=SERVICE_TOKEN, verbose=False):
+        super().__init__(address, ServiceHandler)
+        self.service = service
+        self.token = token
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(service, host="127.0.0.1", port=0, **kwargs):
+    """Starts a ServiceServer on a background thread and returns it."""
+    server = ServiceServer((host, port), service, **kwargs)
+    threading.Thread(target=server.serve_forever, name="fois-service", daemon=True).start()
+    return server
+
+
+# --- Client ---
+
+class ServiceClient:
+    """Calls a running service, e.g. from another system or a notebook."""
+
+    def __init__(self, base_url, token=SERVICE_TOKEN, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _call(self, method, path, body=None, params=None):
+        url = self.base_url + path + (f"?{urlencode(params)}" if params else "")
+        request = Request(url, method=method, data=json.dumps(body).encode("utf-8") if body is not None else None)
+        if body is not None:
+            request.add_header("Content-Type", "application/json")
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        try:
+            with urlopen(request, timeout=self.timeout) as resp:
+                data = resp.read()
+                return json.loads(data) if resp.headers.get_content_type() == "application/json" else data
+        except HTTPError as e:
+            try:
+                message = json.loads(e.read())["error"]
+            except Exception:
+                message = e.reason
+            raise ServiceError(message, e.code) from None
+
+    def submit(self, query, zone, period=None):
+        """Queues a query; returns its job id."""
+        return self._call("POST", "/jobs", {"query": query, "zone": zone, "period": period})["id"]
+
+    def status(self, job_id):
+        return self._call("GET", f"/jobs/{job_id}")
+
+    def jobs(self):
+        return self._call("GET", "/jobs")["jobs"]
+
+    def captcha(self, job_id):
+        return self._call("GET", f"/jobs/{job_id}/captcha")
+
+    def answer(self, job_id, text):
+        self._call("POST", f"/jobs/{job_id}/captcha", {"answer": text})
+
+    def cancel(self, job_id):
+        return self._call("DELETE", f"/jobs/{job_id}")
+
+    def result(self, job_id, fmt="parquet"):
+        """The result as bytes in ``fmt``."""
+        return self._call("GET", f"/jobs/{job_id}/result", params={"format": fmt})
+
+    def dataframe(self, job_id):
+        return pd.read_parquet(io.BytesIO(self.result(job_id)))
+
+    def health(self):
+        return self._call("GET", "/health")
+
+    def wait(self, job_id, solve=None, poll=1.0, timeout=None):
+        """Polls until the job finishes and returns its final status.
+
+        ``solve(image, status)`` is called for every CAPTCHA the job waits on
+        and returns the answer; without it, CAPTCHAs are left to someone else.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        answered = None
+        while True:
+            state = self.status(job_id)
+            if state["status"] not in ("queued",) + ACTIVE_STATUSES:
+                return state
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError(f"Job {job_id} is still {state['status']}")
+            if solve is not None and state["status"] == "awaiting captcha" and answered != state["attempts"]:
+                try:
+                    image = self.captcha(job_id)
+                except ServiceError:
+                    image = None
+                if image is not None:
+                    self.answer(job_id, solve(image, state))
+                    answered = state["attempts"]
+            time.sleep(poll)
+
+
+# --- Command line ---
+
+def _worker_settings(args):
+    return {
+        "engine": args.engine,
+        "url": args.url,
+        "driver_profile": args.driver_profile,
+        "auto_solve": args.auto_solve,
+        "captcha_timeout": args.captcha_timeout,
+        "max_retries": args.retries,
+        "cache_dir": args.cache,
+        "history_dir": args.history,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="Serve the HTTP API and run workers")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=SERVICE_PORT)
+    serve.add_argument("--verbose", action="store_true", help="Log every request")
+    worker = commands.add_parser("worker", help="Run workers only, against a shared Redis broker")
+    for sub, workers in ((serve, SERVICE_WORKERS), (worker, SERVICE_WORKERS)):
+        sub.add_argument("--workers", type=int, default=workers, help="Worker processes on this node")
+        sub.add_argument("--redis", default=REDIS_URL, help="Redis URL of the broker (default: local)")
+        sub.add_argument("--engine", default="http", choices=list(ENGINES))
+        sub.add_argument("--url", default=FOIS_URL, help="FOIS form URL, e.g. a fois_replay.py server")
+        sub.add_argument("--driver-profile", default=DEFAULT_PROFILE, choices=list(PROFILES),
+                         help="Chrome launch profile for the selenium engine")
+        sub.add_argument("--auto-solve", action="store_true", help="Try the trained offline CAPTCHA model first")
+        sub.add_argument("--captcha-timeout", type=int, default=CAPTCHA_TIMEOUT,
+                         help="Seconds a worker waits for a CAPTCHA answer")
+        sub.add_argument("--retries", type=int, default=MAX_RETRIES,
+                         help="New CAPTCHAs to ask for when FOIS cannot process a query")
+        sub.add_argument("--cache", default=CACHE_DIR, help="Result cache directory; empty disables")
+        sub.add_argument("--history", default=HISTORY_DIR,
+                         help="Append results to this history store (history.py); empty disables")
+    args = parser.parse_args(argv)
+
+    if args.auto_solve and load_solver() is None:
+        parser.error(f"No CAPTCHA model at {MODEL_PATH}; run 'python captcha_solver.py train' first.")
+    if args.redis and not HAS_REDIS:
+        parser.error("The Redis broker needs the redis package: pip install redis")
+    if args.command == "worker" and not args.redis:
+        parser.error("Workers on their own need a shared broker; pass --redis or set FOIS_SERVICE_REDIS.")
+    if args.command == "serve" and args.workers < 1 and not args.redis:
+        parser.error("Without --redis the workers must run in this process; pass --workers 1 or more.")
+
+    # docker stop and systemd send SIGTERM; shut down as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    broker = make_broker(args.redis)
+    stop = multiprocessing.get_context("spawn").Event()
+    processes = start_workers(broker, args.workers, _worker_settings(args), stop)
+    server = None
+    try:
+        if args.command == "serve":
+            server = ServiceServer((args.host, args.port), ExtractionService(broker), verbose=args.verbose)
+            print(f"Serving the extraction API at {server.url} with {args.workers} worker(s)")
+            server.serve_forever()
+        else:
+            print(f"Running {args.workers} worker(s) against {args.redis}")
+            for process in processes:
+                process.join()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        if server is not None:
+            server.server_close()
+        stop_workers(processes, stop)
+        broker.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+import pandas as pd
+
+from batch import CAPTCHA_ATTEMPTS, BatchJob, BatchRun, build_jobs
+from conftest import CAPTCHA, ROWS
+from extractors import HttpExtractor
+from result_cache import ResultCache
+
+
+def answer_all(run, answer=CAPTCHA):
+    """Plays the operator: answers every CAPTCHA the run queues until it is done."""
+    while not run.done:
+        request = run.next_captcha(timeout=0.1)
+        if request is not None:
+            request.solve(answer)
+    return run.wait()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_build_jobs():
+    jobs = build_jobs(["ODR_RK_OTSG", "MATURED_INDENTS"], ["ECO", "SEC"], ["7", "15"])
+    assert sorted(job.label for job in jobs) == [
+        "ECO/MATURED_INDENTS/15", "ECO/MATURED_INDENTS/7", "ECO/ODR_RK_OTSG",
+        "SEC/MATURED_INDENTS/15", "SEC/MATURED_INDENTS/7", "SEC/ODR_RK_OTSG",
+    ]
+
+
+def test_run_and_merge(replay):
+    server = replay()
+    jobs = build_jobs(["ODR_RK_OTSG"], ["ECO", "SEC", "NR"])
+    run = answer_all(BatchRun(jobs, lambda: HttpExtractor(server.form_url), max_workers=2).start())
+
+    assert run.progress() == {"done": 3}
+    assert run.finished_at is not None
+    merged = run.results()
+    assert len(merged) == 3 * ROWS
+    assert set(merged["zone"]) == {"ECO", "SEC", "NR"}
+    assert isinstance(merged["zone"].dtype, pd.CategoricalDtype)
+    summary = run.summary()
+    assert (summary["attempts"] == 1).all() and (summary["retries"] == 0).all()
+
+
+def test_cached_jobs_skip_the_portal(replay, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("ODR_RK_OTSG", "ECO", None, pd.DataFrame({"ODR No": ["ODR1"]}))
+    server = replay()
+    jobs = build_jobs(["ODR_RK_OTSG"], ["ECO", "SEC"])
+    run = answer_all(BatchRun(jobs, lambda: HttpExtractor(server.form_url), cache=cache).start())
+    assert {job.zone: job.status for job in run.jobs} == {"ECO": "cached", "SEC": "done"}
+    assert cache.get("ODR_RK_OTSG", "SEC") is not None
+
+
+def test_server_error_is_retried(replay):
+    server = replay(error_rate=1.0)
+
+    def solver(image, job):
+        # FOIS recovers after the first failure
+        if job.retries:
+            server.error_rate = 0.0
+        return CAPTCHA
+
+    job = BatchJob("ODR_RK_OTSG", "ECO")
+    BatchRun([job], lambda: HttpExtractor(server.form_url), solver=solver, max_retries=2).start().wait()
+    assert (job.status, job.retries, job.attempts, job.rows) == ("done", 1, 2, ROWS)
+
+
+def test_server_error_retries_run_out(replay):
+    server = replay(error_rate=1.0)
+    job = BatchJob("ODR_RK_OTSG", "ECO")
+    BatchRun([job], lambda: HttpExtractor(server.form_url), solver=lambda image, job: CAPTCHA,
+             max_retries=1).start().wait()
+    assert (job.status, job.retries, job.attempts) == ("server error", 1, 2)
+    assert "Unable to process" in job.error
+
+
+def test_rejected_captchas_dont_count_as_retries(replay):
+    server = replay()
+    job = BatchJob("ODR_RK_OTSG", "ECO")
+    BatchRun([job], lambda: HttpExtractor(server.form_url), solver=lambda image, job: "WRONG").start().wait()
+    assert (job.status, job.attempts, job.retries) == ("captcha rejected", CAPTCHA_ATTEMPTS, 0)
+
+
+def test_unanswered_captcha_expires(replay):
+    server = replay()
+    job = BatchJob("ODR_RK_OTSG", "ECO")
+    run = BatchRun([job], lambda: HttpExtractor(server.form_url), captcha_timeout=0.2).start().wait()
+    assert job.status == "skipped"
+    # The expired request is not handed out any more
+    assert run.next_captcha() is None
+
+
+def test_cancel_skips_only_this_runs_captchas(replay):
+    server = replay()
+    captchas = queue.Queue()
+    other = BatchRun([BatchJob("ODR_RK_OTSG", "NR")], lambda: HttpExtractor(server.form_url),
+                     captchas=captchas).start()
+    jobs = build_jobs(["ODR_RK_OTSG"], ["ECO", "SEC", "WR"])
+    run = BatchRun(jobs, lambda: HttpExtractor(server.form_url), max_workers=1, captchas=captchas).start()
+    wait_for(lambda: captchas.qsize() == 2)
+
+    run.cancel()
+    run.wait()
+    # The job that was waiting on its CAPTCHA is cancelled too, not skipped
+    assert [job.status for job in run.jobs] == ["cancelled"] * 3
+    assert run.done and run.finished_at is not None
+    # The other run's CAPTCHA is still waiting for an answer
+    request = other.next_captcha()
+    assert request.job is other.jobs[0]
+    request.solve(CAPTCHA)
+    assert other.wait().jobs[0].status == "done"
+
+
+def test_cancel_stops_a_fetch(replay):
+    server = replay(rows=20000, chunk_delay=0.05)
+    job = BatchJob("ODR_RK_OTSG", "ECO")
+    run = BatchRun([job], lambda: HttpExtractor(server.form_url), solver=lambda image, job: CAPTCHA).start()
+    wait_for(lambda: job.status == "fetching")
+
+    started = time.monotonic()
+    threading.Timer(0.2, run.cancel).start()
+    run.wait()
+    assert job.status == "cancelled"
+    assert time.monotonic() - started < 5
+
+
+def test_run_cancelled_before_its_jobs_start_finishes(replay):
+    server = replay()
+    run = BatchRun(build_jobs(["ODR_RK_OTSG"], ["ECO", "SEC"]), lambda: HttpExtractor(server.form_url))
+    run.cancel()
+    run.start().wait()
+    assert run.progress() == {"cancelled": 2}
+    assert run.finished_at is not None
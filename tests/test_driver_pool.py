@@ -0,0 +1,48 @@
+import threading
+import time
+
+import pytest
+
+from driver_pool import DriverPool, PoolExhausted
+from instrumentation import METRICS
+
+
+class FakeDriver:
+    def __init__(self, quit_delay=0.0):
+        self.quit_delay = quit_delay
+        self.quit_called = threading.Event()
+
+    def execute_script(self, script):
+        return 1
+
+    def quit(self):
+        self.quit_called.set()
+        time.sleep(self.quit_delay)
+
+
+def test_stale_leases_are_quit_outside_the_lock():
+    pool = DriverPool(lambda: FakeDriver(quit_delay=1.0), size=0, max_size=2, lease_timeout=0.1)
+    stale = pool.checkout()
+    time.sleep(0.2)
+
+    # The next checkout reclaims the stale lease and quits its browser...
+    thread = threading.Thread(target=pool.checkout)
+    thread.start()
+    assert stale.quit_called.wait(5)
+    # ...without holding the pool up while it does
+    started = time.monotonic()
+    assert pool.stats()["leased"] <= 1
+    assert time.monotonic() - started < 0.5
+    thread.join()
+    pool.close()
+
+
+def test_launch_failures_are_counted():
+    def factory():
+        raise RuntimeError("no chrome here")
+
+    before = METRICS.counter("fois_driver_launch_failures_total")
+    pool = DriverPool(factory, size=0)
+    with pytest.raises(PoolExhausted, match="no chrome here"):
+        pool.checkout()
+    assert METRICS.counter("fois_driver_launch_failures_total") == before + 1
@@ -0,0 +1,158 @@
+import time
+
+import pytest
+
+from conftest import CAPTCHA, ROWS
+from extractors import CaptchaRejected, FoisServerError, HttpExtractor, SeleniumExtractor
+from fois_parser import RowFeed
+from fois_replay import ERROR_HTML, sample_results_html
+from readiness import _FRAME_STATE_JS, QueryTimer, ReadinessError, wait_for_results
+from resilience import ZONE_BREAKER, CircuitOpen
+
+
+def test_load_and_extract(replay):
+    server = replay()
+    extractor = HttpExtractor(server.form_url)
+    image = extractor.load("ODR_RK_OTSG", "ECO")
+    assert image.startswith(b"\x89PNG")
+
+    df = extractor.extract(CAPTCHA)
+    assert len(df) == ROWS
+    assert {"Station", "ODR No", "Wagons Demanded"} <= set(df.columns)
+    assert (df["Zone"] == "ECO").all()
+    assert df["Wagons Demanded"].dtype == "int64"
+    assert extractor.stats["rows"] == ROWS
+    assert extractor.stats["html_bytes"] > 0
+    assert {"navigate", "captcha", "submit", "table_complete"} <= set(extractor.timings)
+    extractor.close()
+
+
+def test_matured_indents_period(replay):
+    server = replay()
+    extractor = HttpExtractor(server.form_url)
+    extractor.load("MATURED_INDENTS", "SEC", "15")
+    df = extractor.extract(CAPTCHA)
+    assert len(df) == ROWS
+    assert any("INDENT" in column.upper() for column in df.columns)
+
+
+def test_stand_in_answers_are_not_labels(replay):
+    # Only the live portal checks CAPTCHA answers
+    assert not HttpExtractor(replay().form_url).live
+
+
+def test_wrong_captcha_is_rejected_then_reloaded(replay):
+    server = replay()
+    extractor = HttpExtractor(server.form_url)
+    extractor.load("ODR_RK_OTSG", "ECO")
+    with pytest.raises(CaptchaRejected):
+        extractor.extract("WRONG")
+
+    assert extractor.reload_captcha().startswith(b"\x89PNG")
+    assert len(extractor.extract(CAPTCHA)) == ROWS
+    # A wrong answer says nothing about the portal's health
+    assert ZONE_BREAKER.state("ECO") == "closed"
+
+
+def test_server_error_retry(replay):
+    server = replay(error_rate=1.0)
+    extractor = HttpExtractor(server.form_url)
+    extractor.load("ODR_RK_OTSG", "ECO")
+    with pytest.raises(FoisServerError):
+        extractor.extract(CAPTCHA)
+
+    server.error_rate = 0.0
+    assert extractor.retry(1).startswith(b"\x89PNG")
+    assert extractor.stats["attempt"] == 1
+    assert len(extractor.extract(CAPTCHA)) == ROWS
+
+
+def test_server_errors_open_the_breaker(replay):
+    server = replay(error_rate=1.0)
+    extractor = HttpExtractor(server.form_url)
+    for _ in range(ZONE_BREAKER.threshold):
+        extractor.load("ODR_RK_OTSG", "WR")
+        with pytest.raises(FoisServerError):
+            extractor.extract(CAPTCHA)
+    with pytest.raises(CircuitOpen):
+        extractor.load("ODR_RK_OTSG", "WR")
+    # Other zones are not affected
+    extractor.load("ODR_RK_OTSG", "ECO")
+
+
+def test_row_feed_marks_failed_attempts(replay, tmp_path):
+    # An error page that follows part of a results table, as FOIS sometimes sends
+    errors = tmp_path / "errors"
+    errors.mkdir()
+    page = sample_results_html("ODR_RK_OTSG", "ECO", rows=2000).replace("</table></body></html>", "")
+    (errors / "partial.html").write_text(page + "</table>" + ERROR_HTML, encoding="utf-8")
+    server = replay(str(tmp_path), error_rate=1.0)
+
+    streamed = {}
+    extractor = HttpExtractor(server.form_url)
+
+    def on_rows(columns, rows):
+        streamed[feed.attempt] = streamed.get(feed.attempt, 0) + len(rows)
+
+    feed = extractor.progress = RowFeed(on_rows)
+    extractor.load("ODR_RK_OTSG", "ECO")
+    with pytest.raises(FoisServerError):
+        extractor.extract(CAPTCHA)
+    assert streamed[1] > 0
+
+    server.error_rate = 0.0
+    extractor.retry(1)
+    df = extractor.extract(CAPTCHA)
+    assert feed.attempt == 2
+    assert streamed[2] == len(df) == ROWS
+    assert feed.discarded == [(1, streamed[1])]
+
+
+class FakeDriver:
+    """Answers the readiness script with a page that replaced the form and has no frmDtls frame."""
+
+    def __init__(self, state, page=""):
+        self.state = dict({"frame": False, "fresh": True, "ready": "complete", "rows": 0, "error": False,
+                           "empty": False, "text": len(page)}, **state)
+        self.page = page
+        self.polls = 0
+
+    def execute_script(self, script, *args):
+        if script == _FRAME_STATE_JS:
+            self.polls += 1
+            return self.state
+        if "innerHTML" in script:
+            return self.page
+
+    def find_element(self, by, value):
+        return FakeElement()
+
+
+class FakeElement:
+    def clear(self):
+        pass
+
+    def send_keys(self, text):
+        pass
+
+    def click(self):
+        pass
+
+
+def test_page_without_the_frame_ends_the_wait():
+    driver = FakeDriver({"text": 40})
+    started = time.monotonic()
+    state = wait_for_results(driver, QueryTimer(30))
+    assert not state["frame"] and driver.polls == 1
+    assert time.monotonic() - started < 1
+
+    with pytest.raises(ReadinessError):
+        wait_for_results(FakeDriver({"error": True}), QueryTimer(30))
+
+
+def test_whole_page_invalid_captcha_is_rejected():
+    extractor = SeleniumExtractor(FakeDriver({"empty": True}, page="<b>Invalid Captcha</b>"))
+    extractor._start_query("ODR_RK_OTSG", "ECO")
+    with pytest.raises(CaptchaRejected):
+        extractor.submit("WRONG")
+    assert extractor.timer.total() < 1
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+
+from conftest import CAPTCHA, ROWS
+from extractors import HttpExtractor
+from harvester import CHANGE_COLUMN, CHANGED_FIELDS_COLUMN, Harvester, SnapshotStore, diff_snapshots, find_key_columns
+
+
+def snapshot(rows):
+    return pd.DataFrame(rows, columns=["S.No", "ODR No", "Station", "Wagons Outstanding"])
+
+
+OLD = snapshot([(1, "ODR1", "ABC", 10), (2, "ODR2", "ABC", 5), (3, "ODR3", "XYZ", 7)])
+# ODR1 unchanged but renumbered, ODR2 changed, ODR3 cleared, ODR4 new
+NEW = snapshot([(1, "ODR2", "ABC", 2), (2, "ODR1", "ABC", 10), (3, "ODR4", "XYZ", 1)])
+
+
+def by_key(delta):
+    return {row["ODR No"]: row for _, row in delta.iterrows()}
+
+
+def test_diff_snapshots():
+    delta = by_key(diff_snapshots(OLD, NEW))
+    assert {key: row[CHANGE_COLUMN] for key, row in delta.items()} == {
+        "ODR2": "changed", "ODR3": "removed", "ODR4": "added",
+    }
+    # Changed rows are as they are now, removed ones as they were
+    assert delta["ODR2"]["Wagons Outstanding"] == 2
+    assert delta["ODR2"][CHANGED_FIELDS_COLUMN] == "Wagons Outstanding"
+    assert delta["ODR3"]["Wagons Outstanding"] == 7
+
+
+def test_diff_identical_snapshots_is_empty():
+    delta = diff_snapshots(OLD, OLD.copy())
+    assert delta.empty
+    assert {CHANGE_COLUMN, CHANGED_FIELDS_COLUMN} <= set(delta.columns)
+
+
+def test_diff_compares_numbers_as_numbers():
+    # The outer merge turns ints into floats; 10 and 10.0 are not a change
+    assert diff_snapshots(OLD, OLD.astype({"Wagons Outstanding": "float64"})).empty
+
+
+def test_find_key_columns():
+    assert find_key_columns(NEW) == ["ODR No"]
+    with pytest.raises(ValueError):
+        find_key_columns(pd.DataFrame({"Station": ["ABC"]}))
+
+
+def test_snapshot_store(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    assert store.add("ODR_RK_OTSG", "ECO", None, OLD) is None
+    delta = store.add("ODR_RK_OTSG", "ECO", None, NEW)
+    assert len(delta) == 3
+    pd.testing.assert_frame_equal(store.latest("ODR_RK_OTSG", "ECO"), NEW)
+
+    # Snapshots taken within the same second don't overwrite each other
+    store.add("ODR_RK_OTSG", "ECO", None, OLD)
+    deltas = store.read_deltas("ODR_RK_OTSG", "ECO")
+    assert deltas["snapshot"].nunique() == 2 and len(deltas) == 6
+
+
+def test_read_deltas_since(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    for second, df in enumerate((OLD, NEW, OLD)):
+        store.add("ODR_RK_OTSG", "ECO", None, df, when=datetime(2024, 1, 31, 10, 0, second, tzinfo=timezone.utc))
+    assert store.read_deltas("ODR_RK_OTSG", "ECO", since="20240131T100001")["snapshot"].unique().tolist() == [
+        "20240131T100002000000",
+    ]
+
+
+class KeylessSec(HttpExtractor):
+    """SEC's table comes back without its ODR No column."""
+
+    def extract(self, captcha_text, **kwargs):
+        df = super().extract(captcha_text, **kwargs)
+        return df.drop(columns=["ODR No"]) if self.labels["zone"] == "SEC" else df
+
+
+def test_snapshot_without_a_key_is_not_stored(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.add("ODR_RK_OTSG", "ECO", None, OLD.drop(columns=["ODR No"]))
+    assert store.latest("ODR_RK_OTSG", "ECO") is None
+
+
+def test_harvest_cycle_survives_a_bad_combo(replay, tmp_path):
+    server = replay()
+    store = SnapshotStore(str(tmp_path))
+    harvester = Harvester([("ODR_RK_OTSG", zone, None) for zone in ("SEC", "ECO")],
+                          lambda: KeylessSec(server.form_url), store=store, solver=lambda image, job: CAPTCHA)
+    assert list(harvester.run_once()) == [("ODR_RK_OTSG", "ECO", None)]
+    assert len(store.latest("ODR_RK_OTSG", "ECO")) == ROWS
+    assert store.latest("ODR_RK_OTSG", "SEC") is None
+    summary = harvester.history[-1]["summary"].set_index("zone")
+    assert summary.loc["SEC", "status"] == "failed"
@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+try:
+    import duckdb
+except ImportError:
+    pass
+
+from fois_parser import parse_fois_table
+from fois_replay import sample_results_html
+from history import HAS_DUCKDB, HistoryStore
+
+pytestmark = pytest.mark.skipif(not HAS_DUCKDB, reason="the history queries need DuckDB")
+
+MORNING = datetime(2024, 1, 30, 9, 0)
+EVENING = datetime(2024, 1, 30, 18, 0)
+NEXT_DAY = datetime(2024, 1, 31, 9, 0)
+
+
+def results(rows):
+    return pd.DataFrame(rows, columns=["S.No", "Zone", "Station", "ODR No", "ODR Date", "Wagons"]).assign(
+        **{"ODR Date": lambda df: pd.to_datetime(df["ODR Date"])}
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append(results([
+        (1, "ECO", "ABC", "ODR1", "2024-01-20", 5),
+        (2, "ECO", "ABC", "ODR2", "2024-01-25", 3),
+        (3, "ECO", "XYZ", "ODR3", "2024-01-01", 8),
+    ]), "ODR_RK_OTSG", "ECO", captured_at=MORNING)
+    # XYZ cleared its ODR in the evening; ABC got a new one
+    store.append(results([
+        (1, "ECO", "ABC", "ODR1", "2024-01-20", 5),
+        (2, "ECO", "ABC", "ODR4", "2024-01-30", 2),
+    ]), "ODR_RK_OTSG", "ECO", captured_at=EVENING)
+    store.append(results([
+        (1, "SEC", "DEF", "ODR9", "2024-01-29", 1),
+    ]), "ODR_RK_OTSG", "SEC", captured_at=NEXT_DAY)
+    return store
+
+
+def test_append_normalises_columns(store):
+    columns = store.columns()
+    assert {"station", "odr_no", "odr_date", "row_zone", "zone", "captured_at", "capture_date"} <= set(columns)
+    assert store.stats()["files"] == 3
+
+
+def test_counts_use_the_latest_capture(store):
+    counts = store.counts(by="station")
+    assert dict(zip(counts["station"], counts["rows"])) == {"ABC": 2, "DEF": 1}
+
+
+def test_dimension_filters_apply_after_the_latest_capture(store):
+    # XYZ had rows only in an older capture, so it has none now
+    assert store.counts(by="station", station="XYZ").empty
+    assert store.counts(by="station", station="ABC")["rows"].tolist() == [2]
+    assert store.trend(by="station", station="XYZ")["rows"].tolist() == []
+
+
+def test_capture_filters(store):
+    counts = store.counts(by="zone", zones=["ECO"])
+    assert counts["rows"].tolist() == [2]
+    assert store.counts(by="zone", until="2024-01-30")["zone"].tolist() == ["ECO"]
+
+
+def test_ageing(store):
+    ageing = store.ageing(by="station", zones=["ECO"])
+    abc = ageing.set_index("station").loc["ABC"]
+    # ODR1 raised on the 20th, ODR4 on the 30th, captured on the 30th
+    assert abc["max_age_days"] == 10
+    assert abc["0-7d"] == 1 and abc["8-15d"] == 1
+
+
+def test_trend(store):
+    trend = store.trend(by="zone")
+    assert [(str(day)[:10], zone, rows) for day, zone, rows in trend.itertuples(index=False)] == [
+        ("2024-01-30", "ECO", 2), ("2024-01-31", "SEC", 1),
+    ]
+
+
+def test_outstanding(store):
+    outstanding = store.outstanding().set_index("key")
+    assert outstanding.loc["ODR1", "captures"] == 2
+    assert outstanding.loc["ODR3", "last_seen"] == pd.Timestamp(MORNING)
+    assert set(store.outstanding(station="ABC")["key"]) == {"ODR1", "ODR2", "ODR4"}
+
+
+def test_compact_keeps_the_rows(store):
+    before = store.sql("SELECT count(*) AS n FROM history")["n"].iloc[0]
+    # SEC's partition has a single file, which is left as it is
+    assert store.compact(before=datetime(2024, 2, 1)) == 2
+    assert store.stats()["files"] == 2
+    assert store.sql("SELECT count(*) AS n FROM history")["n"].iloc[0] == before
+    assert store.counts(by="station")["rows"].sum() == 3
+
+
+def test_parsed_results_round_trip(tmp_path):
+    df = parse_fois_table(sample_results_html("ODR_RK_OTSG", "NR", rows=100))
+    store = HistoryStore(str(tmp_path))
+    store.append(df, "ODR_RK_OTSG", "NR")
+    assert store.counts(by="commodity")["rows"].sum() == 100
+    assert store.ageing(by="zone")["rows"].tolist() == [100]
+
+
+def test_empty_store(tmp_path):
+    assert HistoryStore(str(tmp_path)).counts().empty
+
+
+def test_sql_cannot_reach_outside_the_store(store, tmp_path_factory):
+    outside = tmp_path_factory.mktemp("outside")
+    assert store.sql("SELECT count(*) AS n FROM history")["n"].iloc[0] == 6
+    for query in ("SELECT * FROM read_csv('/etc/passwd')",
+                  f"COPY (SELECT 1) TO '{outside / 'x.csv'}'",
+                  "INSTALL httpfs",
+                  "SET enable_external_access = true"):
+        with pytest.raises(duckdb.Error):
+            store.sql(query)
+    assert not list(outside.iterdir())
+
+
+def test_sql_select_only(store):
+    assert store.sql("WITH z AS (SELECT DISTINCT zone FROM history) SELECT * FROM z", select_only=True)["zone"].size == 2
+    for query in ("COPY (SELECT 1) TO 'x.csv'", "SELECT 1; SELECT 2", "CREATE TABLE t AS SELECT 1"):
+        with pytest.raises(ValueError):
+            store.sql(query, select_only=True)
@@ -0,0 +1,57 @@
+import time
+
+from conftest import CAPTCHA, ROWS
+from extractors import HttpExtractor
+from jobs import JobExecutor
+
+
+def finished(executor, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    job = executor.get(job_id)
+    while not job.done:
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+    return job
+
+
+def loaded(server):
+    extractor = HttpExtractor(server.form_url)
+    extractor.load("ODR_RK_OTSG", "ECO")
+    return extractor
+
+
+def test_extracts_in_the_background(replay):
+    server = replay()
+    executor = JobExecutor(max_workers=2)
+    job = finished(executor, executor.submit(loaded(server), CAPTCHA))
+    assert (job.status, job.rows, job.extractor) == ("done", ROWS, None)
+
+
+def test_server_error_loads_the_retry_captcha(replay):
+    server = replay(error_rate=1.0)
+    executor = JobExecutor(max_retries=1)
+    job = finished(executor, executor.submit(loaded(server), CAPTCHA))
+    assert (job.status, job.retries) == ("server error", 1)
+    assert job.captcha_image.startswith(b"\x89PNG")
+
+    # The page takes the extractor back and answers the new CAPTCHA
+    server.error_rate = 0.0
+    extractor = executor.take_extractor(job.id)
+    retry = finished(executor, executor.submit(extractor, CAPTCHA, retries=job.retries))
+    assert (retry.status, retry.rows) == ("done", ROWS)
+
+
+def test_untaken_retry_gives_its_extractor_back(replay):
+    server = replay()
+    executor = JobExecutor(retry_timeout=0.3)
+    extractor = loaded(server)
+    job = finished(executor, executor.submit(extractor, "WRONG"))
+    assert job.status == "captcha rejected" and job.extractor is extractor
+
+    time.sleep(0.4)
+    executor.jobs()
+    assert job.extractor is None and job.captcha_image is None
+    assert "not answered" in job.error
+    # Closed, so its session no longer holds the form
+    assert extractor.form is None
+    assert executor.take_extractor(job.id) is None
@@ -0,0 +1,87 @@
+import io
+
+import pandas as pd
+
+from conftest import CAPTCHA, ROWS
+from extractors import HttpExtractor
+from fois_parser import RowFeed, parse_fois_table
+from fois_replay import Recorder, results_name, sample_results_html
+
+
+def record(replay, directory, query_type="ODR_RK_OTSG", zone="ECO", period=None):
+    """Runs one query against the stand-in with a Recorder; returns the saved results page."""
+    server = replay()
+    extractor = HttpExtractor(server.form_url, recorder=Recorder(str(directory)))
+    extractor.load(query_type, zone, period)
+    extractor.extract(CAPTCHA)
+    return directory / "results" / results_name(query_type, zone, period)
+
+
+def test_parses_recorded_page(replay, tmp_path):
+    path = record(replay, tmp_path)
+    assert (tmp_path / "form.html").exists() and (tmp_path / "captcha.png").exists()
+
+    df = parse_fois_table(path.read_text(encoding="utf-8"))
+    assert len(df) == ROWS
+    # The title table before the results is skipped
+    assert df.columns[0] == "S.No"
+    assert pd.api.types.is_datetime64_any_dtype(df["ODR Date"])
+    assert isinstance(df["Station"].dtype, pd.CategoricalDtype)
+    assert df["Wagons Outstanding"].dtype == "int64"
+
+
+def test_recorded_page_replays_the_same(replay, tmp_path):
+    path = record(replay, tmp_path, "MATURED_INDENTS", "SEC", "7")
+    expected = parse_fois_table(path.read_text(encoding="utf-8"))
+
+    # A server over the recording answers with the recorded page
+    server = replay(str(tmp_path), rows=1)
+    extractor = HttpExtractor(server.form_url)
+    extractor.load("MATURED_INDENTS", "SEC", "7")
+    pd.testing.assert_frame_equal(extractor.extract(CAPTCHA), expected)
+
+
+def test_sources_and_chunk_sizes_agree():
+    html = sample_results_html("ODR_RK_OTSG", "NR", rows=300)
+    expected = parse_fois_table(html)
+    for source in (html.encode("utf-8"), io.StringIO(html), [html[:1000], html[1000:]]):
+        pd.testing.assert_frame_equal(parse_fois_table(source, chunk_size=257), expected)
+
+
+def test_no_table():
+    assert parse_fois_table("<html><body><p>Invalid Captcha</p></body></html>") is None
+
+
+def test_multi_level_header_colspan_and_totals():
+    html = """<table>
+        <tr><th>Station</th><th colspan="2">Wagons</th></tr>
+        <tr><th></th><th>Demanded</th><th>Outstanding</th></tr>
+        <tr><td>ABC</td><td>10</td><td>4</td></tr>
+        <tr><td>XYZ</td><td>3</td><td></td></tr>
+        <tr><td>Grand Total</td><td>13</td><td>4</td></tr>
+    </table>"""
+    df = parse_fois_table(html)
+    assert list(df.columns) == ["Station", "Wagons Demanded", "Wagons Outstanding"]
+    assert list(df["Station"]) == ["ABC", "XYZ"]
+    assert df["Wagons Demanded"].dtype == "int64"
+    # Blanks make a nullable integer column, not floats
+    assert df["Wagons Outstanding"].dtype == "Int64"
+    assert df["Wagons Outstanding"].isna().sum() == 1
+
+
+def test_colspan_in_data_rows():
+    html = """<table><tr><th>A</th><th>B</th><th>C</th></tr>
+        <tr><td colspan="2">x</td><td>1</td></tr></table>"""
+    df = parse_fois_table(html, typed=False)
+    assert df.iloc[0].tolist() == ["x", "x", "1"]
+
+
+def test_row_feed_streams_every_row():
+    html = sample_results_html("ODR_RK_OTSG", "ECO", rows=3000)
+    batches = []
+    feed = RowFeed(lambda columns, rows: batches.append((columns, rows)))
+    df = parse_fois_table(html, chunk_size=4096, progress=feed)
+    assert len(batches) > 1
+    assert sum(len(rows) for _, rows in batches) == len(df) == 3000
+    assert batches[0][0] == list(df.columns)
+    assert batches[0][1][0][df.columns.get_loc("ODR No")] == df["ODR No"].iloc[0]
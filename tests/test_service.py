@@ -0,0 +1,115 @@
+import io
+import multiprocessing
+import time
+
+import pandas as pd
+import pytest
+
+from conftest import CAPTCHA, ROWS
+from fois_replay import start_server as start_replay
+from history import HAS_DUCKDB, HistoryStore
+from service import (
+    ExtractionService, LocalBroker, ServiceClient, ServiceError, start_server, start_workers, stop_workers,
+)
+
+
+@pytest.fixture(scope="module")
+def service(tmp_path_factory):
+    """A service with one worker process, against a stand-in with slow results pages."""
+    replay = start_replay(captcha_answer=CAPTCHA, rows=ROWS, delay=0.3)
+    history_dir = str(tmp_path_factory.mktemp("history"))
+    settings = {"url": replay.form_url, "captcha_timeout": 30, "max_retries": 0, "cache_dir": None,
+                "history_dir": history_dir}
+    broker = LocalBroker()
+    stop = multiprocessing.get_context("spawn").Event()
+    workers = start_workers(broker, 1, settings, stop)
+    server = start_server(ExtractionService(broker), token="secret")
+    client = ServiceClient(server.url, token="secret", timeout=10)
+
+    deadline = time.time() + 60
+    while not client.health()["workers"]:
+        assert time.time() < deadline, "the worker did not start"
+        time.sleep(0.2)
+    yield client, broker, history_dir
+
+    stop_workers(workers, stop)
+    server.shutdown()
+    broker.close()
+    replay.shutdown()
+
+
+def test_round_trip(service):
+    client, broker, history_dir = service
+    job_id = client.submit("ODR_RK_OTSG", "ECO")
+    images = []
+
+    def solve(image, state):
+        images.append(image)
+        return CAPTCHA
+
+    state = client.wait(job_id, solve=solve, poll=0.1, timeout=60)
+    assert (state["status"], state["rows"], state["attempts"]) == ("done", ROWS, 1)
+    assert images and images[0].startswith(b"\x89PNG")
+
+    df = client.dataframe(job_id)
+    assert len(df) == ROWS and "ODR No" in df.columns
+    csv = pd.read_csv(io.BytesIO(client.result(job_id, "csv")))
+    assert csv["ODR No"].tolist() == df["ODR No"].tolist()
+    assert job_id in {job["id"] for job in client.jobs()}
+    if HAS_DUCKDB:
+        assert HistoryStore(history_dir).counts(by="zone", zones=["ECO"])["rows"].tolist() == [ROWS]
+
+
+def test_wrong_answer_gets_a_new_captcha(service):
+    client = service[0]
+    job_id = client.submit("MATURED_INDENTS", "SEC", "15")
+    answers = iter(["WRONG", CAPTCHA])
+    state = client.wait(job_id, solve=lambda image, state: next(answers), poll=0.1, timeout=60)
+    assert (state["status"], state["attempts"], state["period"]) == ("done", 2, "15")
+
+
+def test_cancel_while_awaiting_captcha(service):
+    client = service[0]
+    job_id = client.submit("ODR_RK_OTSG", "WR")
+    deadline = time.time() + 30
+    while client.status(job_id)["status"] != "awaiting captcha":
+        assert time.time() < deadline
+        time.sleep(0.1)
+    assert client.captcha(job_id).startswith(b"\x89PNG")
+
+    client.cancel(job_id)
+    state = client.wait(job_id, poll=0.1, timeout=30)
+    assert state["status"] == "cancelled"
+    with pytest.raises(ServiceError) as error:
+        client.result(job_id)
+    assert error.value.status == 404
+
+
+def test_bad_requests(service):
+    client = service[0]
+    for call, status in ((lambda: client.submit("ODR_RK_OTSG", "XX"), 400),
+                         (lambda: client.status("nope"), 404),
+                         (lambda: ServiceClient(client.base_url, token="").health(), 401)):
+        with pytest.raises(ServiceError) as error:
+            call()
+        assert error.value.status == status
+
+
+def test_job_of_a_dead_worker_fails():
+    broker = LocalBroker()
+    try:
+        service = ExtractionService(broker, heartbeat_timeout=0.3)
+        job_id = service.submit("ODR_RK_OTSG", "ECO")["id"]
+        broker.heartbeat("gone-1")
+        broker.update(job_id, status="awaiting captcha", worker="gone-1")
+        broker.put("captcha", job_id, b"png")
+        assert service.status(job_id)["status"] == "awaiting captcha"
+
+        # No heartbeat from gone-1 any more
+        time.sleep(0.4)
+        state = service.status(job_id)
+        assert state["status"] == "failed" and "gone-1" in state["error"]
+        with pytest.raises(ServiceError):
+            service.captcha(job_id)
+    finally:
+        broker.close()